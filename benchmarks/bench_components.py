@@ -0,0 +1,184 @@
+"""
+元件微基準測試（pytest-benchmark）
+分別量測標籤繪製（PIL 與 NumPy 版）、圖片解碼、偵測後處理與藥品資料查詢，讓單一階段的退步可以獨立發現
+
+用法:
+    pytest benchmarks/bench_components.py --benchmark-only
+    pytest benchmarks/bench_components.py --benchmark-only -k draw --benchmark-cprofile=tottime
+    pytest benchmarks/bench_components.py --benchmark-autosave      # 儲存結果
+    pytest benchmarks/bench_components.py --benchmark-compare       # 與上次儲存的結果比較
+"""
+import base64
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from offline_env import (  # noqa: E402
+    STUB_CLASS_NAMES,
+    STUB_MODEL_NAME,
+    StubYOLO,
+    create_sqlite_drug_db,
+    import_analyzer,
+    make_pill_image,
+)
+from modules import image_decode, label_renderer  # noqa: E402
+
+IMAGE_SIZES = [(640, 480), (2016, 1512), (4032, 3024)]
+DETECTION_COUNTS = [1, 10, 50]
+
+
+def _size_id(size):
+    return f"{size[0]}x{size[1]}"
+
+
+@pytest.fixture(scope="module")
+def analyzer():
+    return import_analyzer()
+
+
+@pytest.fixture(scope="module")
+def sqlite_catalog():
+    import db_cloud_sql
+
+    previous_pool = db_cloud_sql.db_pool
+    db_cloud_sql.db_pool = create_sqlite_drug_db()
+    db_cloud_sql.load_drug_catalog()
+    yield db_cloud_sql
+    db_cloud_sql.db_pool = previous_pool
+
+
+def _fake_detections(count, size):
+    width, height = size
+    stub = StubYOLO(latency_s=0, detections_per_image=count)
+    result = stub.predict(source=Image.new("RGB", size))[0]
+    detections = []
+    for i in range(len(result.boxes)):
+        detections.append({
+            "class_name": STUB_CLASS_NAMES[int(result.boxes.cls[i])],
+            "confidence": float(result.boxes.conf[i]),
+            "bbox": [round(c) for c in result.boxes.xyxy[i].tolist()],
+        })
+    return detections
+
+
+def _render_pil(analyzer, image, detections, pills_info):
+    return analyzer.draw_annotations(image, detections, pills_info, renderer="pil")
+
+
+def _render_numpy(analyzer, image, detections, pills_info):
+    """標籤圖塊快取已暖（同樣的藥品標籤在先前的請求出現過）"""
+    return analyzer.draw_annotations(image, detections, pills_info, renderer="numpy")
+
+
+def _render_numpy_cold(analyzer, image, detections, pills_info):
+    """每次都清空標籤圖塊與文字量測快取，量測最差情況"""
+    label_renderer.label_sprite.cache_clear()
+    label_renderer.fit_label_font.cache_clear()
+    return analyzer.draw_annotations(image, detections, pills_info, renderer="numpy")
+
+
+RENDERERS = {
+    "pil": _render_pil,
+    "numpy": _render_numpy,
+    "numpy_cold": _render_numpy_cold,
+}
+
+
+def _draw_inputs(sqlite_catalog, size, count):
+    """與 API 相同的輸入：解碼後的 BGR 陣列"""
+    image = image_decode.decode_to_array(make_pill_image(*size))
+    return image, _fake_detections(count, size), list(sqlite_catalog.drug_catalog.values())
+
+
+@pytest.mark.parametrize("renderer", list(RENDERERS))
+@pytest.mark.parametrize("count", DETECTION_COUNTS)
+@pytest.mark.parametrize("size", IMAGE_SIZES, ids=_size_id)
+def test_draw_custom_labels(benchmark, analyzer, sqlite_catalog, size, count, renderer):
+    image, detections, pills_info = _draw_inputs(sqlite_catalog, size, count)
+    benchmark(RENDERERS[renderer], analyzer, image, detections, pills_info)
+
+
+@pytest.mark.parametrize("count", DETECTION_COUNTS)
+@pytest.mark.parametrize("size", IMAGE_SIZES, ids=_size_id)
+def test_renderers_equivalent(analyzer, sqlite_catalog, size, count):
+    """NumPy 版與 PIL 版的輸出只允許 alpha 混合的捨入誤差"""
+    image, detections, pills_info = _draw_inputs(sqlite_catalog, size, count)
+    expected = np.asarray(_render_pil(analyzer, image, detections, pills_info))[:, :, ::-1].astype(np.int16)
+    actual = _render_numpy(analyzer, image, detections, pills_info).astype(np.int16)
+    diff = np.abs(expected - actual)
+    assert diff.max() <= 2
+    assert diff.mean() < 0.01
+    # 原圖不應被修改
+    assert np.array_equal(image, image_decode.decode_to_array(make_pill_image(*size)))
+
+
+def _decode_pil_legacy(image_b64):
+    """舊的解碼流程：base64 -> PIL -> 載入 -> RGB，模型推論前還要再轉成 BGR 陣列"""
+    image_pil = Image.open(io.BytesIO(base64.b64decode(image_b64)))
+    image_pil.load()
+    if image_pil.mode in ("RGBA", "LA", "P"):
+        image_pil = image_pil.convert("RGB")
+    return np.ascontiguousarray(np.asarray(image_pil)[:, :, ::-1])
+
+
+def _decode_to_array(image_b64):
+    """目前的解碼流程：base64 -> BGR 陣列（OpenCV imdecode）"""
+    return image_decode.decode_to_array(base64.b64decode(image_b64))
+
+
+def _decode_pil_fallback(image_b64):
+    """未安裝 OpenCV 時的解碼流程（含 EXIF 方向）"""
+    return image_decode._decode_with_pil(base64.b64decode(image_b64))
+
+
+DECODERS = {
+    "pil_legacy": _decode_pil_legacy,
+    "opencv": _decode_to_array,
+    "pil_fallback": _decode_pil_fallback,
+}
+
+
+@pytest.mark.parametrize("decoder", list(DECODERS))
+@pytest.mark.parametrize("size", IMAGE_SIZES, ids=_size_id)
+def test_base64_decode_convert(benchmark, size, decoder):
+    """解碼到可直接交給模型的 BGR 陣列為止的成本"""
+    image_b64 = base64.b64encode(make_pill_image(*size)).decode("ascii")
+    image = benchmark(DECODERS[decoder], image_b64)
+    assert image.shape == (size[1], size[0], 3)
+
+
+class _CachedResultModel:
+    """固定回傳同一份預測結果的模型，讓量測只涵蓋 detect_pills 的後處理"""
+
+    def __init__(self, count):
+        stub = StubYOLO(latency_s=0, detections_per_image=count)
+        self.names = stub.names
+        self._results = stub.predict(source=Image.new("RGB", (1280, 960)), conf=0)
+
+    def predict(self, source=None, **kwargs):
+        return self._results
+
+
+@pytest.mark.parametrize("count", [10, 100, 300])
+def test_detect_pills_postprocess(benchmark, analyzer, sqlite_catalog, count):
+    model = _CachedResultModel(count)
+    previous = analyzer.loaded_models.get(STUB_MODEL_NAME)
+    analyzer.loaded_models[STUB_MODEL_NAME] = model
+    analyzer.rebuild_class_bindings()
+    try:
+        result = benchmark(analyzer.detect_pills, STUB_MODEL_NAME, Image.new("RGB", (1280, 960)))
+        assert len(result["detections"]) == count
+    finally:
+        analyzer.loaded_models[STUB_MODEL_NAME] = previous
+
+
+@pytest.mark.parametrize("count", [1, 10, 50])
+def test_get_pills_details_by_ids(benchmark, sqlite_catalog, count):
+    class_names = list(STUB_CLASS_NAMES.values())
+    drug_ids = [class_names[i % len(class_names)] for i in range(count)]
+    benchmark(sqlite_catalog.get_pills_details_by_ids, drug_ids, STUB_MODEL_NAME)
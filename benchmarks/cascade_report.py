@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+兩階段串接偵測對照報告（離線）
+對同一組圖片分別以單次推論（detect_pills）與兩階段串接（detect_pills_cascade）偵測，列出延遲與準確度；
+可另外列出指定推論尺寸的單次推論（--single-imgsz，例如 1280 或 auto）作為高解析度的對照：
+有標註（YOLO 格式的 txt）時計算 IoU >= 0.5 且類別相同的 precision / recall；
+沒有標註時以單次推論的結果為基準，計算串接偵測找回的比例與類別一致率
+
+用法:
+    python benchmarks/cascade_report.py                       # 假模型 + 合成照片（只驗證流程與相對延遲）
+    python benchmarks/cascade_report.py --model models/YOLOv12.pt --images data/val/images --labels data/val/labels
+    python benchmarks/cascade_report.py --single-imgsz 1280 auto
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import percentile  # noqa: E402
+from offline_env import (  # noqa: E402
+    STUB_MODEL_NAME,
+    StubYOLO,
+    create_sqlite_drug_db,
+    import_analyzer,
+    make_pill_image,
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+MATCH_IOU = 0.5
+
+
+def load_images(args, image_decode):
+    """回傳 [(名稱, BGR 陣列)]；未指定 --images 時產生合成照片"""
+    if not args.images:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        return [
+            (f"synthetic_{i}", image_decode.decode_to_array(make_pill_image(width, height, pills=args.detections, seed=i)))
+            for i in range(args.count)
+        ]
+    names = sorted(f for f in os.listdir(args.images) if f.lower().endswith(IMAGE_EXTENSIONS))[:args.count]
+    images = []
+    for name in names:
+        with open(os.path.join(args.images, name), "rb") as f:
+            images.append((name, image_decode.decode_to_array(f.read())))
+    return images
+
+
+def load_labels(labels_dir, name, image):
+    """讀取 YOLO 格式標註（class cx cy w h，0～1），回傳 [(class_id, [x0, y0, x1, y1])]；沒有標註檔時回傳 None"""
+    path = os.path.join(labels_dir, os.path.splitext(name)[0] + ".txt")
+    if not os.path.exists(path):
+        return None
+    height, width = image.shape[:2]
+    labels = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            cx, cy, w, h = (float(v) for v in parts[1:5])
+            labels.append((int(parts[0]), [(cx - w / 2) * width, (cy - h / 2) * height,
+                                           (cx + w / 2) * width, (cy + h / 2) * height]))
+    return labels
+
+
+def count_matches(detections, references):
+    """依信心度貪婪配對：IoU >= MATCH_IOU 且類別相同才算吻合，回傳 (吻合數, 位置吻合但類別不同的數量)"""
+    from modules.tracking import iou_matrix
+
+    if not detections or not references:
+        return 0, 0
+    detections = sorted(detections, key=lambda det: -det["confidence"])
+    ious = iou_matrix([det["bbox"] for det in detections], [box for _, box in references])
+    used = np.zeros(len(references), dtype=bool)
+    matched = class_mismatch = 0
+    for i, det in enumerate(detections):
+        candidates = np.flatnonzero((ious[i] >= MATCH_IOU) & ~used)
+        if not len(candidates):
+            continue
+        j = candidates[np.argmax(ious[i, candidates])]
+        used[j] = True
+        if references[j][0] == det["class_id"]:
+            matched += 1
+        else:
+            class_mismatch += 1
+    return matched, class_mismatch
+
+
+def run_mode(detect, model_name, image, repeat):
+    """執行 repeat 次，回傳 (最後一次的偵測結果, 每次耗時秒數)"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = detect(model_name, image)
+        samples.append(time.perf_counter() - start)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result["detections"], samples
+
+
+def summarize(samples, detections_total, matched, mismatch, reference_total):
+    samples = sorted(samples)
+    summary = {
+        "median_ms": round(statistics.median(samples) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "detections": detections_total,
+    }
+    if reference_total is not None:
+        summary.update({
+            "matched": matched,
+            "class_mismatch": mismatch,
+            "precision": round(matched / detections_total, 4) if detections_total else None,
+            "recall": round(matched / reference_total, 4) if reference_total else None,
+        })
+    return summary
+
+
+def load_model(analyzer, args):
+    """載入真實模型或假模型並建立類別綁定，回傳模型名稱"""
+    if args.model:
+        model = analyzer._get_yolo_class()(args.model)
+        model_name = os.path.basename(args.model)
+    else:
+        model = StubYOLO(latency_s=args.inference_latency_ms / 1000.0, detections_per_image=args.detections)
+        model_name = STUB_MODEL_NAME
+    analyzer.loaded_models[model_name] = model
+    analyzer.rebuild_class_bindings()
+    return model_name
+
+
+def run_report(args):
+    logging.disable(logging.INFO)
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyzer = import_analyzer()
+        import db_cloud_sql
+
+        db_cloud_sql.db_pool = create_sqlite_drug_db()
+        db_cloud_sql.load_drug_catalog()
+        model_name = load_model(analyzer, args)
+    from modules import cascade, image_decode, inference_params
+
+    modes = {"single": analyzer.detect_pills, "cascade": analyzer.detect_pills_cascade}
+    for imgsz in args.single_imgsz:
+        modes[f"single@{imgsz}"] = functools.partial(analyzer.detect_pills, options={"imgsz": imgsz})
+    images = load_images(args, image_decode)
+    # 暖身（模型初始化與第一次配置記憶體不列入統計）
+    for detect in modes.values():
+        detect(model_name, images[0][1])
+
+    samples = {mode: [] for mode in modes}
+    totals = {mode: {"detections": 0, "matched": 0, "mismatch": 0} for mode in modes}
+    reference_total = 0
+    has_labels = bool(args.labels)
+    for name, image in images:
+        outputs = {}
+        for mode, detect in modes.items():
+            outputs[mode], times = run_mode(detect, model_name, image, args.repeat)
+            samples[mode].extend(times)
+        # 有標註時與標註比較；否則以單次推論結果為基準
+        if has_labels:
+            references = load_labels(args.labels, name, image)
+            if references is None:
+                continue
+        else:
+            references = [(det["class_id"], det["bbox"]) for det in outputs["single"]]
+        reference_total += len(references)
+        for mode, detections in outputs.items():
+            matched, mismatch = count_matches(detections, references)
+            totals[mode]["detections"] += len(detections)
+            totals[mode]["matched"] += matched
+            totals[mode]["mismatch"] += mismatch
+
+    results = {
+        mode: summarize(samples[mode], totals[mode]["detections"], totals[mode]["matched"],
+                        totals[mode]["mismatch"], reference_total)
+        for mode in modes
+    }
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "model": args.model or "stub",
+            "inference_latency_ms": None if args.model else args.inference_latency_ms,
+            "images": len(images),
+            "image_source": args.images or f"synthetic {args.size}",
+            "reference": "labels" if has_labels else "single-pass detections",
+            "repeat": args.repeat,
+            "single_imgsz": inference_params.DEFAULT_IMGSZ,
+            "cascade": {
+                "locate_imgsz": cascade.LOCATE_IMGSZ,
+                "locate_conf": cascade.LOCATE_CONF,
+                "crop_imgsz": cascade.CROP_IMGSZ,
+                "crop_padding": cascade.CROP_PADDING,
+            },
+        },
+        "results": results,
+    }
+
+
+def print_report(report):
+    print(f"參考基準: {report['meta']['reference']}（{report['meta']['images']} 張圖片）")
+    print(f"{'mode':<13}{'median_ms':>11}{'p95_ms':>9}{'dets':>7}{'matched':>9}{'cls_diff':>10}"
+          f"{'precision':>11}{'recall':>8}")
+    for mode, row in report["results"].items():
+        print(f"{mode:<13}{row['median_ms']:>11}{row['p95_ms']:>9}{row['detections']:>7}{row.get('matched', '-'):>9}"
+              f"{row.get('class_mismatch', '-'):>10}{str(row.get('precision', '-')):>11}{str(row.get('recall', '-')):>8}")
+
+
+def parse_imgsz(value):
+    return value if value.lower() == "auto" else int(value)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="單次推論與兩階段串接偵測的延遲 / 準確度對照")
+    parser.add_argument("--model", default=None, help="真實 YOLO 模型路徑（預設使用假模型）")
+    parser.add_argument("--images", default=None, help="圖片目錄（預設產生合成照片）")
+    parser.add_argument("--labels", default=None, help="YOLO 格式標註目錄（檔名與圖片相同、副檔名 .txt）")
+    parser.add_argument("--count", type=int, default=10, help="最多使用的圖片數")
+    parser.add_argument("--size", default="4032x3024", help="合成照片尺寸")
+    parser.add_argument("--detections", type=int, default=10, help="合成照片的藥丸數 / 假模型每張的偵測數")
+    parser.add_argument("--inference-latency-ms", type=float, default=30.0, help="假模型在 640x640 的推論延遲")
+    parser.add_argument("--single-imgsz", nargs="*", default=[], type=parse_imgsz,
+                        help="另外列出以這些推論尺寸單次推論的結果（整數或 auto）")
+    parser.add_argument("--repeat", type=int, default=3, help="每張圖片每種模式的重複次數")
+    parser.add_argument("--output", default=None, help="JSON 報告輸出路徑")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_report(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"報告已寫入: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+冷啟動時間報告
+在全新的子行程中量測：
+1. `python -X importtime -c "import fastapi_app"` 的匯入耗時，依頂層套件彙整
+2. 執行 startup 事件（模型載入、資料庫、藥品目錄、暖機）的各階段耗時
+可與先前的報告比較，總耗時退步超過門檻時以非零狀態結束
+
+用法:
+    python benchmarks/cold_start.py                       # 使用 env.yaml 與真實模型
+    python benchmarks/cold_start.py --offline             # 假模型 + SQLite，不需要雲端資源
+    python benchmarks/cold_start.py --offline --output cold.json --baseline baseline_cold.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+DEFAULT_REGRESSION_THRESHOLD = 20.0
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+# 在子行程中執行 startup 事件並輸出各階段耗時
+_STARTUP_SCRIPT = """
+import asyncio, contextlib, io, json, logging, os, sys
+offline = {offline!r}
+logging.disable(logging.INFO)
+with contextlib.redirect_stdout(io.StringIO()):
+    if offline:
+        sys.path.insert(0, {bench_dir!r})
+        from offline_env import setup_offline_app
+        app_module, _ = setup_offline_app(inference_latency_s=0)
+    else:
+        import fastapi_app as app_module
+    asyncio.run(app_module.startup_event())
+from modules import startup_timing
+print(json.dumps(startup_timing.phases_ms()))
+"""
+
+
+def parse_importtime(stderr, top=15):
+    """
+    解析 -X importtime 的輸出，回傳 (總耗時 ms, 各頂層套件的累計耗時 ms)
+    每個套件取最外層那次匯入的累計時間（已包含其子模組）
+    """
+    packages = {}
+    total_us = 0
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        root = name.split(".")[0]
+        packages[root] = max(packages.get(root, 0), int(cumulative_us))
+        if len(indent) <= 1:
+            # 縮排最淺的是頂層匯入，累加即為整體匯入耗時
+            total_us += int(cumulative_us)
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return round(total_us / 1000, 1), {name: round(us / 1000, 1) for name, us in ranked}
+
+
+def measure_import(python):
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", "import fastapi_app"],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"匯入 fastapi_app 失敗:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def measure_startup(python, offline):
+    script = _STARTUP_SCRIPT.format(offline=offline, bench_dir=BENCH_DIR)
+    result = subprocess.run([python, "-c", script], cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"執行 startup 失敗:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_report(args):
+    import_runs = [measure_import(args.python) for _ in range(args.repeat)]
+    startup_runs = [measure_startup(args.python, args.offline) for _ in range(args.repeat)]
+    # 多次執行時取匯入總耗時最短的一次，減少磁碟快取等雜訊
+    import_total_ms, packages = min(import_runs, key=lambda run: run[0])
+    phases = min(startup_runs, key=lambda run: run.get("startup_total", float("inf")))
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "offline": args.offline,
+            "repeat": args.repeat,
+        },
+        "import_total_ms": import_total_ms,
+        "import_by_package_ms": packages,
+        "startup_phases_ms": phases,
+        "cold_start_ms": round(phases.get("import_app", 0) + phases.get("startup_total", 0), 1),
+    }
+
+
+def compare_with_baseline(report, baseline, threshold):
+    """印出與基準報告的差異，回傳冷啟動總耗時是否退步超過門檻"""
+    print(f"\n{'metric':<32}{'baseline':>12}{'current':>12}{'change':>10}")
+    rows = [("cold_start_ms", baseline.get("cold_start_ms"), report["cold_start_ms"]),
+            ("import_total_ms", baseline.get("import_total_ms"), report["import_total_ms"])]
+    for name, value in report["startup_phases_ms"].items():
+        rows.append((name, baseline.get("startup_phases_ms", {}).get(name), value))
+    for name, old, new in rows:
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        flag = " !" if change > threshold else ""
+        print(f"{name:<32}{old:>12}{new:>12}{change:>+9.1f}%{flag}")
+    old_total = baseline.get("cold_start_ms")
+    return bool(old_total) and (report["cold_start_ms"] - old_total) / old_total * 100 > threshold
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="藥丸檢測 API 冷啟動時間報告")
+    parser.add_argument("--offline", action="store_true", help="使用假模型與 SQLite（不需要雲端資源）")
+    parser.add_argument("--repeat", type=int, default=3, help="重複次數（取最快的一次）")
+    parser.add_argument("--python", default=sys.executable, help="要量測的 Python 直譯器")
+    parser.add_argument("--output", default=None, help="JSON 報告輸出路徑")
+    parser.add_argument("--baseline", default=None, help="要比較的基準報告")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="冷啟動總耗時退步超過此百分比時以非零狀態結束")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_report(args)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"報告已寫入: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare_with_baseline(report, baseline, args.threshold):
+            print(f"\n⚠️ 冷啟動耗時退步超過 {args.threshold}%")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
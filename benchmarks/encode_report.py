@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+標註圖片輸出選項報告（離線）
+對同一張合成藥盤照片與偵測結果，逐一量測各輸出選項（格式 × 品質 × 最長邊 × 縮圖）的
+繪製耗時、編碼耗時與輸出大小；另外列出「全解析度繪製後再縮小」的做法作為對照
+
+用法:
+    python benchmarks/encode_report.py
+    python benchmarks/encode_report.py --size 4032x3024 --detections 20 --repeat 5 --output encode.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from offline_env import (  # noqa: E402
+    STUB_CLASS_NAMES,
+    StubYOLO,
+    create_sqlite_drug_db,
+    import_analyzer,
+    make_pill_image,
+)
+
+FORMATS = {"jpeg": (60, 75, 90), "webp": (60, 75, 90), "png": (None,)}
+MAX_DIMENSIONS = (None, 2048, 1280, 640)
+THUMBNAIL_SIZE = 256
+
+
+def _median_ms(func, repeat):
+    """執行 repeat 次，回傳 (最後一次的結果, 耗時中位數 ms)"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return result, round(statistics.median(samples) * 1000, 2)
+
+
+def _fake_detections(image, count):
+    result = StubYOLO(latency_s=0, detections_per_image=count).predict(source=image)[0]
+    return [
+        {
+            "class_name": STUB_CLASS_NAMES[int(result.boxes.cls[i])],
+            "confidence": float(result.boxes.conf[i]),
+            "bbox": [round(c) for c in result.boxes.xyxy[i].tolist()],
+        }
+        for i in range(len(result.boxes))
+    ]
+
+
+def _option_grid(thumbnail_size):
+    for fmt, qualities in FORMATS.items():
+        for quality in qualities:
+            for max_dimension in MAX_DIMENSIONS:
+                yield {"format": fmt, "quality": quality, "max_dimension": max_dimension, "thumbnail_size": None}
+        # 每種格式以預設品質加測一次縮圖
+        yield {"format": fmt, "quality": qualities[len(qualities) // 2], "max_dimension": None,
+               "thumbnail_size": thumbnail_size}
+
+
+def measure_option(analyzer, image_encode, image, detections, pills_info, options, repeat):
+    """量測一組選項：各版本（full / thumbnail）的繪製耗時、編碼耗時與大小"""
+    options = image_encode.resolve_options(options)
+    rendered, render_ms = _median_ms(
+        lambda: analyzer.render_annotated_variants(image, detections, pills_info, options), repeat
+    )
+    variants = {}
+    for variant, annotated in rendered:
+        data, encode_ms = _median_ms(lambda: image_encode.encode(annotated, options["format"], options["quality"]),
+                                     repeat)
+        width, height = image_encode.image_size(annotated)
+        variants[variant] = {"width": width, "height": height, "encode_ms": encode_ms, "bytes": len(data)}
+    return {"options": options, "render_ms": render_ms, "variants": variants}
+
+
+def measure_downscale_after(analyzer, image_encode, image, detections, pills_info, max_dimension, repeat):
+    """對照組：在全解析度上繪製後再整張縮小（舊做法的延伸）"""
+    size = image_encode.target_size(*image_encode.image_size(image), max_dimension)
+
+    def render():
+        return image_encode.resize(analyzer.draw_annotations(image, detections, pills_info), size)
+
+    annotated, render_ms = _median_ms(render, repeat)
+    data, encode_ms = _median_ms(lambda: image_encode.encode(annotated, "jpeg", 75), repeat)
+    return {"max_dimension": max_dimension, "render_ms": render_ms, "encode_ms": encode_ms, "bytes": len(data)}
+
+
+def run_report(args):
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    logging.disable(logging.INFO)
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyzer = import_analyzer()
+        import db_cloud_sql
+
+        db_cloud_sql.db_pool = create_sqlite_drug_db()
+        db_cloud_sql.load_drug_catalog()
+    from modules import image_decode, image_encode
+
+    image = image_decode.decode_to_array(make_pill_image(width, height, pills=args.detections))
+    detections = _fake_detections(image, args.detections)
+    pills_info = list(db_cloud_sql.drug_catalog.values())
+    # 先繪製一次，讓字型與標籤圖塊快取就緒（與長時間執行的服務相同）
+    analyzer.render_annotated_variants(image, detections, pills_info,
+                                       image_encode.resolve_options({"thumbnail_size": args.thumbnail}))
+
+    results = [
+        measure_option(analyzer, image_encode, image, detections, pills_info, options, args.repeat)
+        for options in _option_grid(args.thumbnail)
+    ]
+    baseline = [
+        measure_downscale_after(analyzer, image_encode, image, detections, pills_info, max_dimension, args.repeat)
+        for max_dimension in MAX_DIMENSIONS if max_dimension
+    ]
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "image_size": [width, height],
+            "detections": len(detections),
+            "repeat": args.repeat,
+            "opencv": image_encode.CV2_AVAILABLE,
+        },
+        "results": results,
+        "downscale_after_render": baseline,
+    }
+
+
+def print_report(report):
+    print(f"{'format':<6}{'quality':>8}{'max_dim':>9}{'variant':>11}{'size':>12}"
+          f"{'render_ms':>11}{'encode_ms':>11}{'kB':>9}")
+    for row in report["results"]:
+        options = row["options"]
+        for variant, info in row["variants"].items():
+            # 繪製耗時是整組選項（含縮圖）的合計，只列在第一行
+            render_ms = row["render_ms"] if variant == "full" else ""
+            print(f"{options['format']:<6}{str(options['quality'] or '-'):>8}"
+                  f"{str(options['max_dimension'] or '-'):>9}{variant:>11}"
+                  f"{info['width']:>6}x{info['height']:<5}{render_ms:>11}{info['encode_ms']:>11}"
+                  f"{info['bytes'] / 1024:>9.1f}")
+    print("\n全解析度繪製後再縮小（JPEG 75）:")
+    print(f"{'max_dim':>9}{'render_ms':>11}{'encode_ms':>11}{'kB':>9}")
+    for row in report["downscale_after_render"]:
+        print(f"{row['max_dimension']:>9}{row['render_ms']:>11}{row['encode_ms']:>11}{row['bytes'] / 1024:>9.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="標註圖片輸出選項的繪製 / 編碼耗時與大小報告")
+    parser.add_argument("--size", default="4032x3024", help="合成圖片尺寸，例如 4032x3024")
+    parser.add_argument("--detections", type=int, default=10, help="偵測框數量")
+    parser.add_argument("--thumbnail", type=int, default=THUMBNAIL_SIZE, help="縮圖最長邊")
+    parser.add_argument("--repeat", type=int, default=3, help="每個選項重複次數（取中位數）")
+    parser.add_argument("--output", default=None, help="JSON 報告輸出路徑")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_report(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"報告已寫入: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
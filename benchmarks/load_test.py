@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+端對端負載測試（離線）
+在同一個行程內啟動 fastapi_app:app，以指定併發量對偵測端點送出合成藥盤圖片，
+輸出各端點 p50/p95/p99 延遲與吞吐量的 JSON 報告，並可與既有基準報告比較
+
+用法:
+    python benchmarks/load_test.py --requests 200 --concurrency 8 --output report.json
+    python benchmarks/load_test.py --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from offline_env import make_corpus, setup_offline_app  # noqa: E402
+
+ENDPOINTS = ["/api/detect", "/api/detect/simple", "/api/detect/upload"]
+# 與基準比較時視為退步的門檻（百分比）
+DEFAULT_REGRESSION_THRESHOLD = 10.0
+
+
+def percentile(sorted_values, pct):
+    """最近秩法百分位數（sorted_values 需已排序）"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, wall_time):
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "mean_ms": _ms(sum(latencies) / len(latencies)) if latencies else None,
+        "max_ms": _ms(latencies[-1]) if latencies else None,
+        "throughput_rps": round(len(latencies) / wall_time, 2) if wall_time > 0 else None,
+        "wall_time_s": round(wall_time, 3),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def _build_request(endpoint, image_bytes, image_b64):
+    if endpoint == "/api/detect/upload":
+        return {"files": {"file": ("pill.jpg", image_bytes, "image/jpeg")}}
+    return {"json": {"image": image_b64}}
+
+
+async def run_endpoint(client, endpoint, corpus, corpus_b64, total_requests, concurrency):
+    """以固定數量的併發 worker 對單一端點送出 total_requests 個請求"""
+    latencies = []
+    errors = 0
+    counter = iter(range(total_requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            kwargs = _build_request(endpoint, corpus[i % len(corpus)], corpus_b64[i % len(corpus)])
+            start = time.perf_counter()
+            try:
+                response = await client.post(endpoint, **kwargs)
+                ok = response.status_code == 200
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run_load_test(args):
+    import httpx
+
+    app_module, workdir = setup_offline_app(
+        workdir=args.workdir,
+        model_path=args.model,
+        inference_latency_s=args.inference_latency_ms / 1000.0,
+        detections_per_image=args.detections,
+        upload_latency_s=args.upload_latency_ms / 1000.0,
+    )
+    await app_module.initialize_models_async()
+
+    corpus = make_corpus(args.corpus_size)
+    corpus_b64 = [base64.b64encode(data).decode("ascii") for data in corpus]
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        for endpoint in args.endpoints:
+            # 暖身請求不列入統計
+            await run_endpoint(client, endpoint, corpus, corpus_b64, args.warmup, 1)
+            results[endpoint] = await run_endpoint(
+                client, endpoint, corpus, corpus_b64, args.requests, args.concurrency
+            )
+
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "model": args.model or "stub",
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "corpus_size": args.corpus_size,
+            "inference_latency_ms": None if args.model else args.inference_latency_ms,
+            "workdir": workdir,
+        },
+        "results": results,
+    }
+
+
+def compare_with_baseline(report, baseline, threshold):
+    """印出與基準報告的差異，回傳是否有端點的 p95 退步超過門檻"""
+    regressed = False
+    print(f"\n{'endpoint':<22}{'metric':<16}{'baseline':>12}{'current':>12}{'change':>10}")
+    for endpoint, current in report["results"].items():
+        base = baseline.get("results", {}).get(endpoint)
+        if not base:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            # 吞吐量越高越好，其他延遲指標越低越好
+            worse = -change if metric == "throughput_rps" else change
+            flag = " !" if worse > threshold else ""
+            if metric == "p95_ms" and worse > threshold:
+                regressed = True
+            print(f"{endpoint:<22}{metric:<16}{old:>12}{new:>12}{change:>+9.1f}%{flag}")
+    return regressed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="藥丸檢測 API 離線負載測試")
+    parser.add_argument("--requests", type=int, default=100, help="每個端點的請求數")
+    parser.add_argument("--concurrency", type=int, default=4, help="併發請求數")
+    parser.add_argument("--warmup", type=int, default=3, help="每個端點的暖身請求數")
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, help="要測試的端點")
+    parser.add_argument("--corpus-size", type=int, default=16, help="合成圖片數量")
+    parser.add_argument("--model", default=None, help="真實 YOLO 模型路徑（預設使用假模型）")
+    parser.add_argument("--inference-latency-ms", type=float, default=30.0, help="假模型的推論延遲")
+    parser.add_argument("--detections", type=int, default=6, help="假模型每張圖片的偵測數量")
+    parser.add_argument("--upload-latency-ms", type=float, default=0.0, help="本地儲存模擬的上傳延遲")
+    parser.add_argument("--workdir", default=None, help="工作目錄（預設建立暫存目錄）")
+    parser.add_argument("--output", default=None, help="JSON 報告輸出路徑")
+    parser.add_argument("--baseline", default=None, help="要比較的基準報告")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="p95 退步超過此百分比時以非零狀態結束")
+    parser.add_argument("--verbose", action="store_true", help="顯示應用程式日誌")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.baseline:
+        args.baseline = os.path.abspath(args.baseline)
+
+    if args.verbose:
+        report = asyncio.run(run_load_test(args))
+    else:
+        logging.disable(logging.INFO)
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = asyncio.run(run_load_test(args))
+        logging.disable(logging.NOTSET)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"報告已寫入: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare_with_baseline(report, baseline, args.threshold):
+            print(f"\n⚠️ p95 延遲退步超過 {args.threshold}%")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
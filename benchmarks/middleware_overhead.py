@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+請求追蹤中介層的每請求成本（離線）
+在同一個事件迴圈內直接呼叫 ASGI 應用（不經過網路與 HTTP 解析，只留下中介層與路由本身的成本），
+以固定併發數連續送出大量請求到一個什麼都不做的端點，比較：
+
+- none：沒有請求追蹤
+- legacy：原本的 @app.middleware("http") 版本（BaseHTTPMiddleware，每個請求都記錄開始 / 完成日誌）
+- asgi：純 ASGI 的 RequestTrackingMiddleware，全部記錄（REQUEST_LOG_SAMPLE_RATE=1）
+- asgi_sampled：純 ASGI 版本，日誌依 --sample-rate 抽樣
+
+每種做法分別量測一般路徑（/api/item）與健康檢查（/health，ASGI 版本預設排除），
+列出吞吐量、每請求平均耗時與相對於 none 的額外成本。日誌照常格式化成 JSON，只是寫到 /dev/null
+
+用法:
+    python benchmarks/middleware_overhead.py
+    python benchmarks/middleware_overhead.py --requests 20000 --concurrency 64 --rounds 5 --output middleware.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import traceback
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request  # noqa: E402
+
+PATHS = ("/api/item", "/health")
+
+
+def _legacy_middleware(logger):
+    """原本的請求追蹤中間件（改寫前的 fastapi_app.request_tracking_middleware）"""
+    from modules import admission, memory, metrics, profiling, tracing
+
+    async def request_tracking_middleware(request: Request, call_next):
+        request_id = str(uuid.uuid4())
+        request.state.request_id = request_id
+        profile_session = None
+        if profiling.is_profiling_requested(request):
+            profile_session = profiling.start_session(request_id)
+        start_time = time.time()
+        admission.start_request(request.url.path, request.headers)
+        memory_start = memory.start_request()
+        logger.info(
+            "Request started",
+            request_id=request_id,
+            method=request.method,
+            url=str(request.url),
+            client_ip=request.client.host if request.client else "unknown"
+        )
+        with tracing.start_span(
+            f"{request.method} {request.url.path}",
+            request_id=request_id,
+            **{"http.method": request.method, "http.target": request.url.path}
+        ) as request_span:
+            try:
+                response = await call_next(request)
+                process_time = time.time() - start_time
+                rss_delta, peak_delta, rss_bytes = memory.finish_request(memory_start)
+                route = getattr(request.scope.get('route'), 'path', 'unmatched')
+                metrics.record_request_memory(route, rss_delta, peak_delta, rss_bytes)
+                logger.info(
+                    "Request completed",
+                    request_id=request_id,
+                    status_code=response.status_code,
+                    process_time=round(process_time, 4),
+                    rss_delta_bytes=rss_delta,
+                    peak_allocated_bytes=peak_delta
+                )
+                if request_span is not None:
+                    request_span.set_attribute("http.status_code", response.status_code)
+                response.headers["X-Request-ID"] = request_id
+                response.headers["X-Process-Time"] = str(round(process_time, 4))
+                return response
+            except Exception as e:
+                logger.error("Request failed", request_id=request_id, error=str(e),
+                             traceback=traceback.format_exc())
+                raise
+
+    return request_tracking_middleware
+
+
+def build_apps(sample_rate):
+    """回傳 {名稱: ASGI 應用}；所有應用共用同樣的端點"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import fastapi_app
+    from modules.request_tracking import RequestTrackingMiddleware
+
+    # 請求日誌照常格式化，但輸出丟到 /dev/null；其他模組的日誌不輸出
+    logging.getLogger().handlers = [logging.NullHandler()]
+    structured_logger = fastapi_app.logger
+    structured_logger.logger.handlers = [logging.StreamHandler(open(os.devnull, "w"))]
+    structured_logger.logger.propagate = False
+
+    def make_app():
+        app = FastAPI()
+
+        @app.get("/api/item")
+        async def item():
+            return {"ok": True}
+
+        @app.get("/health")
+        async def health():
+            return {"status": "healthy"}
+
+        return app
+
+    apps = {"none": make_app()}
+
+    legacy = make_app()
+    legacy.middleware("http")(_legacy_middleware(structured_logger))
+    apps["legacy"] = legacy
+
+    for name, rate in (("asgi", 1.0), ("asgi_sampled", sample_rate)):
+        app = make_app()
+        app.add_middleware(
+            RequestTrackingMiddleware, logger=structured_logger,
+            draining_response=fastapi_app._draining_response, sample_rate=rate
+        )
+        apps[name] = app
+    return apps
+
+
+def _scope(path):
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"bench"), (b"user-agent", b"middleware-overhead")],
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+
+
+async def _call(app, path):
+    """送出一個沒有本文的 GET；與 uvicorn 相同，本文讀完後 receive 等到回應送完才回傳 http.disconnect"""
+    status = None
+    headers = None
+    body_read = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal body_read
+        if not body_read:
+            body_read = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, headers
+        if message["type"] == "http.response.start":
+            status, headers = message["status"], message.get("headers", [])
+        elif message["type"] == "http.response.body" and not message.get("more_body", False):
+            finished.set()
+
+    await app(_scope(path), receive, send)
+    return status, headers
+
+
+async def _drive(app, path, requests, concurrency):
+    """以 concurrency 個工作共送出 requests 個請求，回傳耗時（秒）"""
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            status, _ = await _call(app, path)
+            if status != 200:
+                raise RuntimeError(f"{path} 回傳 {status}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def _check_headers(apps):
+    """確認追蹤版本都帶上 X-Request-ID / X-Process-Time"""
+    for name, app in apps.items():
+        if name == "none":
+            continue
+        for path in PATHS:
+            _, headers = await _call(app, path)
+            names = {key.lower() for key, _ in headers}
+            if not {b"x-request-id", b"x-process-time"} <= names:
+                raise RuntimeError(f"{name} {path} 缺少追蹤標頭")
+
+
+async def _run(args):
+    apps = build_apps(args.sample_rate)
+    await _check_headers(apps)
+    rows = []
+    for path in PATHS:
+        baseline = None
+        for name, app in apps.items():
+            await _drive(app, path, args.warmup, args.concurrency)
+            durations = [await _drive(app, path, args.requests, args.concurrency) for _ in range(args.rounds)]
+            elapsed = statistics.median(durations)
+            per_request_us = elapsed / args.requests * 1e6
+            if name == "none":
+                baseline = per_request_us
+            rows.append({
+                "path": path,
+                "variant": name,
+                "throughput_rps": round(args.requests / elapsed),
+                "per_request_us": round(per_request_us, 1),
+                "overhead_us": round(per_request_us - baseline, 1),
+            })
+    return rows
+
+
+def run_report(args):
+    rows = asyncio.run(_run(args))
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "rounds": args.rounds,
+            "sample_rate": args.sample_rate,
+        },
+        "results": rows,
+    }
+
+
+def print_report(report):
+    print(f"{'path':<11}{'variant':<14}{'rps':>9}{'per_req_us':>12}{'overhead_us':>13}")
+    for row in report["results"]:
+        print(f"{row['path']:<11}{row['variant']:<14}{row['throughput_rps']:>9}"
+              f"{row['per_request_us']:>12}{row['overhead_us']:>13}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="量測請求追蹤中介層在高請求率下的每請求成本")
+    parser.add_argument("--requests", type=int, default=5000, help="每輪送出的請求數")
+    parser.add_argument("--concurrency", type=int, default=32, help="同時進行的請求數")
+    parser.add_argument("--rounds", type=int, default=3, help="量測輪數（取中位數）")
+    parser.add_argument("--warmup", type=int, default=500, help="量測前的暖身請求數")
+    parser.add_argument("--sample-rate", type=float, default=0.01, help="asgi_sampled 的日誌抽樣比例")
+    parser.add_argument("--output", default=None, help="JSON 報告輸出路徑")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_report(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"報告已寫入: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
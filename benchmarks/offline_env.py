@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+離線基準測試環境
+以假模型（或小型 YOLO 模型）、SQLite 版 drug_info 與本地儲存取代 Cloud SQL / GCS，
+讓 fastapi_app 可以在沒有雲端資源的筆電上完整執行
+"""
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+import types
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+STUB_MODEL_NAME = "YOLOv12.pt"
+# 假模型的類別名稱，與 SQLite 藥品目錄中的 drug_id 對應（含一個無對應的類別）
+STUB_CLASS_NAMES = {
+    0: "A000001_front",
+    1: "A000002_back",
+    2: "B000010",
+    3: "B000011_2",
+    4: "C000100_front",
+    5: "UNMAPPED_PILL",
+}
+STUB_DRUGS = [
+    ("A000001", "Acetaminophen", "普拿疼500毫克錠"),
+    ("A000002", "Ibuprofen", "“伊普”膜衣錠200mg"),
+    ("B000010", "Amoxicillin", "安莫西林膠囊(250mg)"),
+    ("B000011", "Metformin", "庫魯化錠500"),
+    ("C000100", "Aspirin", "阿斯匹靈腸溶錠"),
+]
+
+
+class _Array:
+    """模擬 ultralytics 回傳的 tensor（支援 cpu()/numpy()/tolist() 與索引）"""
+
+    def __init__(self, data):
+        self.data = np.asarray(data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        item = self.data[index]
+        return _Array(item) if np.ndim(item) else item
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.data
+
+    def tolist(self):
+        return self.data.tolist()
+
+
+class _StubBoxes:
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = _Array(xyxy.astype(np.float32))
+        self.conf = _Array(conf.astype(np.float32))
+        self.cls = _Array(cls.astype(np.float32))
+
+    def __len__(self):
+        return len(self.conf)
+
+
+class _StubResult:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class StubYOLO:
+    """
+    假的 YOLO 模型：以固定延遲（依 imgsz 縮放）模擬推論，並回傳可重現的偵測框
+    檢測數量與圖片內容無關，只依 detections_per_image 決定
+    """
+
+    def __init__(self, model_path=None, latency_s=0.03, detections_per_image=6, seed=0):
+        self.names = dict(STUB_CLASS_NAMES)
+        self.latency_s = latency_s
+        self.detections_per_image = detections_per_image
+        self.seed = seed
+
+    def _image_size(self, source):
+        if hasattr(source, "shape"):
+            return source.shape[1], source.shape[0]
+        return source.size
+
+    def _predict_one(self, source, conf=0.25, max_det=300, classes=None):
+        width, height = self._image_size(source)
+        rng = np.random.default_rng(self.seed + width * 7 + height)
+        n = min(self.detections_per_image, max_det)
+        box_w = max(8, width // 8)
+        box_h = max(8, height // 8)
+        x0 = rng.uniform(0, max(1, width - box_w), n)
+        y0 = rng.uniform(0, max(1, height - box_h), n)
+        xyxy = np.stack([x0, y0, x0 + box_w, y0 + box_h], axis=1)
+        scores = rng.uniform(0.5, 1.0, n)
+        cls = rng.integers(0, len(self.names), n)
+        keep = scores >= conf
+        if classes is not None:
+            keep &= np.isin(cls, classes)
+        return _StubResult(_StubBoxes(xyxy[keep], scores[keep], cls[keep]))
+
+    def predict(self, source=None, conf=0.25, max_det=300, classes=None, imgsz=None, **kwargs):
+        sources = source if isinstance(source, list) else [source]
+        if self.latency_s:
+            # 推論成本約與輸入像素數成正比：latency_s 為 640x640 時的延遲
+            scale = (imgsz / 640) ** 2 if imgsz else 1.0
+            time.sleep(self.latency_s * scale * len(sources))
+        return [self._predict_one(s, conf=conf, max_det=max_det, classes=classes) for s in sources]
+
+
+def make_pill_image(width=1280, height=960, pills=6, seed=0, quality=90):
+    """產生一張合成的藥盤照片（JPEG bytes）：淺色背景上隨機分布的彩色橢圓"""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(200, 240, size=3)
+    noise = rng.integers(-12, 12, size=(height, width, 1), dtype=np.int16)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    image = Image.fromarray(pixels, "RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(pills):
+        w = int(rng.integers(width // 16, width // 8))
+        h = int(rng.integers(height // 20, height // 10))
+        x = int(rng.integers(0, width - w))
+        y = int(rng.integers(0, height - h))
+        color = tuple(int(c) for c in rng.integers(40, 255, size=3))
+        draw.ellipse((x, y, x + w, y + h), fill=color, outline=(30, 30, 30), width=2)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def make_corpus(count=16, sizes=((640, 480), (1280, 960), (2016, 1512)), seed=0):
+    """產生合成圖片集，依序輪替圖片尺寸"""
+    return [
+        make_pill_image(*sizes[i % len(sizes)], pills=4 + i % 6, seed=seed + i)
+        for i in range(count)
+    ]
+
+
+def create_sqlite_drug_db(path=None):
+    """建立 SQLite 版 drug_info（path 為 None 時使用記憶體資料庫）"""
+    import sqlalchemy
+    from sqlalchemy.pool import StaticPool
+
+    if path:
+        engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    else:
+        engine = sqlalchemy.create_engine(
+            "sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False}
+        )
+
+    # SQLite 沒有 LEFT()，補上與 MySQL 相同語意的函式供 get_pills_details_by_ids 使用
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def _register_functions(dbapi_connection, connection_record):
+        dbapi_connection.create_function("LEFT", 2, lambda s, n: None if s is None else s[:n])
+
+    with engine.connect() as conn:
+        conn.execute(sqlalchemy.text("""
+            CREATE TABLE IF NOT EXISTS drug_info (
+                drug_id VARCHAR(100) PRIMARY KEY,
+                drug_name_en VARCHAR(255),
+                drug_name_zh VARCHAR(255),
+                main_use TEXT,
+                side_effects TEXT,
+                shape VARCHAR(100),
+                color VARCHAR(100),
+                food_drug_interactions TEXT,
+                image_url VARCHAR(2083)
+            )
+        """))
+        for drug_id, name_en, name_zh in STUB_DRUGS:
+            conn.execute(
+                sqlalchemy.text("""
+                    REPLACE INTO drug_info (drug_id, drug_name_en, drug_name_zh, main_use, side_effects,
+                                            shape, color, food_drug_interactions, image_url)
+                    VALUES (:drug_id, :name_en, :name_zh, '止痛', '噁心', '圓形', '白色', '無', '')
+                """),
+                {"drug_id": drug_id, "name_en": name_en, "name_zh": name_zh},
+            )
+        conn.commit()
+    return engine
+
+
+class LocalStorage:
+    """GCS 的本地替代品：把檔案複製到指定目錄並回傳 file:// URL（與 upload_file_to_gcs 相同簽名）"""
+
+    def __init__(self, root, latency_s=0.0):
+        self.root = root
+        self.latency_s = latency_s
+        # 每個上傳物件的 Content-Type（{bucket/object: content_type}）
+        self.content_types = {}
+        os.makedirs(root, exist_ok=True)
+
+    def upload_file(self, local_file_path, bucket_name, object_name=None, content_type=None):
+        if object_name is None:
+            object_name = os.path.basename(local_file_path)
+        self.content_types[f"{bucket_name}/{object_name}"] = content_type
+        target = os.path.join(self.root, bucket_name, object_name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        shutil.copyfile(local_file_path, target)
+        return "file://" + target
+
+
+def _ensure_ultralytics_importable():
+    """未安裝 ultralytics 時註冊一個只含 StubYOLO 的模組，讓分析模組可以匯入"""
+    try:
+        import ultralytics  # noqa: F401
+    except ImportError:
+        module = types.ModuleType("ultralytics")
+        module.YOLO = StubYOLO
+        sys.modules["ultralytics"] = module
+
+
+def import_analyzer():
+    """匯入 modules.yolo_pill_analyzer（未安裝 ultralytics 時使用 StubYOLO）"""
+    _ensure_ultralytics_importable()
+    from modules import yolo_pill_analyzer
+    return yolo_pill_analyzer
+
+
+def setup_offline_app(workdir=None, model_path=None, inference_latency_s=0.03, detections_per_image=6,
+                      upload_latency_s=0.0, db_path=None):
+    """
+    匯入 fastapi_app 並接上離線替代元件，回傳 (app 模組, 工作目錄)
+    model_path 指定時載入真正的（小型）YOLO 模型，否則使用 StubYOLO
+    """
+    if model_path is None:
+        _ensure_ultralytics_importable()
+
+    import db_cloud_sql
+    import fastapi_app
+    from modules import yolo_pill_analyzer
+
+    workdir = workdir or tempfile.mkdtemp(prefix="pill-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # 標註圖片寫入相對路徑 temp_images/，切換到工作目錄避免污染專案目錄
+    os.chdir(workdir)
+
+    db_cloud_sql.db_pool = create_sqlite_drug_db(db_path)
+
+    if model_path is None:
+        stub = StubYOLO(latency_s=inference_latency_s, detections_per_image=detections_per_image)
+        yolo_pill_analyzer.YOLO = lambda path: stub
+        placeholder = os.path.join(workdir, "stub_model.pt")
+        open(placeholder, "a").close()
+        yolo_pill_analyzer.MODEL_PATHS = {STUB_MODEL_NAME: placeholder}
+    else:
+        yolo_pill_analyzer.MODEL_PATHS = {os.path.basename(model_path): os.path.abspath(model_path)}
+
+    storage = LocalStorage(os.path.join(workdir, "gcs"), latency_s=upload_latency_s)
+    yolo_pill_analyzer.GCS_AVAILABLE = True
+    yolo_pill_analyzer.GCS_BUCKET_NAME = "offline-bench"
+    yolo_pill_analyzer.upload_file_to_gcs = storage.upload_file
+
+    return fastapi_app, workdir
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+回應序列化成本報告（離線）
+以相同的偵測結果（預設 200 個偵測）比較 /api/detect 回應從 dict 變成 JSON 位元組的各種做法：
+
+- legacy：原本的做法，response_model 宣告為 List[Dict[str, Any]]，FastAPI 驗證後以標準 json 序列化
+- typed_model：改用型別化的 Detection / PillInfo 模型，但仍經過 FastAPI 的 response_model 驗證
+- direct_json：略過 response_model，dict 直接以標準 json 序列化
+- direct_orjson：略過 response_model，以 FastJSONResponse（orjson）序列化（目前偵測端點的做法）
+- columnar_orjson：偵測結果轉成平行陣列後以 orjson 序列化（response_format=columnar）
+
+用法:
+    python benchmarks/serialization_report.py
+    python benchmarks/serialization_report.py --detections 200 500 --repeat 500 --output serialization.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from offline_env import STUB_CLASS_NAMES, STUB_DRUGS  # noqa: E402
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+from pydantic import BaseModel  # noqa: E402
+
+
+class LegacyDetectionResponse(BaseModel):
+    """原本的回應模型（偵測與藥品資訊為未型別化的 dict）"""
+    success: bool
+    detections: List[Dict[str, Any]]
+    pills_info: List[Dict[str, Any]]
+    annotated_image_url: Optional[str]
+    annotated_images: Optional[Dict[str, Dict[str, Any]]] = None
+    elapsed_time: float
+    model_name: str
+    message: Optional[str] = None
+    timings: Optional[Dict[str, float]] = None
+
+
+def make_response(count, seed=0):
+    """產生與 /api/detect 相同結構的回應內容（count 個偵測）"""
+    rng = random.Random(seed)
+    drugs = {drug_id: (name_en, name_zh) for drug_id, name_en, name_zh in STUB_DRUGS}
+    detections = []
+    for i in range(count):
+        class_id = rng.randrange(len(STUB_CLASS_NAMES))
+        class_name = STUB_CLASS_NAMES[class_id]
+        drug_id = class_name.split("_")[0]
+        x0, y0 = rng.randrange(0, 3800), rng.randrange(0, 2800)
+        detections.append({
+            "class_name": class_name,
+            "class_id": class_id,
+            "drug_id": drug_id if drug_id in drugs else None,
+            "confidence": round(rng.uniform(0.5, 1.0), 3),
+            "bbox": [x0, y0, x0 + rng.randrange(40, 200), y0 + rng.randrange(40, 200)],
+            "color": f"#{rng.randrange(0x1000000):06X}",
+        })
+    pills_info = [
+        {
+            "drug_id": drug_id, "drug_name_en": name_en, "drug_name_zh": name_zh, "uses": "用途說明",
+            "side_effects": "副作用說明", "shape": "圓形", "color": "白色", "interactions": "交互作用說明",
+            "image_url": f"https://example.com/{drug_id}.jpg", "display_label": name_zh,
+        }
+        for drug_id, (name_en, name_zh) in drugs.items()
+    ]
+    return {
+        "success": True,
+        "detections": detections,
+        "pills_info": pills_info,
+        "annotated_image_url": "https://storage.googleapis.com/bucket/predictions/predicted.jpg",
+        "annotated_images": None,
+        "elapsed_time": 0.42,
+        "model_name": "YOLOv12.pt",
+        "message": None,
+        "timings": {"decode": 3.1, "inference": 180.2, "annotate": 40.5, "total": 230.1},
+    }
+
+
+def _run_coroutine(coroutine):
+    """同步執行不會真正等待的協程（async 端點的 serialize_response 直接驗證，不切換執行緒），不計入事件迴圈的成本"""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("serialize_response 需要事件迴圈")
+
+
+def _through_response_model(model_class, field, content):
+    """FastAPI 對回傳 response_model 實例的端點所做的事：建立模型、依 response_model 驗證轉換、標準 json 序列化"""
+    response = model_class(**content)
+    serialized = _run_coroutine(serialize_response(field=field, response_content=response, is_coroutine=True))
+    return JSONResponse(serialized).body
+
+
+def build_variants():
+    """回傳 {名稱: 函式(content) -> JSON 位元組}"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import fastapi_app
+    from modules import serialization
+
+    legacy_field = create_response_field("response", LegacyDetectionResponse)
+    typed_field = create_response_field("response", fastapi_app.DetectionResponse)
+
+    def columnar(content):
+        content = dict(content, detections=serialization.to_columnar(content["detections"]))
+        return serialization.FastJSONResponse(content).body
+
+    return {
+        "legacy": lambda content: _through_response_model(LegacyDetectionResponse, legacy_field, content),
+        "typed_model": lambda content: _through_response_model(fastapi_app.DetectionResponse, typed_field, content),
+        "direct_json": lambda content: JSONResponse(content).body,
+        "direct_orjson": lambda content: serialization.FastJSONResponse(content).body,
+        "columnar_orjson": columnar,
+    }, serialization.ORJSON_AVAILABLE
+
+
+def measure(func, content, repeat, warmup):
+    for _ in range(warmup):
+        body = func(content)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = func(content)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "median_us": round(statistics.median(samples) * 1e6, 1),
+        "p95_us": round(samples[int(0.95 * (len(samples) - 1))] * 1e6, 1),
+        "bytes": len(body),
+    }
+
+
+def run_report(args):
+    variants, orjson_available = build_variants()
+    rows = []
+    for count in args.detections:
+        content = make_response(count)
+        baseline = None
+        for name, func in variants.items():
+            row = {"detections": count, "variant": name, **measure(func, content, args.repeat, args.warmup)}
+            if name == "legacy":
+                baseline = row["median_us"]
+            row["speedup"] = round(baseline / row["median_us"], 1) if baseline and row["median_us"] else None
+            rows.append(row)
+            # 確認輸出是合法的 JSON
+            json.loads(func(content))
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "orjson": orjson_available,
+            "repeat": args.repeat,
+        },
+        "results": rows,
+    }
+
+
+def print_report(report):
+    print(f"{'detections':>10}  {'variant':<16}{'median_us':>11}{'p95_us':>10}{'bytes':>9}{'speedup':>9}")
+    for row in report["results"]:
+        print(f"{row['detections']:>10}  {row['variant']:<16}{row['median_us']:>11}{row['p95_us']:>10}"
+              f"{row['bytes']:>9}{str(row['speedup']):>9}")
+    if not report["meta"]["orjson"]:
+        print("（未安裝 orjson，direct_orjson / columnar_orjson 實際使用標準 json）")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="比較偵測回應各種序列化做法的耗時與大小")
+    parser.add_argument("--detections", type=int, nargs="+", default=[200], help="每個回應的偵測數")
+    parser.add_argument("--repeat", type=int, default=300, help="每種做法的量測次數")
+    parser.add_argument("--warmup", type=int, default=20, help="量測前的暖身次數")
+    parser.add_argument("--output", default=None, help="JSON 報告輸出路徑")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.disable(logging.INFO)
+    report = run_report(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"報告已寫入: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+長時間浸泡測試（離線）
+在同一個行程內對偵測端點輪流送出數千個請求，定期取樣行程 RSS，
+暖身後的 RSS 成長量或後半段的成長斜率超過門檻時以非零狀態結束，用來發現記憶體洩漏
+
+用法:
+    python benchmarks/soak_test.py --requests 5000 --concurrency 4
+    python benchmarks/soak_test.py --requests 2000 --max-growth-mb 64 --output soak.json
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import gc
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import ENDPOINTS, _build_request  # noqa: E402
+from offline_env import make_corpus, setup_offline_app  # noqa: E402
+
+_MB = 1024 * 1024
+
+
+def _slope_mb_per_1k(samples):
+    """以最小平方法估計 RSS 對請求數的斜率（MB / 1000 請求）"""
+    if len(samples) < 2:
+        return 0.0
+    xs = [count for count, _ in samples]
+    ys = [rss / _MB for _, rss in samples]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    denominator = sum((x - mean_x) ** 2 for x in xs)
+    if denominator == 0:
+        return 0.0
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / denominator
+    return slope * 1000
+
+
+async def run_soak_test(args):
+    import httpx
+
+    app_module, workdir = setup_offline_app(
+        workdir=args.workdir,
+        model_path=args.model,
+        inference_latency_s=args.inference_latency_ms / 1000.0,
+        detections_per_image=args.detections,
+    )
+    from modules.memory import current_rss_bytes
+
+    await app_module.initialize_models_async()
+
+    corpus = make_corpus(args.corpus_size)
+    corpus_b64 = [base64.b64encode(data).decode("ascii") for data in corpus]
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    samples = []
+    errors = 0
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://soak", timeout=120) as client:
+        async def run_phase(total, sample_every=None):
+            """以 concurrency 個 worker 送出 total 個請求，每 sample_every 個請求取樣一次 RSS"""
+            nonlocal errors
+            counter = iter(range(total))
+            completed = 0
+
+            async def worker():
+                nonlocal errors, completed
+                for i in counter:
+                    endpoint = args.endpoints[i % len(args.endpoints)]
+                    kwargs = _build_request(endpoint, corpus[i % len(corpus)], corpus_b64[i % len(corpus)])
+                    try:
+                        response = await client.post(endpoint, **kwargs)
+                        if response.status_code != 200:
+                            errors += 1
+                    except Exception:
+                        errors += 1
+                    completed += 1
+                    if sample_every and completed % sample_every == 0:
+                        samples.append((completed, current_rss_bytes()))
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+        # 暖身後才記錄基準 RSS（模型、字型、目錄快取都已載入）
+        await run_phase(args.warmup)
+        errors = 0
+        gc.collect()
+        baseline_rss = current_rss_bytes()
+        start = time.perf_counter()
+        await run_phase(args.requests, args.sample_every)
+        wall_time = time.perf_counter() - start
+
+    gc.collect()
+    final_rss = current_rss_bytes()
+    second_half = samples[len(samples) // 2:]
+    growth_mb = (final_rss - baseline_rss) / _MB
+    slope = _slope_mb_per_1k(second_half)
+    passed = errors == 0 and growth_mb <= args.max_growth_mb and slope <= args.max_slope_mb_per_1k
+
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "endpoints": args.endpoints,
+            "model": args.model or "stub",
+            "workdir": workdir,
+        },
+        "baseline_rss_mb": round(baseline_rss / _MB, 1),
+        "final_rss_mb": round(final_rss / _MB, 1),
+        "peak_sampled_rss_mb": round(max(rss for _, rss in samples) / _MB, 1) if samples else None,
+        "growth_mb": round(growth_mb, 1),
+        "second_half_slope_mb_per_1k": round(slope, 2),
+        "errors": errors,
+        "wall_time_s": round(wall_time, 1),
+        "samples": [(count, round(rss / _MB, 1)) for count, rss in samples],
+        "limits": {"max_growth_mb": args.max_growth_mb, "max_slope_mb_per_1k": args.max_slope_mb_per_1k},
+        "passed": passed,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="藥丸檢測 API 記憶體浸泡測試")
+    parser.add_argument("--requests", type=int, default=3000, help="總請求數（不含暖身）")
+    parser.add_argument("--warmup", type=int, default=50, help="暖身請求數")
+    parser.add_argument("--concurrency", type=int, default=4, help="併發請求數")
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, help="輪流測試的端點")
+    parser.add_argument("--corpus-size", type=int, default=16, help="合成圖片數量")
+    parser.add_argument("--model", default=None, help="真實 YOLO 模型路徑（預設使用假模型）")
+    parser.add_argument("--inference-latency-ms", type=float, default=0.0, help="假模型的推論延遲")
+    parser.add_argument("--detections", type=int, default=6, help="假模型每張圖片的偵測數量")
+    parser.add_argument("--sample-every", type=int, default=100, help="每隔多少請求取樣一次 RSS")
+    parser.add_argument("--max-growth-mb", type=float, default=100.0, help="暖身後 RSS 可成長的上限")
+    parser.add_argument("--max-slope-mb-per-1k", type=float, default=5.0,
+                        help="後半段每 1000 個請求 RSS 成長的上限")
+    parser.add_argument("--workdir", default=None, help="工作目錄（預設建立暫存目錄）")
+    parser.add_argument("--output", default=None, help="JSON 報告輸出路徑")
+    parser.add_argument("--verbose", action="store_true", help="顯示應用程式日誌")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    if args.verbose:
+        report = asyncio.run(run_soak_test(args))
+    else:
+        # 丟到 devnull 而不是 StringIO，避免輸出累積在記憶體中干擾量測
+        logging.disable(logging.INFO)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            report = asyncio.run(run_soak_test(args))
+        logging.disable(logging.NOTSET)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"報告已寫入: {args.output}")
+
+    if not report["passed"]:
+        print(f"\n⚠️ RSS 成長 {report['growth_mb']} MB，後半段斜率 "
+              f"{report['second_half_slope_mb_per_1k']} MB/1k 請求，錯誤 {report['errors']} 次")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+WebSocket 串流偵測基準測試（離線）
+在子行程中以 uvicorn 啟動 fastapi_app:app（避免客戶端與伺服器搶同一個事件迴圈與 GIL），
+每條連線模擬一台鏡頭以固定畫面率送出 JPEG 畫面到 /ws/detect，
+量測每條連線持續處理的畫面率（FPS）、被丟棄的畫面數，以及畫面送出到收到結果的延遲；
+另外以同樣的畫面逐一呼叫 POST /api/detect/simple（base64）作為對照
+
+用法:
+    python benchmarks/stream_bench.py
+    python benchmarks/stream_bench.py --connections 1 2 4 --send-fps 30 --duration 10 --output stream.json
+    python benchmarks/stream_bench.py --model models/YOLOv12.pt --size 1280x960
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import socket
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import percentile  # noqa: E402
+from offline_env import make_pill_image, setup_offline_app  # noqa: E402
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def summarize_connection(sent, latencies, dropped, errors, duration):
+    latencies = sorted(latencies)
+    return {
+        "sent": sent,
+        "processed": len(latencies),
+        "dropped": dropped,
+        "errors": errors,
+        "fps": round(len(latencies) / duration, 2),
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "max_ms": _ms(latencies[-1]) if latencies else None,
+    }
+
+
+async def run_connection(url, frames, send_fps, duration):
+    """一條串流連線：以 send_fps 送出畫面 duration 秒，回傳這條連線的統計"""
+    import websockets
+
+    sent_at = {}
+    latencies = []
+    counts = {"dropped": 0, "errors": 0}
+    # JPEG 畫面已經壓縮過，關閉 permessage-deflate（否則客戶端每格都要多做一次 zlib 壓縮）
+    async with websockets.connect(url, max_size=None, compression=None) as ws:
+        json.loads(await ws.recv())  # ready 訊息
+
+        async def sender():
+            interval = 1.0 / send_fps if send_fps > 0 else 0
+            start = time.perf_counter()
+            seq = 0
+            while time.perf_counter() - start < duration:
+                seq += 1
+                sent_at[seq] = time.perf_counter()
+                await ws.send(frames[seq % len(frames)])
+                await asyncio.sleep(max(0.0, start + seq * interval - time.perf_counter()))
+            return seq
+
+        async def receiver():
+            async for raw in ws:
+                message = json.loads(raw)
+                if message["type"] == "det":
+                    latencies.append(time.perf_counter() - sent_at[message["seq"]])
+                    counts["dropped"] += message["dropped"]
+                else:
+                    counts["errors"] += 1
+
+        def settled():
+            return len(latencies) + counts["dropped"] + counts["errors"] >= sent
+
+        receive_task = asyncio.create_task(receiver())
+        sent = await sender()
+        # 最新一格一定會被處理，等它回來再結算（最多再等 2 秒）
+        deadline = time.perf_counter() + 2.0
+        while not settled() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        receive_task.cancel()
+    return summarize_connection(sent, latencies, counts["dropped"], counts["errors"], duration)
+
+
+async def run_http_baseline(base_url, frames, duration):
+    """對照組：單一客戶端逐一以 base64 POST 到 /api/detect/simple"""
+    import httpx
+
+    payloads = [{"image": base64.b64encode(frame).decode("ascii")} for frame in frames]
+    latencies = []
+    errors = 0
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        start = time.perf_counter()
+        i = 0
+        while time.perf_counter() - start < duration:
+            request_start = time.perf_counter()
+            response = await client.post("/api/detect/simple", json=payloads[i % len(payloads)])
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - request_start)
+            else:
+                errors += 1
+            i += 1
+    return summarize_connection(i, latencies, 0, errors, duration)
+
+
+def _serve(port, args):
+    """子行程：接上離線替代元件後啟動 uvicorn"""
+    import uvicorn
+
+    logging.disable(logging.INFO)
+    with contextlib.redirect_stdout(io.StringIO()):
+        app_module, _ = setup_offline_app(
+            workdir=args.workdir,
+            model_path=args.model,
+            inference_latency_s=args.inference_latency_ms / 1000.0,
+            detections_per_image=args.detections,
+        )
+        uvicorn.run(app_module.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+async def _wait_for_server(port, timeout=60.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"伺服器未在 {timeout} 秒內啟動")
+
+
+async def run_benchmark(args):
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    frames = [make_pill_image(width, height, pills=args.detections, seed=i) for i in range(8)]
+
+    port = _free_port()
+    server = multiprocessing.get_context("spawn").Process(target=_serve, args=(port, args), daemon=True)
+    server.start()
+    await _wait_for_server(port)
+
+    results = {}
+    try:
+        url = f"ws://127.0.0.1:{port}/ws/detect"
+        # 暖身
+        await run_connection(url, frames, args.send_fps, 1.0)
+        for connections in args.connections:
+            per_connection = await asyncio.gather(
+                *(run_connection(url, frames, args.send_fps, args.duration) for _ in range(connections))
+            )
+            results[str(connections)] = {
+                "connections": per_connection,
+                "mean_fps_per_connection": round(sum(c["fps"] for c in per_connection) / connections, 2),
+                "total_fps": round(sum(c["fps"] for c in per_connection), 2),
+            }
+        http_baseline = None
+        if not args.no_http_baseline:
+            http_baseline = await run_http_baseline(f"http://127.0.0.1:{port}", frames, args.duration)
+    finally:
+        server.terminate()
+        server.join()
+
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "model": args.model or "stub",
+            "inference_latency_ms": None if args.model else args.inference_latency_ms,
+            "frame_size": [width, height],
+            "frame_kb": round(sum(len(f) for f in frames) / len(frames) / 1024, 1),
+            "send_fps": args.send_fps,
+            "duration_s": args.duration,
+        },
+        "websocket": results,
+        "http_simple_baseline": http_baseline,
+    }
+
+
+def print_report(report):
+    print(f"{'connections':>11}{'fps/conn':>10}{'total_fps':>11}{'p50_ms':>9}{'p95_ms':>9}{'dropped':>9}{'errors':>8}")
+    for connections, row in report["websocket"].items():
+        conns = row["connections"]
+        p50 = max(c["p50_ms"] or 0 for c in conns)
+        p95 = max(c["p95_ms"] or 0 for c in conns)
+        print(f"{connections:>11}{row['mean_fps_per_connection']:>10}{row['total_fps']:>11}{p50:>9}{p95:>9}"
+              f"{sum(c['dropped'] for c in conns):>9}{sum(c['errors'] for c in conns):>8}")
+    baseline = report["http_simple_baseline"]
+    if baseline:
+        print(f"\nHTTP /api/detect/simple（base64，逐一送出）: {baseline['fps']} fps, "
+              f"p50 {baseline['p50_ms']} ms, p95 {baseline['p95_ms']} ms")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="WebSocket 串流偵測的每條連線畫面率基準測試")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 2, 4], help="同時連線數（可列多個）")
+    parser.add_argument("--send-fps", type=float, default=30.0, help="每條連線送出畫面的頻率（0 為不限速）")
+    parser.add_argument("--duration", type=float, default=5.0, help="每輪送出畫面的秒數")
+    parser.add_argument("--size", default="1280x960", help="畫面尺寸，例如 1280x960")
+    parser.add_argument("--model", default=None, help="真實 YOLO 模型路徑（預設使用假模型）")
+    parser.add_argument("--inference-latency-ms", type=float, default=30.0, help="假模型的推論延遲")
+    parser.add_argument("--detections", type=int, default=6, help="每個畫面的偵測數量")
+    parser.add_argument("--no-http-baseline", action="store_true", help="不執行 HTTP 對照組")
+    parser.add_argument("--workdir", default=None, help="工作目錄（預設建立暫存目錄）")
+    parser.add_argument("--output", default=None, help="JSON 報告輸出路徑")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"報告已寫入: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
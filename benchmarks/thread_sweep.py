@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+推論執行緒配置掃描（離線）
+對每組 (worker 數, intra-op 執行緒, inter-op 執行緒, CPU 綁定) 啟動對應數量的子行程，
+每個子行程以服務相同的方式（modules/cpu_topology.py 依環境變數設定執行緒與 CPU 綁定）載入模型，
+同時開始連續推論同一張圖片，量測整體吞吐量與單次推論的 p50 / p99，最後推薦一組設定。
+結果只對執行此腳本的機型有效，請在與部署相同的 CPU 配額下執行
+
+用法:
+    python benchmarks/thread_sweep.py --model models/YOLOv12.pt
+    python benchmarks/thread_sweep.py --model models/YOLOv12.pt --workers 1 2 --intra 1 2 4 --affinity off auto
+    python benchmarks/thread_sweep.py --model models/YOLOv12.pt --p99-budget-ms 400 --output sweep.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import percentile  # noqa: E402
+from offline_env import StubYOLO, import_analyzer, make_pill_image  # noqa: E402
+
+# 吞吐量與最佳值相差在此比例內時，改選 p99 較低的設定
+THROUGHPUT_TOLERANCE = 0.03
+
+
+@contextlib.contextmanager
+def topology_env(workers, intra, inter, affinity):
+    """暫時設定 cpu_topology 讀取的環境變數（spawn 的子行程會繼承）"""
+    values = {
+        "WEB_CONCURRENCY": str(workers),
+        "TORCH_INTRA_OP_THREADS": str(intra),
+        "TORCH_INTER_OP_THREADS": str(inter),
+        "CPU_AFFINITY": affinity,
+    }
+    previous = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def _worker(args, barrier, results):
+    """子行程：依環境變數設定執行緒與 CPU 綁定、載入模型，等所有 worker 就緒後連續推論 args.duration 秒"""
+    logging.disable(logging.INFO)
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyzer = import_analyzer()
+        from modules import cpu_topology, image_decode, inference_params
+
+        cpu_topology.apply_affinity()
+        if args.model:
+            # 與服務相同：匯入 ultralytics 後立即設定 torch 執行緒數
+            model = analyzer._get_yolo_class()(args.model)
+        else:
+            cpu_topology.configure_torch()
+            model = StubYOLO(latency_s=args.inference_latency_ms / 1000.0)
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        image = image_decode.decode_to_array(make_pill_image(width, height))
+        predict_kwargs = inference_params.resolve({"imgsz": args.imgsz}, image)
+        for _ in range(args.warmup):
+            model.predict(source=image, verbose=False, **predict_kwargs)
+
+    barrier.wait()
+    latencies = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.duration:
+        request_start = time.perf_counter()
+        model.predict(source=image, verbose=False, **predict_kwargs)
+        latencies.append(time.perf_counter() - request_start)
+    results.put({"plan": cpu_topology.describe(), "latencies": latencies})
+
+
+def run_combination(args, workers, intra, inter, affinity):
+    """以一組設定同時執行 workers 個子行程，回傳彙整結果"""
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers + 1)
+    results = context.Queue()
+    with topology_env(workers, intra, inter, affinity):
+        processes = [context.Process(target=_worker, args=(args, barrier, results)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+    barrier.wait()
+    outputs = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = sorted(latency for output in outputs for latency in output["latencies"])
+    plans = [output["plan"] for output in outputs]
+    return {
+        "workers": workers,
+        "intra_op_threads": intra,
+        "inter_op_threads": inter,
+        "affinity": affinity,
+        "resolved": [
+            {"slot": plan["worker_slot"], "cpus": plan["affinity"],
+             "threads": plan.get("torch_threads", {"intra_op": plan["intra_op_threads"],
+                                                   "inter_op": plan["inter_op_threads"]})}
+            for plan in plans
+        ],
+        "inferences": len(latencies),
+        "throughput_per_s": round(len(latencies) / args.duration, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+
+
+def build_grid(args, cpu_count):
+    """列出要量測的組合；預設略過 worker 數 x intra-op 執行緒超過 CPU 數（超額配置）的組合"""
+    grid = []
+    for workers, intra, inter, affinity in itertools.product(args.workers, args.intra, args.inter, args.affinity):
+        if workers == 1 and affinity == "auto":
+            continue  # 單一 worker 時 auto 綁定等於使用全部 CPU，與 off 相同
+        if not args.allow_oversubscribe and workers * intra > cpu_count:
+            continue
+        grid.append((workers, intra, inter, affinity))
+    return grid
+
+
+def recommend(rows, p99_budget_ms=None):
+    """吞吐量最高者（相差 THROUGHPUT_TOLERANCE 內取 p99 較低者）；指定 p99 上限時只考慮符合的組合"""
+    candidates = [row for row in rows if row["p99_ms"] is not None]
+    if p99_budget_ms is not None:
+        candidates = [row for row in candidates if row["p99_ms"] <= p99_budget_ms]
+    if not candidates:
+        return None
+    best = max(row["throughput_per_s"] for row in candidates)
+    close = [row for row in candidates if row["throughput_per_s"] >= best * (1 - THROUGHPUT_TOLERANCE)]
+    return min(close, key=lambda row: row["p99_ms"])
+
+
+def run_sweep(args):
+    from modules.cpu_topology import available_cpus, cgroup_cpu_limit
+
+    cpus = available_cpus()
+    limit = cgroup_cpu_limit()
+    cpu_count = min(len(cpus), int(limit + 0.999)) if limit else len(cpus)
+    if args.intra is None:
+        args.intra = sorted({1, 2, 4, 8, 16, cpu_count} & set(range(1, cpu_count + 1)))
+    if args.workers is None:
+        args.workers = sorted({1, 2, 4} & set(range(1, cpu_count + 1)))
+
+    rows = []
+    for workers, intra, inter, affinity in build_grid(args, cpu_count):
+        row = run_combination(args, workers, intra, inter, affinity)
+        rows.append(row)
+        print(f"workers={workers} intra={intra} inter={inter} affinity={affinity}: "
+              f"{row['throughput_per_s']} inf/s, p50 {row['p50_ms']} ms, p99 {row['p99_ms']} ms", file=sys.stderr)
+
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "available_cpus": len(cpus),
+            "cgroup_cpu_limit": limit,
+            "model": args.model or "stub",
+            "inference_latency_ms": None if args.model else args.inference_latency_ms,
+            "image_size": args.size,
+            "imgsz": args.imgsz,
+            "duration_s": args.duration,
+            "p99_budget_ms": args.p99_budget_ms,
+        },
+        "results": rows,
+        "recommendation": recommend(rows, args.p99_budget_ms),
+    }
+
+
+def print_report(report):
+    print(f"{'workers':>7}{'intra':>7}{'inter':>7}{'affinity':>10}{'inf/s':>9}{'p50_ms':>9}{'p99_ms':>9}")
+    for row in report["results"]:
+        print(f"{row['workers']:>7}{row['intra_op_threads']:>7}{row['inter_op_threads']:>7}{row['affinity']:>10}"
+              f"{row['throughput_per_s']:>9}{row['p50_ms']:>9}{row['p99_ms']:>9}")
+    best = report["recommendation"]
+    if best is None:
+        print("\n沒有符合 p99 上限的組合")
+        return
+    print("\n建議設定:")
+    print(f"  WEB_CONCURRENCY={best['workers']}")
+    print(f"  TORCH_INTRA_OP_THREADS={best['intra_op_threads']}")
+    print(f"  TORCH_INTER_OP_THREADS={best['inter_op_threads']}")
+    print(f"  CPU_AFFINITY={best['affinity']}")
+    if report["meta"]["model"] == "stub":
+        print("（假模型的推論是固定延遲，不受執行緒數影響，只用來驗證流程；請以 --model 指定真實模型）")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="掃描 worker 數與 torch 執行緒配置，量測吞吐量與 p99 並推薦設定")
+    parser.add_argument("--model", default=None, help="真實 YOLO 模型路徑（預設使用假模型，只驗證流程）")
+    parser.add_argument("--workers", type=int, nargs="+", default=None, help="worker 數（預設 1 2 4，不超過 CPU 數）")
+    parser.add_argument("--intra", type=int, nargs="+", default=None,
+                        help="intra-op 執行緒數（預設 1 2 4 ... 與 CPU 數）")
+    parser.add_argument("--inter", type=int, nargs="+", default=[1], help="inter-op 執行緒數")
+    parser.add_argument("--affinity", nargs="+", default=["off", "auto"], choices=["off", "auto"],
+                        help="CPU 綁定方式")
+    parser.add_argument("--allow-oversubscribe", action="store_true",
+                        help="也量測 worker 數 x intra-op 執行緒超過 CPU 數的組合")
+    parser.add_argument("--size", default="1280x960", help="測試圖片尺寸")
+    parser.add_argument("--imgsz", default="640", help="推論尺寸（整數或 auto）")
+    parser.add_argument("--duration", type=float, default=10.0, help="每組設定連續推論的秒數")
+    parser.add_argument("--warmup", type=int, default=3, help="每個 worker 開始計時前的暖身推論次數")
+    parser.add_argument("--inference-latency-ms", type=float, default=30.0, help="假模型的推論延遲")
+    parser.add_argument("--p99-budget-ms", type=float, default=None, help="只推薦 p99 不超過此值的設定")
+    parser.add_argument("--output", default=None, help="JSON 報告輸出路徑")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_sweep(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"報告已寫入: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,8 @@ from datetime import datetime
 import logging
 import sys
 import sqlalchemy
+from modules.drug_labels import make_display_label
+from modules.tracing import start_span
 
 # ====== Cloud Run/GCP 日誌設定 (放最上面) ======
 logging.basicConfig(
@@ -26,6 +28,40 @@ def _log_and_print(msg, level="info"):
         logger.info(msg)
 
 db_pool = None
+# 藥品目錄快取：drug_id -> 藥品資訊（含預先計算的 display_label）
+drug_catalog = {}
+# 藥品目錄變更時的回呼函式（例如重建模型類別綁定）
+_catalog_listeners = []
+
+DRUG_INFO_COLUMNS = "drug_id, drug_name_en, drug_name_zh, main_use, side_effects, shape, color, food_drug_interactions, image_url"
+
+def _row_to_pill_details(row_dict):
+    """將 drug_info 資料列轉成 API 使用的藥品資訊格式，並預先計算顯示標籤"""
+    drug_id = row_dict.get('drug_id')
+    return {
+        'drug_id': drug_id,
+        'drug_name_en': row_dict.get('drug_name_en'),
+        'drug_name_zh': row_dict.get('drug_name_zh'),
+        'uses': row_dict.get('main_use'),
+        'side_effects': row_dict.get('side_effects'),
+        'shape': row_dict.get('shape'),
+        'color': row_dict.get('color'),
+        'interactions': row_dict.get('food_drug_interactions'),
+        'image_url': row_dict.get('image_url'),
+        'display_label': make_display_label(drug_id, row_dict.get('drug_name_zh'))
+    }
+
+def register_catalog_listener(callback):
+    """註冊藥品目錄變更回呼，目錄載入或更新後會被呼叫"""
+    if callback not in _catalog_listeners:
+        _catalog_listeners.append(callback)
+
+def _notify_catalog_listeners():
+    for callback in _catalog_listeners:
+        try:
+            callback()
+        except Exception as e:
+            _log_and_print(f"[錯誤] 藥品目錄變更回呼執行失敗: {e}", level="error")
 
 def get_db_connection_pool():
     global db_pool
@@ -137,27 +173,18 @@ def get_pills_details_by_ids(drug_id, model_name=None):
             placeholders = ', '.join([':id' + str(i) for i in range(len(lower_case_drug_ids))])
             params = {'id' + str(i): lower_case_drug_ids[i] for i in range(len(lower_case_drug_ids))}
             sql = sqlalchemy.text(f"""
-                SELECT drug_id, drug_name_en, drug_name_zh, main_use, side_effects, shape, color, food_drug_interactions, image_url 
+                SELECT {DRUG_INFO_COLUMNS}
                 FROM drug_info WHERE LOWER(LEFT(drug_id, 10)) IN ({placeholders})
             """)
             _log_and_print(f"[調試] 執行 SQL (前10碼比對){model_info}: {sql}")
             _log_and_print(f"[調試] SQL 參數 (前10碼){model_info}: {params}")
-            results = conn.execute(sql, params)
-            rows = results.fetchall()
+            with start_span("sql.select drug_info", **{"db.system": "mysql", "db.operation": "SELECT",
+                                                        "db.params_count": len(params)}):
+                results = conn.execute(sql, params)
+                rows = results.fetchall()
             _log_and_print(f"[調試] 資料庫查詢返回 {len(rows)} 筆記錄{model_info}")
             for row in rows:
-                row_dict = dict(row._mapping)
-                details_list.append({
-                    'drug_id': row_dict.get('drug_id'),
-                    'drug_name_en': row_dict.get('drug_name_en'),
-                    'drug_name_zh': row_dict.get('drug_name_zh'),
-                    'uses': row_dict.get('main_use'),
-                    'side_effects': row_dict.get('side_effects'),
-                    'shape': row_dict.get('shape'),
-                    'color': row_dict.get('color'),
-                    'interactions': row_dict.get('food_drug_interactions'),
-                    'image_url': row_dict.get('image_url')
-                })
+                details_list.append(_row_to_pill_details(dict(row._mapping)))
     except Exception as e:
         _log_and_print(f"[錯誤] 查詢多筆藥品資訊時失敗: {e}", level="error")
     return details_list
@@ -177,10 +204,36 @@ def add_drug_info(drug_id, drug_name_en, drug_name_zh, main_use, side_effects, s
             REPLACE INTO drug_info (drug_id, drug_name_en, drug_name_zh, main_use, side_effects, shape, color, food_drug_interactions, image_url)
             VALUES (:drug_id, :drug_name_en, :drug_name_zh, :main_use, :side_effects, :shape, :color, :interactions, :image_url)
         """)
-        with pool.connect() as conn:
+        with pool.connect() as conn, start_span("sql.replace drug_info", **{"db.system": "mysql",
+                                                                            "db.operation": "REPLACE"}):
             conn.execute(sql, params)
             conn.commit()
             success = True
+        row_dict = dict(params, food_drug_interactions=interactions)
+        drug_catalog[drug_id] = _row_to_pill_details(row_dict)
+        _notify_catalog_listeners()
     except Exception as e:
         _log_and_print(f"!!!!!! [嚴重錯誤] 新增/更新藥品資訊時失敗: {e} !!!!!!", level="error")
     return success
+
+def load_drug_catalog():
+    """載入整個 drug_info 目錄到記憶體快取，回傳載入筆數"""
+    pool = get_db_connection_pool()
+    if not pool:
+        _log_and_print("[調試] 資料庫連線池不可用，無法載入藥品目錄", level="warning")
+        return 0
+    try:
+        with pool.connect() as conn, start_span("sql.select drug_info", **{"db.system": "mysql",
+                                                                           "db.operation": "SELECT"}):
+            rows = conn.execute(sqlalchemy.text(f"SELECT {DRUG_INFO_COLUMNS} FROM drug_info")).fetchall()
+        catalog = {}
+        for row in rows:
+            details = _row_to_pill_details(dict(row._mapping))
+            catalog[details['drug_id']] = details
+        drug_catalog.clear()
+        drug_catalog.update(catalog)
+        _log_and_print(f"--- 藥品目錄載入完成，共 {len(drug_catalog)} 筆 ---")
+        _notify_catalog_listeners()
+    except Exception as e:
+        _log_and_print(f"[錯誤] 載入藥品目錄失敗: {e}", level="error")
+    return len(drug_catalog)
@@ -1,46 +1,37 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Request
+import time
+_IMPORT_STARTED_AT = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Query, Depends, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, FileResponse
 from fastapi.exceptions import RequestValidationError
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
-import time
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, Field, conint
+from typing import Optional, List, Dict, Any, Literal, Union
 import uuid
 import traceback
 import os
-import io
 import base64
-from PIL import Image
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import yaml
 from datetime import datetime
-import uvicorn
 
 # 載入環境變數
 def load_env_from_yaml():
-    """從 env.yaml 載入環境變數"""
+    """從 env.yaml 載入環境變數（只輸出一行摘要，不輸出變數值）"""
     try:
         if os.path.exists('env.yaml'):
             with open('env.yaml', 'r', encoding='utf-8') as f:
-                env_vars = yaml.safe_load(f)
-                for key, value in env_vars.items():
-                    os.environ[key] = str(value)
-                print(f"[調試] 從 env.yaml 載入了 {len(env_vars)} 個環境變數")
-                print(f"[調試] 載入的變數: {list(env_vars.keys())}")
-                
-                # 詳細檢查每個變數
-                for key, value in env_vars.items():
-                    if key == 'DB_PASS':
-                        print(f"[調試] {key}: {'已設定' if value else '未設定'}")
-                    else:
-                        print(f"[調試] {key}: {value}")
-                        
-                # 驗證載入結果
-                print(f"[調試] 驗證環境變數載入:")
-                for key in ['DB_HOST', 'DB_USER', 'DB_PASS', 'DB_NAME']:
-                    loaded_value = os.environ.get(key)
-                    print(f"[調試]   {key}: {'✓' if loaded_value else '✗'}")
-                        
+                env_vars = yaml.safe_load(f) or {}
+            for key, value in env_vars.items():
+                os.environ[key] = str(value)
+            missing = [key for key in ('DB_USER', 'DB_PASS', 'DB_NAME') if not os.environ.get(key)]
+            print(f"[調試] 從 env.yaml 載入了 {len(env_vars)} 個環境變數: {list(env_vars.keys())}"
+                  + (f"，缺少: {missing}" if missing else ""))
         else:
             print("[調試] env.yaml 檔案不存在")
     except Exception as e:
@@ -93,76 +84,66 @@ class StructuredLogger:
         }
         
         if level == 'ERROR':
-            self.logger.error(json.dumps(log_data, ensure_ascii=False))
+            self.logger.error(json.dumps(log_data, ensure_ascii=False, default=str))
         elif level == 'WARNING':
-            self.logger.warning(json.dumps(log_data, ensure_ascii=False))
+            self.logger.warning(json.dumps(log_data, ensure_ascii=False, default=str))
         elif level == 'DEBUG':
-            self.logger.debug(json.dumps(log_data, ensure_ascii=False))
+            self.logger.debug(json.dumps(log_data, ensure_ascii=False, default=str))
         else:
-            self.logger.info(json.dumps(log_data, ensure_ascii=False))
+            self.logger.info(json.dumps(log_data, ensure_ascii=False, default=str))
 
 logger = StructuredLogger(__name__)
 
+from modules import metrics
+from modules import profiling
+from modules import tracing
+from modules import memory
+from modules import startup_timing
+from modules import burst
+from modules import streaming
+from modules import cpu_topology
+from modules import admission
+from modules import jobs
+from modules import serialization
+from modules.request_limits import BodySizeLimitMiddleware, ImageTooLargeError, MAX_UPLOAD_BYTES
+from modules.request_tracking import RequestTrackingMiddleware
+from modules.admin_auth import is_admin
+
 # 創建FastAPI應用
 app = FastAPI(
     title="藥丸檢測API",
     description="使用YOLO模型進行藥丸檢測的FastAPI應用",
     version="2.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=serialization.FastJSONResponse
 )
 
-# 請求追蹤中間件
-@app.middleware("http")
-async def request_tracking_middleware(request: Request, call_next):
-    """請求追蹤和性能監控中間件"""
-    # 生成請求ID
-    request_id = str(uuid.uuid4())
-    request.state.request_id = request_id
-    
-    # 記錄請求開始
-    start_time = time.time()
-    
-    logger.info(
-        "Request started",
-        request_id=request_id,
-        method=request.method,
-        url=str(request.url),
-        client_ip=request.client.host if request.client else "unknown"
+def _draining_response(request: Request, request_id):
+    """關閉中拒絕新請求的 503 回應（格式與 HTTP 異常處理器相同）"""
+    exc = admission.ServiceDraining()
+    # 在路由之前就拒絕，scope 還沒有 route：只以已知的偵測 / 工作路由當指標標籤，其餘為 unmatched
+    path = request.url.path
+    endpoint = path if path in admission.ROUTE_LANES or path == "/api/jobs" else _route_path(request)
+    metrics.record_error(endpoint, f"http_{exc.status_code}")
+    response = JSONResponse(
+        status_code=exc.status_code,
+        content={
+            "success": False,
+            "error": exc.detail,
+            "request_id": request_id,
+            "timestamp": datetime.utcnow().isoformat()
+        },
+        headers=exc.headers
     )
-    
-    try:
-        # 處理請求
-        response = await call_next(request)
-        
-        # 計算處理時間
-        process_time = time.time() - start_time
-        
-        # 記錄請求完成
-        logger.info(
-            "Request completed",
-            request_id=request_id,
-            status_code=response.status_code,
-            process_time=round(process_time, 4)
-        )
-        
-        # 添加請求ID到響應頭
-        response.headers["X-Request-ID"] = request_id
-        response.headers["X-Process-Time"] = str(round(process_time, 4))
-        
-        return response
-        
-    except Exception as e:
-        # 記錄請求錯誤
-        process_time = time.time() - start_time
-        logger.error(
-            "Request failed",
-            request_id=request_id,
-            error=str(e),
-            process_time=round(process_time, 4),
-            traceback=traceback.format_exc()
-        )
-        raise
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+# 請求追蹤（請求 ID、處理時間標頭、抽樣日誌、記憶體量測、追蹤 span 與效能分析）
+app.add_middleware(RequestTrackingMiddleware, logger=logger, draining_response=_draining_response)
+
+# 限制請求本文大小（邊讀邊檢查，超過上限時回傳 413）
+app.add_middleware(BodySizeLimitMiddleware)
 
 # 添加CORS中間件
 app.add_middleware(
@@ -173,11 +154,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _route_path(request: Request):
+    """取得匹配到的路由路徑，避免以原始 URL 當作指標標籤"""
+    route = request.scope.get('route')
+    return getattr(route, 'path', 'unmatched')
+
 # 全域異常處理器
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """HTTP異常處理器"""
     request_id = getattr(request.state, 'request_id', 'unknown')
+    metrics.record_error(_route_path(request), f"http_{exc.status_code}")
     
     logger.error(
         "HTTP Exception",
@@ -194,18 +181,22 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             "error": exc.detail,
             "request_id": request_id,
             "timestamp": datetime.utcnow().isoformat()
-        }
+        },
+        headers=exc.headers
     )
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     """請求驗證異常處理器"""
     request_id = getattr(request.state, 'request_id', 'unknown')
+    metrics.record_error(_route_path(request), "validation")
+    # 上傳檔案欄位驗證失敗時，錯誤內容會包含 UploadFile 物件，需轉成可序列化的值
+    errors = jsonable_encoder(exc.errors(), custom_encoder={UploadFile: lambda f: f.filename})
     
     logger.error(
         "Validation Error",
         request_id=request_id,
-        errors=exc.errors(),
+        errors=errors,
         url=str(request.url)
     )
     
@@ -214,7 +205,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content={
             "success": False,
             "error": "請求參數驗證失敗",
-            "details": exc.errors(),
+            "details": errors,
             "request_id": request_id,
             "timestamp": datetime.utcnow().isoformat()
         }
@@ -224,6 +215,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 async def general_exception_handler(request: Request, exc: Exception):
     """通用異常處理器"""
     request_id = getattr(request.state, 'request_id', 'unknown')
+    metrics.record_error(_route_path(request), type(exc).__name__)
     
     logger.error(
         "Unhandled Exception",
@@ -247,17 +239,92 @@ async def general_exception_handler(request: Request, exc: Exception):
 # 全域變數來存儲模型
 models_loaded = False
 loaded_models = {}
+# 批次工作佇列（第一次使用時建立）與本行程啟動的 worker
+job_store = None
+job_workers = None
 
 # Pydantic模型定義
+class AnnotatedImageOptions(BaseModel):
+    """標註圖片輸出選項（未指定的欄位使用伺服器預設值）"""
+    format: Optional[Literal["jpeg", "webp", "png"]] = Field(None, description="輸出格式")
+    quality: Optional[int] = Field(None, ge=1, le=100, description="JPEG / WebP 品質（PNG 不適用）")
+    max_dimension: Optional[int] = Field(None, ge=64, le=8192, description="最長邊像素上限，只縮小不放大")
+    thumbnail_size: Optional[int] = Field(None, ge=32, le=1024, description="另外產生最長邊為此尺寸的縮圖")
+
+class Detection(BaseModel):
+    """單一偵測結果"""
+    class_name: str = Field(..., description="模型的類別名稱")
+    class_id: int = Field(..., description="模型的類別索引")
+    drug_id: Optional[str] = Field(None, description="對應的藥品ID（藥品目錄中沒有對應時為 null）")
+    confidence: float = Field(..., description="信心度（小數三位）")
+    bbox: List[int] = Field(..., description="邊界框 [x0, y0, x1, y1]（像素）")
+    color: str = Field(..., description="標註顏色")
+
+class ColumnarDetections(BaseModel):
+    """偵測結果的平行陣列格式（response_format=columnar）：各陣列的第 i 個元素屬於同一個偵測"""
+    boxes: List[List[int]] = Field(..., description="邊界框 [x0, y0, x1, y1]（像素）")
+    confidences: List[float]
+    class_ids: List[int]
+    drug_ids: List[Optional[str]]
+    class_names: Dict[str, str] = Field(..., description="出現過的類別：類別索引 -> 類別名稱")
+
+class PillInfo(BaseModel):
+    """藥品資訊（來自 drug_info）"""
+    drug_id: str
+    drug_name_en: Optional[str] = None
+    drug_name_zh: Optional[str] = None
+    uses: Optional[str] = None
+    side_effects: Optional[str] = None
+    shape: Optional[str] = None
+    color: Optional[str] = None
+    interactions: Optional[str] = None
+    image_url: Optional[str] = None
+    display_label: Optional[str] = Field(None, description="標註圖片上顯示的標籤")
+
+# 偵測結果的輸出格式：objects（每個偵測一個物件）或 columnar（平行陣列）
+ResponseFormat = Literal["objects", "columnar"]
+
+# 推論尺寸：32～4096 的整數，或 "auto" 依圖片解析度決定
+ImageSize = Union[Literal["auto"], conint(ge=32, le=4096)]
+
+class InferenceOptions(BaseModel):
+    """推論參數（未指定的欄位使用伺服器預設值）"""
+    conf: Optional[float] = Field(None, ge=0, le=1, description="信心度門檻（預設 0.7）")
+    iou: Optional[float] = Field(None, ge=0, le=1, description="NMS 的 IoU 門檻（預設 0.7）")
+    imgsz: Optional[ImageSize] = Field(None, description="推論尺寸（預設 640），auto 依圖片解析度決定")
+    max_det: Optional[int] = Field(None, ge=1, le=1000, description="每張圖片最多偵測數（預設 300）")
+    classes: Optional[List[Union[int, str]]] = Field(None, description="只偵測這些類別（類別名稱或索引）")
+
 class DetectionRequest(BaseModel):
     """檢測請求模型"""
     image: str = Field(..., description="Base64編碼的圖片")
     model_name: Optional[str] = Field(None, description="指定使用的模型名稱")
+    include_timings: bool = Field(False, description="是否在響應中回傳各階段耗時（毫秒）")
+    output: Optional[AnnotatedImageOptions] = Field(None, description="標註圖片的格式、品質與尺寸")
+    cascade: bool = Field(False, description="兩階段串接偵測：低解析度定位後，從原圖裁切候選框整批辨識")
+    inference: Optional[InferenceOptions] = Field(None, description="推論參數（conf、iou、imgsz、max_det、classes）")
+    response_format: ResponseFormat = Field("objects", description="偵測結果格式：objects 或 columnar（平行陣列）")
 
 class SimpleDetectionRequest(BaseModel):
     """簡化檢測請求模型"""
     image: str = Field(..., description="Base64編碼的圖片")
     model_name: Optional[str] = Field(None, description="指定使用的模型名稱")
+    include_timings: bool = Field(False, description="是否在響應中回傳各階段耗時（毫秒）")
+    cascade: bool = Field(False, description="兩階段串接偵測：低解析度定位後，從原圖裁切候選框整批辨識")
+    inference: Optional[InferenceOptions] = Field(None, description="推論參數（conf、iou、imgsz、max_det、classes）")
+    response_format: ResponseFormat = Field("objects", description="偵測結果格式：objects 或 columnar（平行陣列）")
+
+class JobItem(BaseModel):
+    """批次工作中的一張圖片（uri 與 image 擇一）"""
+    id: Optional[str] = Field(None, description="客戶端自訂的識別碼，原樣回傳於結果中")
+    uri: Optional[str] = Field(None, description="圖片位置：允許清單中的 gs://、http(s)://，或 JOB_INPUT_ROOT 下的相對路徑")
+    image: Optional[str] = Field(None, description="Base64編碼的圖片")
+
+class JobRequest(BaseModel):
+    """批次工作請求模型"""
+    items: List[JobItem] = Field(..., min_length=1, description="要偵測的圖片")
+    model_name: Optional[str] = Field(None, description="指定使用的模型名稱")
+    inference: Optional[InferenceOptions] = Field(None, description="推論參數（conf、iou、imgsz、max_det、classes）")
 
 class HealthResponse(BaseModel):
     """健康檢查響應模型"""
@@ -270,19 +337,22 @@ class HealthResponse(BaseModel):
 class DetectionResponse(BaseModel):
     """檢測響應模型"""
     success: bool
-    detections: List[Dict[str, Any]]
-    pills_info: List[Dict[str, Any]]
+    detections: Union[List[Detection], ColumnarDetections]
+    pills_info: List[PillInfo]
     annotated_image_url: Optional[str]
+    annotated_images: Optional[Dict[str, Dict[str, Any]]] = None
     elapsed_time: float
     model_name: str
     message: Optional[str] = None
+    timings: Optional[Dict[str, float]] = None
 
 class SimpleDetectionResponse(BaseModel):
     """簡化檢測響應模型"""
     success: bool
-    detections: List[Dict[str, Any]]
+    detections: Union[List[Detection], ColumnarDetections]
     elapsed_time: float
     model_name: str
+    timings: Optional[Dict[str, float]] = None
 
 class ModelsResponse(BaseModel):
     """模型列表響應模型"""
@@ -294,12 +364,57 @@ class ModelsResponse(BaseModel):
 async def startup_event():
     """應用啟動時的初始化"""
     logger.info("🚀 FastAPI應用啟動中...")
+    startup_started_at = time.perf_counter()
+    # 在建立推論與其他工作執行緒之前綁定 CPU（之後建立的執行緒會繼承）
+    cpu_topology.apply_affinity()
+    # 收到 SIGTERM 時立即停止接受新請求，不必等 uvicorn 處理完進行中的請求才進入關閉流程
+    admission.install_drain_signal_handler(start_draining)
+    tracing.configure_tracing()
+    memory.start_tracing()
     await initialize_models_async()
+    if jobs.JOB_WORKERS > 0:
+        # 批次工作的 worker 是獨立行程，各自載入模型，不佔用 API 的推論執行緒
+        global job_workers
+        job_workers = jobs.WorkerPool(jobs.JOB_WORKERS).start()
+        logger.info(f"批次工作 worker 已啟動: {jobs.JOB_WORKERS} 個")
+    startup_timing.record_phase("startup_total", time.perf_counter() - startup_started_at)
+    logger.info("啟動階段耗時", phases_ms=startup_timing.phases_ms())
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """應用關閉時的清理"""
     logger.info("🛑 FastAPI應用關閉中...")
+    start_draining()
+    
+    # 佇列中來得及的推論做完（來不及的已在開始關閉時回傳 503）
+    if not await inference_scheduler.wait_idle(admission.drain_remaining()):
+        logger.warning("寬限期內未能完成佇列中的推論", queue_depths=inference_scheduler.queue_depths())
+    
+    # 標註與 GCS 上傳在 blocking 執行緒中進行；請求被 uvicorn 取消時執行緒仍在上傳，等它們完成
+    if not await _shutdown_executor(blocking_executor, admission.drain_remaining()):
+        logger.warning("寬限期內未能完成所有上傳")
+    
+    # 批次工作的 worker 做完手上這一批（來不及的在租約到期後由其他 worker 重做）
+    if job_workers is not None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, job_workers.stop, max(1.0, admission.drain_remaining()))
+    
+    tracing.shutdown_tracing()
+    logger.info("✅ 關閉完成", drain_remaining_s=round(admission.drain_remaining(), 2))
+
+def start_draining():
+    """開始關閉：停止接受新請求，佇列中預估來不及推論的請求回傳 503"""
+    if admission.begin_drain():
+        inference_scheduler.shed_for_drain()
+
+async def _shutdown_executor(executor, timeout):
+    """等待執行緒池中已送出的工作完成，回傳是否在 timeout 秒內完成"""
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.wait_for(loop.run_in_executor(None, executor.shutdown, True), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
 
 # 模型管理函數
 async def initialize_models_async():
@@ -310,20 +425,16 @@ async def initialize_models_async():
         logger.info("正在初始化YOLO模型...")
         
         # 導入相關模組
-        from modules.yolo_pill_analyzer import initialize_models as init_yolo_models
-        from modules.yolo_pill_analyzer import get_available_models
-        
-        # 初始化模型
-        init_yolo_models()
+        with startup_timing.phase("import_analyzer"):
+            from modules.yolo_pill_analyzer import initialize_models as init_yolo_models
+            from modules.yolo_pill_analyzer import get_available_models
         
-        # 初始化資料庫連線池
-        logger.info("正在初始化資料庫連線池...")
-        from db_cloud_sql import get_db_connection_pool
-        db_pool = get_db_connection_pool()
-        if db_pool:
-            logger.info("✅ 資料庫連線池初始化成功")
-        else:
-            logger.error("❌ 資料庫連線池初始化失敗，請檢查 env.yaml 設定與日誌")
+        # 模型載入與資料庫初始化互不依賴，同時進行以縮短冷啟動；
+        # 模型在推論執行緒中載入，之後的推論也在同一個執行緒
+        await asyncio.gather(
+            run_blocking(_initialize_yolo_models, init_yolo_models, executor=inference_executor),
+            run_blocking(_initialize_database),
+        )
         
         # 檢查可用模型
         available_models = get_available_models()
@@ -336,6 +447,25 @@ async def initialize_models_async():
         logger.error(f"❌ 模型初始化失敗: {str(e)}")
         models_loaded = False
 
+def _initialize_yolo_models(init_yolo_models):
+    with startup_timing.phase("models"):
+        init_yolo_models()
+
+def _initialize_database():
+    """初始化資料庫連線池並載入藥品目錄"""
+    logger.info("正在初始化資料庫連線池...")
+    with startup_timing.phase("db_import"):
+        from db_cloud_sql import get_db_connection_pool, load_drug_catalog
+    with startup_timing.phase("db_pool"):
+        db_pool = get_db_connection_pool()
+    if db_pool:
+        logger.info("✅ 資料庫連線池初始化成功")
+        with startup_timing.phase("drug_catalog"):
+            catalog_size = load_drug_catalog()
+        logger.info(f"藥品目錄已載入: {catalog_size} 筆")
+    else:
+        logger.error("❌ 資料庫連線池初始化失敗，請檢查 env.yaml 設定與日誌")
+
 def get_available_models():
     """獲取可用模型列表"""
     try:
@@ -348,32 +478,35 @@ def get_available_models():
         logger.error(f"獲取模型列表失敗: {str(e)}")
         return []
 
-def detect_pills_internal(model_name, image_pil):
-    """內部檢測函數"""
+def detect_pills_internal(model_name, image, cascade=False, options=None):
+    """內部檢測函數（cascade 為 True 時使用兩階段串接偵測，options 為推論參數）"""
     try:
         if not models_loaded:
             return {'error': '模型尚未載入'}
         
+        if cascade:
+            from modules.yolo_pill_analyzer import detect_pills_cascade
+            return detect_pills_cascade(model_name, image, options)
         from modules.yolo_pill_analyzer import detect_pills
-        return detect_pills(model_name, image_pil)
+        return detect_pills(model_name, image, options)
     except Exception as e:
         logger.error(f"檢測失敗: {str(e)}")
         return {'error': f'檢測過程中發生錯誤: {str(e)}'}
 
-def create_annotated_image_internal(image_pil, detections, pills_info):
-    """內部圖片標註函數"""
+def create_annotated_image_internal(image, detections, pills_info, output_options=None):
+    """內部圖片標註函數，回傳各輸出版本（full / thumbnail）的 URL 與編碼資訊"""
     try:
         if not models_loaded:
             print("[調試] 模型未載入，跳過圖片標註")
             return None
         
-        print(f"[調試] 開始調用 create_and_upload_annotated_image")
+        print(f"[調試] 開始調用 create_and_upload_annotated_images")
         print(f"[調試] 參數 - 檢測數量: {len(detections)}, 藥品資訊: {len(pills_info)}")
         
-        from modules.yolo_pill_analyzer import create_and_upload_annotated_image
-        result = create_and_upload_annotated_image(image_pil, detections, pills_info)
+        from modules.yolo_pill_analyzer import create_and_upload_annotated_images
+        result = create_and_upload_annotated_images(image, detections, pills_info, output_options)
         
-        print(f"[調試] create_and_upload_annotated_image 返回結果: {result}")
+        print(f"[調試] create_and_upload_annotated_images 返回結果: {result}")
         return result
     except Exception as e:
         logger.error(f"圖片標註失敗: {str(e)}")
@@ -382,6 +515,184 @@ def create_annotated_image_internal(image_pil, detections, pills_info):
         traceback.print_exc()
         return None
 
+def detect_pills_batch_internal(model_name, images, options=None):
+    """內部批次檢測函數（影片 / 連拍）"""
+    try:
+        if not models_loaded:
+            return {'error': '模型尚未載入'}
+        
+        from modules.yolo_pill_analyzer import detect_pills_batch
+        return detect_pills_batch(model_name, images, options=options)
+    except Exception as e:
+        logger.error(f"批次檢測失敗: {str(e)}")
+        return {'error': f'批次檢測過程中發生錯誤: {str(e)}'}
+
+def inference_query_options(
+    conf: Optional[float] = Query(None, ge=0, le=1, description="信心度門檻（預設 0.7）"),
+    iou: Optional[float] = Query(None, ge=0, le=1, description="NMS 的 IoU 門檻（預設 0.7）"),
+    imgsz: Optional[ImageSize] = Query(None, description="推論尺寸（預設 640），auto 依圖片解析度決定"),
+    max_det: Optional[int] = Query(None, ge=1, le=1000, description="每張圖片最多偵測數（預設 300）"),
+    classes: Optional[List[str]] = Query(None, description="只偵測這些類別（類別名稱或索引，可重複指定）"),
+):
+    """上傳、連拍與串流端點以查詢參數指定推論參數"""
+    options = {"conf": conf, "iou": iou, "imgsz": imgsz, "max_det": max_det, "classes": classes}
+    return options if any(value is not None for value in options.values()) else None
+
+def build_inference_options(model_name, options):
+    """請求的推論參數 -> 傳給分析模組的字典（類別名稱轉成索引），模型沒有的類別回傳 400"""
+    if options is None:
+        return None
+    options = dict(options)
+    if options.get('classes') is not None:
+        from modules.yolo_pill_analyzer import resolve_class_filter
+        try:
+            options['classes'] = resolve_class_filter(model_name, options['classes'])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return options
+
+# 模型推論專用的單一執行緒（ultralytics 模型物件不保證執行緒安全）
+inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+# 解碼、標註、資料庫查詢等其他阻塞工作；執行緒數量固定且不多，
+# 因為每個處理大圖的執行緒都會讓 glibc 多保留一個 malloc arena，RSS 會隨執行緒數膨脹
+BLOCKING_WORKERS = int(os.environ.get("BLOCKING_WORKERS", "4"))
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+async def run_blocking(func, *args, executor=None):
+    """
+    在執行緒中執行阻塞函式，避免卡住事件迴圈
+    會複製目前的 contextvars，讓追蹤 span、指標標籤與效能分析在執行緒中延續
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        executor or blocking_executor, functools.partial(context.run, profiling.profile_blocking, func, *args)
+    )
+
+def get_job_store():
+    global job_store
+    if job_store is None:
+        job_store = jobs.JobStore()
+    return job_store
+
+# 推論請求依優先通道排隊，輪到時期限已過的請求不推論（回傳 504）
+inference_scheduler = admission.InferenceScheduler(functools.partial(run_blocking, executor=inference_executor))
+
+def decode_image_bytes(image_data):
+    """將圖片解碼為 BGR NumPy 陣列（已套用 EXIF 方向），PIL 圖片只在標註時才建立"""
+    # 第一次解碼時才匯入 NumPy / PIL / OpenCV
+    from modules.image_decode import decode_to_array
+
+    with metrics.stage_timer("image_decode"):
+        return decode_to_array(image_data)
+
+def decode_base64_image(image_b64):
+    """解碼 Base64 圖片，回傳 BGR NumPy 陣列"""
+    with metrics.stage_timer("base64_decode"):
+        image_data = base64.b64decode(image_b64)
+    return decode_image_bytes(image_data)
+
+def load_burst_frames(video_data, images_data, max_frames):
+    """影片或連拍圖片 -> (畫面索引, BGR 陣列) 列表"""
+    if video_data is not None:
+        with metrics.stage_timer("video_decode"):
+            return burst.sample_video_frames(video_data, max_frames)
+    with metrics.stage_timer("image_decode"):
+        return burst.decode_frames(images_data, max_frames)
+
+def deduplicate_burst_frames(frames, threshold):
+    """略過近似重複的畫面，回傳 (保留的畫面, 略過的數量)"""
+    with metrics.stage_timer("frame_dedup"):
+        return burst.deduplicate_frames(frames, threshold)
+
+def track_burst_detections(frame_indices, frame_detections, min_frames):
+    """跨畫面追蹤並彙整，回傳 (每顆藥丸一筆的偵測列表, 各畫面的偵測列表（含 track_id）)"""
+    from modules.tracking import IoUTracker
+    from modules.yolo_pill_analyzer import get_color_for_index
+
+    with metrics.stage_timer("tracking"):
+        tracker = IoUTracker()
+        frames = []
+        for frame_index, detections in zip(frame_indices, frame_detections):
+            track_ids = tracker.update(frame_index, detections)
+            frames.append({
+                'frame_index': frame_index,
+                'detections': [dict(det, track_id=track_id) for det, track_id in zip(detections, track_ids)],
+            })
+        consolidated = tracker.consolidate(min_frames)
+    # 彙整後重新分配顏色，讓每顆藥丸的顏色不重複
+    for i, det in enumerate(consolidated):
+        det['color'] = get_color_for_index(i)
+    return consolidated, frames
+
+async def receive_stream_frames(websocket: WebSocket, slot):
+    """串流接收端：只保留最新的二進位畫面（文字訊息忽略），連線中斷時通知處理端"""
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                slot.put(message["bytes"])
+    finally:
+        slot.close()
+
+async def process_stream_frame(model_name, seq, data, dropped, include_timings, options=None):
+    """處理一個串流畫面，回傳要送給客戶端的精簡訊息"""
+    start_time = time.perf_counter()
+    timings = metrics.start_request_timings()
+    if len(data) > MAX_UPLOAD_BYTES:
+        metrics.record_stream_frames("error")
+        return {"type": "error", "seq": seq, "error": f"畫面超過上限 {MAX_UPLOAD_BYTES / (1024 * 1024):.1f} MB"}
+    try:
+        image = await run_blocking(decode_image_bytes, data)
+    except Exception as e:
+        metrics.record_stream_frames("error")
+        return {"type": "error", "seq": seq, "error": f"圖片解碼失敗: {str(e)}"}
+
+    # 串流畫面本身就是最新一格優先，不設期限；通道與其他端點一樣由 ROUTE_LANES 決定
+    detection_result = await inference_scheduler.run(
+        detect_pills_internal, model_name, image, False, options, lane=admission.ROUTE_LANES["/ws/detect"]
+    )
+    if 'error' in detection_result:
+        metrics.record_stream_frames("error")
+        return {"type": "error", "seq": seq, "error": detection_result['error']}
+
+    metrics.record_stream_frames("processed")
+    timings['total'] = time.perf_counter() - start_time
+    message = {
+        "type": "det",
+        "seq": seq,
+        "dropped": dropped,
+        "ms": round(timings['total'] * 1000, 1),
+        "det": streaming.compact_detections(detection_result['detections']),
+    }
+    if include_timings:
+        message["timings"] = metrics.timings_ms(timings)
+    return message
+
+async def send_stream_message(websocket: WebSocket, message):
+    """以不含空白的 JSON 送出串流訊息"""
+    await websocket.send_text(json.dumps(message, ensure_ascii=False, separators=(",", ":")))
+
+def detection_response(http_response: Response, content):
+    """
+    偵測結果已是純 dict / list，直接以 FastJSONResponse 回傳，略過 response_model 的重複驗證與轉換；
+    帶上端點在 http_response 設定的標頭（例如 Server-Timing）
+    """
+    response = serialization.FastJSONResponse(content)
+    response.headers.raw.extend(
+        (name, value) for name, value in http_response.headers.raw if name != b"content-length"
+    )
+    return response
+
+def finalize_timings(http_response: Response, timings, start_time, include_timings):
+    """加入 Server-Timing 標頭，並依請求決定是否回傳 timings 欄位（毫秒）"""
+    timings['total'] = time.perf_counter() - start_time
+    http_response.headers["Server-Timing"] = metrics.format_server_timing(timings)
+    http_response.headers["Timing-Allow-Origin"] = "*"
+    return metrics.timings_ms(timings) if include_timings else None
+
 async def ensure_models_loaded():
     """確保模型已載入"""
     global models_loaded
@@ -390,7 +701,7 @@ async def ensure_models_loaded():
 
 # API端點定義
 @app.get("/health", response_model=HealthResponse)
-async def health_check():
+async def health_check(http_response: Response):
     """
     健康檢查端點
     檢查應用狀態、模型載入狀態和各服務狀態
@@ -421,8 +732,19 @@ async def health_check():
                 'error': str(e)
             }
         
+        services['startup'] = startup_timing.phases_ms()
+        services['cpu'] = cpu_topology.describe()
+        services['inference_queue'] = inference_scheduler.queue_depths()
+        if job_store is not None or job_workers is not None:
+            services['jobs'] = {
+                'pending_items': await run_blocking(get_job_store().pending_count),
+                'workers': job_workers.alive() if job_workers is not None else 0,
+            }
+        
+        if admission.is_draining():
+            http_response.status_code = 503
         return HealthResponse(
-            status='healthy' if models_loaded else 'degraded',
+            status='draining' if admission.is_draining() else 'healthy' if models_loaded else 'degraded',
             timestamp=datetime.utcnow().isoformat(),
             models_loaded=models_loaded,
             available_models=available_models,
@@ -432,6 +754,20 @@ async def health_check():
         logger.error(f"健康檢查失敗: {str(e)}")
         raise HTTPException(status_code=500, detail=f"健康檢查失敗: {str(e)}")
 
+@app.get("/api/load")
+async def load_signal(http_response: Response):
+    """
+    負載訊號（供自動擴展或負載平衡器使用）
+    推論執行緒的使用率、各通道佇列長度與新請求的預估等待時間；關閉中回傳 503
+    """
+    load = inference_scheduler.load()
+    metrics.set_load(load)
+    load["active_streams"] = streaming.active_sessions()
+    if admission.is_draining():
+        http_response.status_code = 503
+        load["drain_remaining_s"] = round(admission.drain_remaining(), 2)
+    return {"success": True, "timestamp": datetime.utcnow().isoformat(), **load}
+
 @app.get("/api/models", response_model=ModelsResponse)
 async def get_models():
     """
@@ -448,12 +784,15 @@ async def get_models():
         raise HTTPException(status_code=500, detail=f"獲取模型列表失敗: {str(e)}")
 
 @app.post("/api/detect", response_model=DetectionResponse)
-async def detect_pills_api(request: DetectionRequest, http_request: Request):
+async def detect_pills_api(request: DetectionRequest, http_request: Request, http_response: Response):
     """
     藥丸檢測API端點
     上傳圖片進行藥丸檢測，返回檢測結果、藥品資訊和標註圖片
     """
     request_id = getattr(http_request.state, 'request_id', 'unknown')
+    metrics.set_request_labels("/api/detect")
+    start_time = time.perf_counter()
+    timings = metrics.start_request_timings()
     
     try:
         logger.info("Starting pill detection", request_id=request_id)
@@ -496,23 +835,23 @@ async def detect_pills_api(request: DetectionRequest, http_request: Request):
                 detail=f"模型 {model_name} 不可用，可用模型: {available_models}"
             )
         
+        # 通過驗證後才以模型名稱作為指標標籤（避免任意字串產生新的時間序列）
+        metrics.set_model_name(model_name)
+        inference_options = build_inference_options(model_name, request.inference)
+        
         # 解碼base64圖片
         try:
             logger.info("Decoding image", request_id=request_id)
-            image_data = base64.b64decode(request.image)
-            image_pil = Image.open(io.BytesIO(image_data))
+            image = await run_blocking(decode_base64_image, request.image)
             
             logger.info(
                 "Image decoded successfully", 
                 request_id=request_id,
-                image_size=image_pil.size,
-                image_mode=image_pil.mode
+                image_size=(image.shape[1], image.shape[0])
             )
-            
-            if image_pil.mode in ('RGBA', 'LA', 'P'):
-                image_pil = image_pil.convert('RGB')
-                logger.info("Image converted to RGB", request_id=request_id)
                 
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             logger.error(
                 "Image decoding failed", 
@@ -523,7 +862,9 @@ async def detect_pills_api(request: DetectionRequest, http_request: Request):
         
         # 執行YOLO檢測
         logger.info("Starting YOLO detection", request_id=request_id, model_name=model_name)
-        detection_result = detect_pills_internal(model_name, image_pil)
+        detection_result = await inference_scheduler.run(
+            detect_pills_internal, model_name, image, request.cascade, inference_options
+        )
         
         if 'error' in detection_result:
             logger.error(
@@ -546,45 +887,54 @@ async def detect_pills_api(request: DetectionRequest, http_request: Request):
         # 如果沒有檢測到任何藥丸
         if not detections:
             logger.info("No pills detected", request_id=request_id)
-            return DetectionResponse(
-                success=True,
-                detections=[],
-                pills_info=[],
-                annotated_image_url=None,
-                elapsed_time=elapsed_time,
-                model_name=model_name,
-                message='未檢測到任何藥丸'
-            )
+            return detection_response(http_response, {
+                "success": True,
+                "detections": serialization.format_detections([], request.response_format),
+                "pills_info": [],
+                "annotated_image_url": None,
+                "annotated_images": None,
+                "elapsed_time": elapsed_time,
+                "model_name": model_name,
+                "message": '未檢測到任何藥丸',
+                "timings": finalize_timings(http_response, timings, start_time, request.include_timings)
+            })
         
-        # 獲取檢測到的藥丸ID列表
-        detected_drug_ids = [det['class_name'] for det in detections]
+        # 偵測結果已在模型載入時綁定藥品目錄；目錄未載入時才查詢資料庫
+        pills_info_from_db = detection_result.get('pills_info')
+        if pills_info_from_db is None:
+            # 獲取檢測到的藥丸ID列表
+            detected_drug_ids = [det['class_name'] for det in detections]
+            pills_info_from_db = []
+            try:
+                logger.info(
+                    "Querying database for pill information", 
+                    request_id=request_id,
+                    detected_drug_ids=detected_drug_ids,
+                    model_name=model_name
+                )
+                
+                from db_cloud_sql import get_pills_details_by_ids
+                with metrics.stage_timer("db_lookup"):
+                    pills_info_from_db = await run_blocking(
+                        get_pills_details_by_ids, detected_drug_ids, model_name
+                    )
+                
+                logger.info(
+                    "Database query completed", 
+                    request_id=request_id,
+                    pills_found=len(pills_info_from_db)
+                )
+                
+            except Exception as e:
+                logger.warning(
+                    "Failed to get pill information from database", 
+                    request_id=request_id,
+                    error=str(e),
+                    traceback=traceback.format_exc()
+                )
         
-        # 從資料庫獲取藥丸資訊
-        pills_info_from_db = []
-        try:
-            logger.info(
-                "Querying database for pill information", 
-                request_id=request_id,
-                detected_drug_ids=detected_drug_ids,
-                model_name=model_name
-            )
-            
-            from db_cloud_sql import get_pills_details_by_ids
-            pills_info_from_db = get_pills_details_by_ids(detected_drug_ids, model_name)
-            
-            logger.info(
-                "Database query completed", 
-                request_id=request_id,
-                pills_found=len(pills_info_from_db)
-            )
-            
-        except Exception as e:
-            logger.warning(
-                "Failed to get pill information from database", 
-                request_id=request_id,
-                error=str(e),
-                traceback=traceback.format_exc()
-            )
+        # 標註與上傳也很耗時，期限已過就不再處理
+        admission.check_deadline("annotate")
         
         # 創建並上傳標註圖片（包含中文標籤）
         logger.info(
@@ -594,14 +944,17 @@ async def detect_pills_api(request: DetectionRequest, http_request: Request):
             pills_info_count=len(pills_info_from_db)
         )
         
-        annotated_image_url = create_annotated_image_internal(
-            image_pil, detections, pills_info_from_db
+        output_options = dict(request.output) if request.output is not None else None
+        annotated_images = await run_blocking(
+            create_annotated_image_internal, image, detections, pills_info_from_db, output_options
         )
+        annotated_image_url = annotated_images['full']['url'] if annotated_images else None
         
         logger.info(
             "Annotated image created", 
             request_id=request_id,
-            image_url=annotated_image_url
+            image_url=annotated_image_url,
+            annotated_images=annotated_images
         )
         
         logger.info(
@@ -611,14 +964,17 @@ async def detect_pills_api(request: DetectionRequest, http_request: Request):
             total_pills_info=len(pills_info_from_db)
         )
         
-        return DetectionResponse(
-            success=True,
-            detections=detections,
-            pills_info=pills_info_from_db,
-            annotated_image_url=annotated_image_url,
-            elapsed_time=elapsed_time,
-            model_name=model_name
-        )
+        return detection_response(http_response, {
+            "success": True,
+            "detections": serialization.format_detections(detections, request.response_format),
+            "pills_info": pills_info_from_db,
+            "annotated_image_url": annotated_image_url,
+            "annotated_images": annotated_images,
+            "elapsed_time": elapsed_time,
+            "model_name": model_name,
+            "message": None,
+            "timings": finalize_timings(http_response, timings, start_time, request.include_timings)
+        })
         
     except HTTPException:
         raise
@@ -633,11 +989,14 @@ async def detect_pills_api(request: DetectionRequest, http_request: Request):
         raise HTTPException(status_code=500, detail=f"內部伺服器錯誤: {str(e)}")
 
 @app.post("/api/detect/simple", response_model=SimpleDetectionResponse)
-async def detect_pills_simple(request: SimpleDetectionRequest):
+async def detect_pills_simple(request: SimpleDetectionRequest, http_response: Response):
     """
     簡化版檢測API，只返回檢測結果，不創建標註圖片
     適用於只需要檢測結果的場景，響應更快
     """
+    metrics.set_request_labels("/api/detect/simple")
+    start_time = time.perf_counter()
+    timings = metrics.start_request_timings()
     try:
         # 確保模型已載入
         await ensure_models_loaded()
@@ -661,27 +1020,32 @@ async def detect_pills_simple(request: SimpleDetectionRequest):
                 detail=f"模型 {model_name} 不可用，可用模型: {available_models}"
             )
         
+        metrics.set_model_name(model_name)
+        inference_options = build_inference_options(model_name, request.inference)
+        
         # 解碼圖片
         try:
-            image_data = base64.b64decode(request.image)
-            image_pil = Image.open(io.BytesIO(image_data))
-            if image_pil.mode in ('RGBA', 'LA', 'P'):
-                image_pil = image_pil.convert('RGB')
+            image = await run_blocking(decode_base64_image, request.image)
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"圖片解碼失敗: {str(e)}")
         
         # 執行檢測
-        detection_result = detect_pills_internal(model_name, image_pil)
+        detection_result = await inference_scheduler.run(
+            detect_pills_internal, model_name, image, request.cascade, inference_options
+        )
         
         if 'error' in detection_result:
             raise HTTPException(status_code=500, detail=detection_result['error'])
         
-        return SimpleDetectionResponse(
-            success=True,
-            detections=detection_result['detections'],
-            elapsed_time=detection_result['elapsed_time'],
-            model_name=model_name
-        )
+        return detection_response(http_response, {
+            "success": True,
+            "detections": serialization.format_detections(detection_result['detections'], request.response_format),
+            "elapsed_time": detection_result['elapsed_time'],
+            "model_name": model_name,
+            "timings": finalize_timings(http_response, timings, start_time, request.include_timings)
+        })
         
     except HTTPException:
         raise
@@ -690,11 +1054,17 @@ async def detect_pills_simple(request: SimpleDetectionRequest):
         raise HTTPException(status_code=500, detail=f"內部伺服器錯誤: {str(e)}")
 
 @app.post("/api/detect/upload")
-async def detect_pills_upload(file: UploadFile = File(...), model_name: Optional[str] = None):
+async def detect_pills_upload(http_response: Response, file: UploadFile = File(...), model_name: Optional[str] = None,
+                              include_timings: bool = False, cascade: bool = False,
+                              inference: Optional[dict] = Depends(inference_query_options),
+                              response_format: ResponseFormat = "objects"):
     """
     通過文件上傳進行藥丸檢測
     支持直接上傳圖片文件
     """
+    metrics.set_request_labels("/api/detect/upload")
+    start_time = time.perf_counter()
+    timings = metrics.start_request_timings()
     try:
         # 確保模型已載入
         await ensure_models_loaded()
@@ -706,15 +1076,86 @@ async def detect_pills_upload(file: UploadFile = File(...), model_name: Optional
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="只支持圖片文件")
         
+        # 獲取模型名稱
+        available_models = get_available_models()
+        if not available_models:
+            raise HTTPException(status_code=500, detail="沒有可用的模型")
+        
+        if model_name is None:
+            model_name = available_models[0]
+        elif model_name not in available_models:
+            raise HTTPException(
+                status_code=400,
+                detail=f"模型 {model_name} 不可用，可用模型: {available_models}"
+            )
+        
+        metrics.set_model_name(model_name)
+        inference_options = build_inference_options(model_name, inference)
+        
         # 讀取圖片
         try:
             image_data = await file.read()
-            image_pil = Image.open(io.BytesIO(image_data))
-            if image_pil.mode in ('RGBA', 'LA', 'P'):
-                image_pil = image_pil.convert('RGB')
+            image = await run_blocking(decode_image_bytes, image_data)
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"圖片讀取失敗: {str(e)}")
         
+        # 執行檢測
+        detection_result = await inference_scheduler.run(
+            detect_pills_internal, model_name, image, cascade, inference_options
+        )
+        
+        if 'error' in detection_result:
+            raise HTTPException(status_code=500, detail=detection_result['error'])
+        
+        response_body = {
+            "success": True,
+            "filename": file.filename,
+            "detections": serialization.format_detections(detection_result['detections'], response_format),
+            "elapsed_time": detection_result['elapsed_time'],
+            "model_name": model_name
+        }
+        response_timings = finalize_timings(http_response, timings, start_time, include_timings)
+        if response_timings is not None:
+            response_body["timings"] = response_timings
+        return response_body
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"文件上傳檢測錯誤: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"內部伺服器錯誤: {str(e)}")
+
+@app.post("/api/detect/burst")
+async def detect_pills_burst(http_response: Response,
+                             video: Optional[UploadFile] = File(None),
+                             files: List[UploadFile] = File(None),
+                             model_name: Optional[str] = None,
+                             max_frames: int = Query(burst.DEFAULT_SAMPLE_FRAMES, ge=1, le=burst.MAX_FRAMES),
+                             dedup_threshold: float = Query(burst.DEFAULT_DEDUP_THRESHOLD, ge=0),
+                             min_frames: int = Query(1, ge=1),
+                             include_frames: bool = False,
+                             include_timings: bool = False,
+                             inference: Optional[dict] = Depends(inference_query_options)):
+    """
+    影片 / 連拍檢測
+    上傳一段短影片（video）或多張連拍圖片（files），平均取樣畫面並略過近似重複的畫面，
+    批次推論後跨畫面追蹤，回傳每顆藥丸彙整後的偵測結果（至少出現在 min_frames 個畫面）
+    """
+    metrics.set_request_labels("/api/detect/burst")
+    start_time = time.perf_counter()
+    timings = metrics.start_request_timings()
+    try:
+        # 確保模型已載入
+        await ensure_models_loaded()
+        
+        if not models_loaded:
+            raise HTTPException(status_code=503, detail="模型尚未載入，請稍後再試")
+        
+        if (video is None) == (not files):
+            raise HTTPException(status_code=400, detail="請上傳一段影片（video）或多張圖片（files），兩者擇一")
+        
         # 獲取模型名稱
         available_models = get_available_models()
         if not available_models:
@@ -728,26 +1169,277 @@ async def detect_pills_upload(file: UploadFile = File(...), model_name: Optional
                 detail=f"模型 {model_name} 不可用，可用模型: {available_models}"
             )
         
-        # 執行檢測
-        detection_result = detect_pills_internal(model_name, image_pil)
+        metrics.set_model_name(model_name)
+        inference_options = build_inference_options(model_name, inference)
+        
+        # 讀取並取樣畫面
+        try:
+            if video is not None:
+                video_data, images_data = await video.read(), None
+            else:
+                video_data, images_data = None, [await f.read() for f in files]
+            frames = await run_blocking(load_burst_frames, video_data, images_data, max_frames)
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"影片 / 圖片解碼失敗: {str(e)}")
+        
+        # 略過近似重複的畫面，其餘批次推論
+        kept_frames, duplicate_count = await run_blocking(deduplicate_burst_frames, frames, dedup_threshold)
+        detection_result = await inference_scheduler.run(
+            detect_pills_batch_internal, model_name, [frame for _, frame in kept_frames], inference_options
+        )
         
         if 'error' in detection_result:
             raise HTTPException(status_code=500, detail=detection_result['error'])
         
-        return {
+        detections, frame_results = track_burst_detections(
+            [index for index, _ in kept_frames], detection_result['frames'], min_frames
+        )
+        
+        # 偵測結果已在模型載入時綁定藥品目錄；目錄未載入時才查詢資料庫
+        # 批次結果的藥品資訊是所有畫面的聯集，只保留彙整後（至少出現在 min_frames 個畫面）的偵測對應的藥品
+        pills_info = jobs.item_pills_info(detections, detection_result.get('pills_info'))
+        if pills_info is None:
+            pills_info = []
+            try:
+                from db_cloud_sql import get_pills_details_by_ids
+                with metrics.stage_timer("db_lookup"):
+                    pills_info = await run_blocking(
+                        get_pills_details_by_ids, [det['class_name'] for det in detections], model_name
+                    )
+            except Exception as e:
+                logger.warning("Failed to get pill information from database", error=str(e))
+        
+        response_body = {
             "success": True,
-            "filename": file.filename,
-            "detections": detection_result['detections'],
+            "detections": detections,
+            "pills_info": pills_info,
+            "frames": {
+                "received": len(files) if files else None,
+                "sampled": len(frames),
+                "processed": len(kept_frames),
+                "duplicates_skipped": duplicate_count,
+            },
             "elapsed_time": detection_result['elapsed_time'],
             "model_name": model_name
         }
+        if include_frames:
+            response_body["frame_detections"] = frame_results
+        response_timings = finalize_timings(http_response, timings, start_time, include_timings)
+        if response_timings is not None:
+            response_body["timings"] = response_timings
+        return response_body
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"文件上傳檢測錯誤: {str(e)}")
+        logger.error(f"影片 / 連拍檢測錯誤: {str(e)}")
         raise HTTPException(status_code=500, detail=f"內部伺服器錯誤: {str(e)}")
 
+@app.websocket("/ws/detect")
+async def detect_pills_stream(websocket: WebSocket, model_name: Optional[str] = None, include_timings: bool = False,
+                              inference: Optional[dict] = Depends(inference_query_options)):
+    """
+    WebSocket 即時串流檢測
+    客戶端以二進位訊息連續送出 JPEG / PNG 畫面；伺服器永遠處理最新的畫面、丟棄處理期間被覆蓋的舊畫面，
+    每處理一格回傳 {"type": "det", "seq", "dropped", "ms", "det": [[class_id, confidence, x0, y0, x1, y1], ...]}，
+    class_id 對應連線建立時 ready 訊息中的 classes（[類別名稱, 藥品ID]）
+    """
+    metrics.set_request_labels("/ws/detect")
+    await websocket.accept()
+    if admission.is_draining():
+        await websocket.close(code=streaming.CLOSE_SERVICE_RESTART, reason="服務正在關閉，請重新連線")
+        return
+    if not streaming.try_open_session():
+        await websocket.close(code=streaming.CLOSE_TRY_AGAIN_LATER, reason="串流連線數已達上限")
+        return
+    metrics.set_active_streams(streaming.active_sessions())
+    
+    session_id = str(uuid.uuid4())
+    slot = streaming.LatestFrameSlot()
+    receiver = None
+    logger.info("Stream opened", session_id=session_id, model_name=model_name,
+                client_ip=websocket.client.host if websocket.client else "unknown")
+    try:
+        # 確保模型已載入
+        await ensure_models_loaded()
+        
+        available_models = get_available_models()
+        if not models_loaded or not available_models:
+            await websocket.close(code=streaming.CLOSE_TRY_AGAIN_LATER, reason="模型尚未載入，請稍後再試")
+            return
+        
+        if model_name is None:
+            model_name = available_models[0]
+        elif model_name not in available_models:
+            await websocket.close(code=streaming.CLOSE_POLICY_VIOLATION, reason=f"模型 {model_name} 不可用")
+            return
+        
+        metrics.set_model_name(model_name)
+        try:
+            inference_options = build_inference_options(model_name, inference)
+        except HTTPException as e:
+            await websocket.close(code=streaming.CLOSE_POLICY_VIOLATION, reason=e.detail)
+            return
+        
+        from modules.yolo_pill_analyzer import get_class_labels
+        await send_stream_message(websocket, {
+            "type": "ready",
+            "session_id": session_id,
+            "model_name": model_name,
+            "classes": get_class_labels(model_name),
+        })
+        
+        # 接收與處理分開：處理期間收到的畫面只保留最新一格
+        receiver = asyncio.create_task(receive_stream_frames(websocket, slot))
+        while True:
+            frame = await slot.get()
+            if frame is None:
+                break
+            seq, data, dropped = frame
+            metrics.record_stream_frames("dropped", dropped)
+            message = await process_stream_frame(model_name, seq, data, dropped, include_timings,
+                                                 inference_options)
+            await send_stream_message(websocket, message)
+    
+    except (WebSocketDisconnect, OSError):
+        # 客戶端在處理途中斷線
+        pass
+    except admission.ServiceDraining:
+        # 關閉中：請客戶端重新連線到其他執行個體
+        await websocket.close(code=streaming.CLOSE_SERVICE_RESTART, reason="服務正在關閉，請重新連線")
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+        streaming.close_session()
+        metrics.set_active_streams(streaming.active_sessions())
+        logger.info("Stream closed", session_id=session_id, frames_received=slot.received,
+                    frames_dropped=slot.dropped)
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    """
+    建立非同步批次偵測工作，立即回傳工作 ID
+    圖片由背景 worker 分批推論，以 GET /api/jobs/{job_id} 查詢進度、GET /api/jobs/{job_id}/results 取得結果
+    """
+    metrics.set_request_labels("/api/jobs")
+    await ensure_models_loaded()
+    if not models_loaded:
+        raise HTTPException(status_code=503, detail="模型尚未載入，請稍後再試")
+    
+    if len(request.items) > jobs.JOB_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"單一工作最多 {jobs.JOB_MAX_ITEMS} 張圖片")
+    items = [item.model_dump() for item in request.items]
+    for index, item in enumerate(items):
+        try:
+            jobs.validate_source(item)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"items[{index}]: {e}")
+    
+    model_name = request.model_name
+    available_models = get_available_models()
+    if not available_models:
+        raise HTTPException(status_code=500, detail="沒有可用的模型")
+    if model_name is None:
+        model_name = available_models[0]
+    elif model_name not in available_models:
+        raise HTTPException(
+            status_code=400,
+            detail=f"模型 {model_name} 不可用，可用模型: {available_models}"
+        )
+    metrics.set_model_name(model_name)
+    inference_options = build_inference_options(model_name, request.inference)
+    
+    store = get_job_store()
+    job_id = await run_blocking(store.submit, items, model_name, inference_options)
+    logger.info("Job submitted", job_id=job_id, items=len(items), model_name=model_name)
+    return {"success": True, **await run_blocking(store.status, job_id)}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查詢批次工作的狀態與進度"""
+    job = await run_blocking(get_job_store().status, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"找不到工作 {job_id}（可能已過期刪除）")
+    return {"success": True, **job}
+
+@app.get("/api/jobs/{job_id}/results")
+async def get_job_results(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000),
+                          status: Optional[Literal["pending", "running", "done", "failed", "cancelled"]] = None):
+    """依圖片順序分頁取得批次工作的結果（工作尚未完成時回傳目前已有的部分）"""
+    store = get_job_store()
+    job = await run_blocking(store.status, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"找不到工作 {job_id}（可能已過期刪除）")
+    items = await run_blocking(store.results, job_id, offset, limit, status)
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status": job["status"],
+        "offset": offset,
+        "items": items,
+        "next_offset": offset + len(items) if len(items) == limit else None,
+    }
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消批次工作：尚未處理的圖片不再處理，已完成的結果保留到過期"""
+    store = get_job_store()
+    if not await run_blocking(store.cancel, job_id):
+        raise HTTPException(status_code=404, detail=f"找不到工作 {job_id}（可能已過期刪除）")
+    return {"success": True, **await run_blocking(store.status, job_id)}
+
+@app.get("/admin/profiles/{request_id}")
+async def get_profile_artifact(request_id: str, http_request: Request, artifact: Optional[str] = None):
+    """
+    取得指定請求的效能分析結果（需要管理者權杖）
+    未指定 artifact 時回傳檔案列表，否則下載該檔案
+    """
+    if not is_admin(http_request.headers):
+        raise HTTPException(status_code=403, detail="需要管理者權杖")
+    
+    artifacts = profiling.find_artifacts(request_id)
+    if not artifacts:
+        raise HTTPException(status_code=404, detail=f"找不到請求 {request_id} 的效能分析結果")
+    
+    if artifact is None:
+        return {
+            "success": True,
+            "request_id": request_id,
+            "artifacts": [os.path.basename(path) for path in artifacts]
+        }
+    
+    for path in artifacts:
+        if os.path.basename(path) == artifact:
+            return FileResponse(path, filename=artifact)
+    raise HTTPException(status_code=404, detail=f"找不到檔案 {artifact}")
+
+@app.get("/admin/memory/snapshot")
+async def get_memory_snapshot(http_request: Request, limit: int = 20, key_type: str = "lineno"):
+    """
+    取得堆積快照（需要管理者權杖）
+    回傳配置量最大的項目，以及與上一次快照相比增加最多的項目；連續呼叫兩次即可比較請求前後的差異
+    """
+    if not is_admin(http_request.headers):
+        raise HTTPException(status_code=403, detail="需要管理者權杖")
+    if key_type not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="key_type 必須是 lineno、filename 或 traceback")
+    
+    snapshot = await run_blocking(memory.take_snapshot, max(1, min(limit, 200)), key_type)
+    return {"success": True, **snapshot}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus 指標端點
+    """
+    metrics.set_load(inference_scheduler.load())
+    content, content_type = metrics.render_latest()
+    if content is None:
+        raise HTTPException(status_code=503, detail="prometheus_client 未安裝，指標不可用")
+    return Response(content=content, media_type=content_type)
+
 # 根路徑
 @app.get("/")
 async def root():
@@ -757,20 +1449,47 @@ async def root():
         "version": "2.0.0",
         "docs": "/docs",
         "health": "/health",
-        "models": "/api/models"
+        "models": "/api/models",
+        "metrics": "/metrics",
+        "load": "/api/load",
+        "stream": "/ws/detect",
+        "jobs": "/api/jobs"
     }
 
-if __name__ == "__main__":
-    # 本地開發時使用
+startup_timing.record_phase("import_app", time.perf_counter() - _IMPORT_STARTED_AT)
+
+def main(argv=None):
+    """
+    命令列進入點（setup.py 的 pill-detection-api）
+    不帶參數時啟動本地開發服務器；`pill-detection-api batch ...` 為離線批次偵測（見 modules/batch_cli.py）
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "batch":
+        from modules import batch_cli
+        return batch_cli.main(argv[1:])
+    
+    import argparse
+    import uvicorn
+    parser = argparse.ArgumentParser(prog="pill-detection-api", description="藥丸檢測API（子命令 batch 為離線批次偵測）")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', 8080)))
+    parser.add_argument("--no-reload", action="store_true", help="不自動重載（非開發環境）")
+    args = parser.parse_args(argv)
+    
     print("🚀 啟動FastAPI本地開發服務器...")
-    port = int(os.environ.get('PORT', 8080))
-    print(f"📡 服務器將在 http://localhost:{port} 啟動")
-    print(f"📖 API文檔: http://localhost:{port}/docs")
+    print(f"📡 服務器將在 http://localhost:{args.port} 啟動")
+    print(f"📖 API文檔: http://localhost:{args.port}/docs")
     
     uvicorn.run(
         "fastapi_app:app",
-        host="0.0.0.0",
-        port=port,
-        reload=True,  # 開發模式下自動重載
-        log_level="info"
-    )
\ No newline at end of file
+        host=args.host,
+        port=args.port,
+        reload=not args.no_reload,  # 開發模式下自動重載
+        log_level="info",
+        ws_per_message_deflate=False  # 與 Dockerfile 相同：串流畫面不做 permessage-deflate
+    )
+    return 0
+
+if __name__ == "__main__":
+    # 本地開發時使用
+    sys.exit(main())
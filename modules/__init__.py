@@ -0,0 +1 @@
+"""藥丸檢測API的功能模組"""
@@ -0,0 +1,20 @@
+"""
+管理者權杖驗證
+管理用端點與除錯功能需要帶上 X-Admin-Token，且必須與環境變數 ADMIN_TOKEN 相同；
+未設定 ADMIN_TOKEN 時一律拒絕
+"""
+import os
+import hmac
+
+ADMIN_TOKEN_HEADER = "x-admin-token"
+
+
+def is_admin(headers):
+    """檢查請求標頭中的管理者權杖（以固定時間比較避免時序攻擊）"""
+    expected = os.environ.get("ADMIN_TOKEN")
+    if not expected:
+        return False
+    provided = headers.get(ADMIN_TOKEN_HEADER)
+    if not provided:
+        return False
+    return hmac.compare_digest(provided.encode("utf-8"), expected.encode("utf-8"))
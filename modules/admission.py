@@ -0,0 +1,361 @@
+"""
+期限感知的准入控制與優先順序通道
+每個請求在抵達時決定通道與期限：期限來自 X-Request-Timeout 標頭（秒，只能縮短），否則使用通道的預設值。
+推論執行緒只有一個，等待推論的請求依通道排隊：interactive（簡化 / 上傳 / 串流）優先於 annotated（完整標註），
+再優先於 batch（影片 / 連拍）；同一通道內先到先服務。排隊期間期限到期（客戶端多半已經放棄）的請求
+直接回傳 504 而不推論，避免為已經逾時的請求佔用推論執行緒。
+高優先通道連續被服務 STARVATION_LIMIT 次而低優先通道仍有請求在等時，讓低優先通道中等最久的請求先執行一次，避免完全餓死。
+排程器同時統計推論執行緒的使用率與平均推論時間，估計各通道新請求的等待時間，作為自動擴展的負載訊號。
+
+關閉時（收到 SIGTERM 起算 SHUTDOWN_GRACE_SECONDS 秒內）停止接受新請求（503），
+佇列中預估無法在期限前（保留 SHUTDOWN_UPLOAD_RESERVE_S 秒給標註與上傳）推論完的請求直接回傳 503，讓客戶端改送其他執行個體
+"""
+import os
+import time
+import signal
+import asyncio
+import logging
+import contextvars
+from collections import deque
+
+from fastapi import HTTPException
+
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+# 通道（依優先順序排列）與各通道的預設期限（秒）
+LANES = ("interactive", "annotated", "batch")
+DEFAULT_TIMEOUTS = {
+    "interactive": float(os.environ.get("DEADLINE_INTERACTIVE_S", "10")),
+    "annotated": float(os.environ.get("DEADLINE_ANNOTATED_S", "30")),
+    "batch": float(os.environ.get("DEADLINE_BATCH_S", "120")),
+}
+# 路由 -> 通道（未列出的路由不排隊也沒有期限）；HTTP 請求由請求追蹤中介層查詢，
+# WebSocket 串流的每個畫面由 process_stream_frame 查詢（不設期限）
+ROUTE_LANES = {
+    "/api/detect/simple": "interactive",
+    "/api/detect/upload": "interactive",
+    "/ws/detect": "interactive",
+    "/api/detect": "annotated",
+    "/api/detect/burst": "batch",
+}
+TIMEOUT_HEADER = "x-request-timeout"
+# 被略過的處理階段（指標標籤 -> 錯誤訊息）
+STAGE_NAMES = {"queue": "推論", "annotate": "標註與上傳"}
+# 高優先通道連續被服務的次數上限（低優先通道有請求在等時）
+STARVATION_LIMIT = int(os.environ.get("LANE_STARVATION_LIMIT", "8"))
+
+# 關閉時的寬限期（Cloud Run 在 SIGTERM 後 10 秒強制結束）與保留給標註、上傳的時間
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get("SHUTDOWN_GRACE_SECONDS", "10"))
+SHUTDOWN_UPLOAD_RESERVE_S = float(os.environ.get("SHUTDOWN_UPLOAD_RESERVE_S", "3"))
+# 使用率的統計區間（秒）與平均推論時間的平滑係數
+LOAD_WINDOW_S = float(os.environ.get("LOAD_WINDOW_S", "60"))
+SERVICE_TIME_ALPHA = 0.2
+
+# 目前請求的 (通道, 期限)；期限為 time.monotonic() 的絕對時間
+_request_admission = contextvars.ContextVar("request_admission", default=(None, None))
+
+
+class DeadlineExceeded(HTTPException):
+    """請求期限已過，不再處理（由全域的 HTTP 異常處理器產生 504 回應）"""
+
+    def __init__(self, lane, stage):
+        super().__init__(status_code=504, detail=f"請求已超過期限，略過{STAGE_NAMES.get(stage, stage)}")
+        self.lane = lane
+        self.stage = stage
+
+
+class ServiceDraining(HTTPException):
+    """執行個體正在關閉，不再接受新的推論（客戶端應重試，由其他執行個體處理）"""
+
+    def __init__(self, lane=None):
+        super().__init__(status_code=503, detail="服務正在關閉，請稍後重試",
+                         headers={"Retry-After": "1", "Connection": "close"})
+        self.lane = lane
+
+
+# 關閉的期限（time.monotonic() 的絕對時間），未開始關閉時為 None
+_drain_deadline = None
+
+
+def begin_drain(grace=None):
+    """開始關閉：之後抵達的請求回傳 503；重複呼叫時保留第一次的期限。回傳是否為第一次呼叫"""
+    global _drain_deadline
+    if _drain_deadline is not None:
+        return False
+    grace = SHUTDOWN_GRACE_SECONDS if grace is None else grace
+    _drain_deadline = time.monotonic() + grace
+    metrics.set_draining(True)
+    logger.info(f"開始關閉，停止接受新請求（寬限期 {grace:.1f} 秒）")
+    return True
+
+
+def is_draining():
+    return _drain_deadline is not None
+
+
+def drain_remaining():
+    """距離關閉期限的秒數，未開始關閉時為 None"""
+    if _drain_deadline is None:
+        return None
+    return max(0.0, _drain_deadline - time.monotonic())
+
+
+def install_drain_signal_handler(on_drain):
+    """
+    收到 SIGTERM 時在事件迴圈中呼叫 on_drain，再交給原本的處理器（uvicorn 停止接受連線並等待進行中的請求）
+    需在事件迴圈所在的主執行緒中呼叫
+    """
+    loop = asyncio.get_running_loop()
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        loop.call_soon_threadsafe(on_drain)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            # 沒有伺服器接手關閉流程（例如直接執行 startup 事件）：維持預設行為，結束行程
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    try:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        # 不在主執行緒（例如測試用的 TestClient），只能在 lifespan 關閉時才開始排空
+        logger.debug("[調試] 無法安裝 SIGTERM 處理器（不在主執行緒）")
+
+
+def parse_timeout(value):
+    """X-Request-Timeout 標頭 -> 秒數；格式錯誤或非正數時回傳 None"""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if seconds > 0 else None
+
+
+def start_request(path, headers, arrived_at=None):
+    """在請求抵達時決定通道與期限（由請求追蹤中間件呼叫），回傳 (通道, 期限)"""
+    lane = ROUTE_LANES.get(path)
+    if lane is None:
+        _request_admission.set((None, None))
+        return None, None
+    timeout = DEFAULT_TIMEOUTS[lane]
+    requested = parse_timeout(headers.get(TIMEOUT_HEADER))
+    if requested is not None:
+        timeout = min(timeout, requested)
+    deadline = (arrived_at if arrived_at is not None else time.monotonic()) + timeout
+    _request_admission.set((lane, deadline))
+    return lane, deadline
+
+
+def current_request():
+    return _request_admission.get()
+
+
+def check_deadline(stage):
+    """目前請求的期限已過時拋出 DeadlineExceeded（在昂貴的處理階段之前呼叫）"""
+    lane, deadline = _request_admission.get()
+    if deadline is not None and time.monotonic() >= deadline:
+        metrics.record_deadline_drop(lane, stage)
+        raise DeadlineExceeded(lane, stage)
+
+
+class _Ticket:
+    __slots__ = ("lane", "deadline", "future", "enqueued_at")
+
+    def __init__(self, lane, deadline, future):
+        self.lane = lane
+        self.deadline = deadline
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceScheduler:
+    """
+    推論執行緒前的優先順序佇列（只在事件迴圈中使用，不需要鎖）
+    run(func, *args) 等輪到目前請求的通道後，以 submit 在推論執行緒中執行 func
+    """
+
+    def __init__(self, submit):
+        self._submit = submit
+        self._queues = {lane: deque() for lane in LANES}
+        self._busy = False
+        self._streak = 0
+        # 負載統計：目前推論的開始時間、最近 LOAD_WINDOW_S 秒內完成的推論 (開始, 結束)、平均推論時間
+        self._running_since = None
+        self._intervals = deque()
+        self._service_time = None
+        self._started_at = time.monotonic()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def queue_depths(self):
+        return {lane: len(queue) for lane, queue in self._queues.items()}
+
+    def _record_service(self, started, finished):
+        elapsed = finished - started
+        self._service_time = elapsed if self._service_time is None else (
+            SERVICE_TIME_ALPHA * elapsed + (1 - SERVICE_TIME_ALPHA) * self._service_time
+        )
+        self._intervals.append((started, finished))
+        while self._intervals and self._intervals[0][1] < finished - LOAD_WINDOW_S:
+            self._intervals.popleft()
+
+    def _current_remaining(self, now):
+        """目前推論預估還要多久（沒有推論或尚無平均值時為 0）"""
+        if self._running_since is None or self._service_time is None:
+            return 0.0
+        return max(0.0, self._service_time - (now - self._running_since))
+
+    def load(self):
+        """
+        負載訊號：最近 LOAD_WINDOW_S 秒內推論執行緒的使用率、各通道佇列長度，
+        以及新請求在各通道的預估等待時間（目前推論的剩餘時間 + 排在前面的請求數 x 平均推論時間）
+        """
+        now = time.monotonic()
+        window_start = max(now - LOAD_WINDOW_S, self._started_at)
+        busy = sum(finished - max(started, window_start) for started, finished in self._intervals
+                   if finished > window_start)
+        if self._running_since is not None:
+            busy += now - max(self._running_since, window_start)
+        window = now - window_start
+        depths = self.queue_depths()
+        service_time = self._service_time or 0.0
+        current = self._current_remaining(now)
+        estimated_wait, ahead = {}, 0
+        for lane in LANES:
+            ahead += depths[lane]
+            estimated_wait[lane] = round(current + ahead * service_time, 3)
+        return {
+            "utilization": round(min(1.0, busy / window), 4) if window > 0 else 0.0,
+            "window_s": round(window, 1),
+            "busy": self._running_since is not None,
+            "queue_depth": sum(depths.values()),
+            "queue_depths": depths,
+            "service_time_ms": round(service_time * 1000, 2) if self._service_time is not None else None,
+            "estimated_wait_s": estimated_wait,
+            "draining": is_draining(),
+        }
+
+    def _fits_before_drain(self, position):
+        """關閉中時，排在第 position 位（0 為下一個）的請求預估能否在保留上傳時間之前推論完"""
+        remaining = drain_remaining()
+        if remaining is None:
+            return True
+        service_time = self._service_time or 0.0
+        finish = self._current_remaining(time.monotonic()) + (position + 1) * service_time
+        return finish <= remaining - SHUTDOWN_UPLOAD_RESERVE_S
+
+    def shed_for_drain(self):
+        """開始關閉時呼叫：依服務順序保留預估來得及推論的請求，其餘回傳 503"""
+        position = 0
+        for lane in LANES:
+            queue = self._queues[lane]
+            for ticket in list(queue):
+                if ticket.future.done():
+                    continue
+                if self._fits_before_drain(position):
+                    position += 1
+                    continue
+                queue.remove(ticket)
+                ticket.future.set_exception(ServiceDraining(lane))
+            metrics.set_queue_depth(lane, len(queue))
+
+    async def wait_idle(self, timeout=None):
+        """等到佇列清空且沒有推論在執行，回傳是否在 timeout 內完成"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def run(self, func, *args, lane=None, deadline=None):
+        """lane / deadline 未指定時使用目前請求的值（沒有時排在 annotated 通道、沒有期限）"""
+        request_lane, request_deadline = _request_admission.get()
+        lane = lane or request_lane or "annotated"
+        if deadline is None:
+            deadline = request_deadline
+
+        await self._acquire(lane, deadline)
+        self._running_since = time.monotonic()
+        try:
+            return await self._submit(func, *args)
+        finally:
+            self._record_service(self._running_since, time.monotonic())
+            self._running_since = None
+            self._release()
+
+    async def _acquire(self, lane, deadline):
+        if deadline is not None and time.monotonic() >= deadline:
+            metrics.record_deadline_drop(lane, "queue")
+            raise DeadlineExceeded(lane, "queue")
+        if is_draining() and not self._fits_before_drain(sum(len(queue) for queue in self._queues.values())):
+            raise ServiceDraining(lane)
+        if not self._busy and not any(self._queues.values()):
+            self._busy = True
+            self._idle.clear()
+            metrics.record_queue_wait(lane, 0.0)
+            return
+
+        ticket = _Ticket(lane, deadline, asyncio.get_running_loop().create_future())
+        self._queues[lane].append(ticket)
+        metrics.set_queue_depth(lane, len(self._queues[lane]))
+        try:
+            with metrics.stage_timer("inference_queue"):
+                # 等到輪到或期限到期為止；期限到期時立即回傳 504，不必等到輪到才發現
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, _ = await asyncio.wait({ticket.future}, timeout=timeout)
+            if not done:
+                self._remove(ticket)
+                metrics.record_deadline_drop(lane, "queue")
+                raise DeadlineExceeded(lane, "queue")
+            ticket.future.result()
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled() and ticket.future.exception() is None:
+                # 已經輪到卻在恢復執行前被取消：交給下一個請求
+                self._release()
+            else:
+                self._remove(ticket)
+            raise
+        finally:
+            metrics.record_queue_wait(lane, time.perf_counter() - ticket.enqueued_at)
+
+    def _remove(self, ticket):
+        try:
+            self._queues[ticket.lane].remove(ticket)
+        except ValueError:
+            pass
+        metrics.set_queue_depth(ticket.lane, len(self._queues[ticket.lane]))
+
+    def _next_lane(self):
+        """依優先順序選出下一個通道；最高優先通道連續服務過多次時，讓較低通道中等最久的請求先執行"""
+        waiting = [lane for lane in LANES if self._queues[lane]]
+        if not waiting:
+            return None
+        if len(waiting) > 1 and self._streak >= STARVATION_LIMIT:
+            self._streak = 0
+            return min(waiting[1:], key=lambda lane: self._queues[lane][0].enqueued_at)
+        self._streak = self._streak + 1 if len(waiting) > 1 else 0
+        return waiting[0]
+
+    def _release(self):
+        """推論結束：把推論執行緒交給下一個仍在期限內的請求，期限已過的直接回傳 504"""
+        now = time.monotonic()
+        while True:
+            lane = self._next_lane()
+            if lane is None:
+                self._busy = False
+                self._idle.set()
+                return
+            ticket = self._queues[lane].popleft()
+            metrics.set_queue_depth(lane, len(self._queues[lane]))
+            if ticket.future.done():
+                continue
+            if ticket.deadline is not None and now >= ticket.deadline:
+                metrics.record_deadline_drop(lane, "queue")
+                ticket.future.set_exception(DeadlineExceeded(lane, "queue"))
+                continue
+            ticket.future.set_result(None)
+            return
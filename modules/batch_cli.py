@@ -0,0 +1,342 @@
+"""
+離線批次偵測（命令列）
+走訪圖片目錄或清單檔，以行程池平行解碼並縮小到推論尺寸（只把小圖傳回主行程，記憶體用量與原圖解析度無關），
+依推論尺寸分組以 yolo_pill_analyzer.detect_pills_batch 批次推論、把偵測框換算回原圖座標，
+每處理完一段（--chunk-size 張）就把結果附加寫入 JSONL 或 Parquet；中斷後以相同的參數重新執行，
+已經寫入的圖片會被略過，從中斷的地方繼續。
+
+用法:
+    pill-detection-api batch images/ --output results.jsonl
+    pill-detection-api batch manifest.jsonl --output results.parquet --with-drug-info --conf 0.5
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from modules import image_decode
+from modules import image_encode
+from modules import inference_params
+
+logger = logging.getLogger(__name__)
+
+# Parquet 輸出（可選）
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+PARQUET_COLUMNS = ("source", "id", "num_detections", "detections", "pills_info", "error")
+
+
+# --- 輸入 ---
+
+def iter_directory(directory):
+    """遞迴列出目錄中的圖片（依路徑排序，重新執行時順序相同）"""
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                found.append(os.path.join(root, name))
+    for path in sorted(found):
+        yield {"source": path, "id": None}
+
+
+def iter_manifest(path):
+    """
+    清單檔：.jsonl 每行 {"path": ..., "id": ...}，其餘格式每行一個路徑（# 開頭為註解）
+    相對路徑以清單檔所在目錄為準
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                try:
+                    entry = json.loads(line)
+                    image_path, image_id = entry["path"], entry.get("id")
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"{path}:{line_number} 格式錯誤: {e}")
+            else:
+                image_path, image_id = line, None
+            yield {"source": os.path.join(base, image_path), "id": image_id}
+
+
+def iter_inputs(inputs):
+    for value in inputs:
+        if os.path.isdir(value):
+            yield from iter_directory(value)
+        elif os.path.isfile(value):
+            yield from iter_manifest(value)
+        else:
+            raise FileNotFoundError(f"找不到目錄或清單檔: {value}")
+
+
+def decode_file(path, imgsz=None):
+    """
+    行程池中執行：讀取、解碼圖片並縮小到推論尺寸（imgsz 為 None / 整數 / "auto"，依原圖解析度決定）
+    回傳 (縮小後的 BGR 陣列, 原圖 (寬, 高), 推論尺寸, 錯誤訊息)；模型本來就會把最長邊縮到推論尺寸，
+    先在子行程縮小不影響結果，但傳回主行程的資料量從原圖（1200 萬像素約 36 MB）降到推論尺寸
+    """
+    try:
+        with open(path, "rb") as f:
+            image = image_decode.decode_to_array(f.read())
+    except Exception as e:
+        return None, None, None, f"圖片讀取失敗: {e}"
+    original_size = image_decode.image_size(image)
+    resolved_imgsz = inference_params.resolve({"imgsz": imgsz}, image)["imgsz"]
+    size = image_encode.target_size(*original_size, resolved_imgsz)
+    if size != original_size:
+        image = image_encode.resize(image, size)
+    return image, original_size, resolved_imgsz, None
+
+
+# --- 輸出 ---
+
+class JsonlOutput:
+    """逐段附加寫入 JSONL；開啟時移除上次中斷時寫到一半的最後一行"""
+
+    def __init__(self, path):
+        self.path = path
+        self._completed = {}
+        if os.path.exists(path):
+            self._load_existing()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load_existing(self):
+        valid_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._completed[record["source"]] = record.get("error") is None
+                valid_bytes += len(line)
+        if valid_bytes < os.path.getsize(self.path):
+            logger.warning(f"移除 {self.path} 結尾不完整的資料（上次執行中斷）")
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_bytes)
+
+    def completed(self):
+        """已寫入的來源 -> 是否成功（同一來源重試後以最後一筆為準）"""
+        return self._completed
+
+    def write(self, records):
+        for record in records:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetOutput:
+    """
+    Parquet 輸出為一個目錄，每段結果寫成一個 part-NNNNN.parquet（先寫暫存檔再改名，中斷時不會留下不完整的檔案）
+    detections / pills_info 以 JSON 字串存放
+    """
+
+    def __init__(self, path):
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError("Parquet 輸出需要 pyarrow（pip install pyarrow）")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._completed = {}
+        parts = sorted(name for name in os.listdir(path) if name.startswith("part-") and name.endswith(".parquet"))
+        for name in parts:
+            table = pq.read_table(os.path.join(path, name), columns=["source", "error"])
+            for source, error in zip(table.column("source").to_pylist(), table.column("error").to_pylist()):
+                self._completed[source] = error is None
+        self._next_part = int(parts[-1][len("part-"):-len(".parquet")]) + 1 if parts else 0
+
+    def completed(self):
+        return self._completed
+
+    def write(self, records):
+        if not records:
+            return
+        columns = {name: [] for name in PARQUET_COLUMNS}
+        for record in records:
+            columns["source"].append(record["source"])
+            columns["id"].append(None if record.get("id") is None else str(record["id"]))
+            columns["num_detections"].append(len(record.get("detections") or []))
+            columns["detections"].append(
+                json.dumps(record["detections"], ensure_ascii=False) if "detections" in record else None
+            )
+            columns["pills_info"].append(
+                json.dumps(record["pills_info"], ensure_ascii=False) if record.get("pills_info") is not None else None
+            )
+            columns["error"].append(record.get("error"))
+        schema = pa.schema([("source", pa.string()), ("id", pa.string()), ("num_detections", pa.int32()),
+                            ("detections", pa.string()), ("pills_info", pa.string()), ("error", pa.string())])
+        final_path = os.path.join(self.path, f"part-{self._next_part:05d}.parquet")
+        temp_path = final_path + ".tmp"
+        pq.write_table(pa.table(columns, schema=schema), temp_path)
+        os.replace(temp_path, final_path)
+        self._next_part += 1
+
+    def close(self):
+        pass
+
+
+def open_output(path, output_format=None):
+    output_format = output_format or ("parquet" if path.rstrip("/").endswith(".parquet") else "jsonl")
+    if output_format == "parquet":
+        return ParquetOutput(path)
+    return JsonlOutput(path)
+
+
+# --- 主流程 ---
+
+def build_options(args, analyzer, model_name):
+    options = {"conf": args.conf, "iou": args.iou, "imgsz": args.imgsz, "max_det": args.max_det}
+    if args.classes:
+        options["classes"] = analyzer.resolve_class_filter(model_name, args.classes)
+    options = {key: value for key, value in options.items() if value is not None}
+    return options or None
+
+
+def _chunks(items, size):
+    for offset in range(0, len(items), size):
+        yield items[offset:offset + size]
+
+
+def detect_chunk(analyzer, model_name, entries, decoded, options, with_drug_info):
+    """一段已解碼的圖片 -> 輸出紀錄"""
+    from modules.jobs import item_pills_info
+
+    records = {}
+    # 推論尺寸 -> [(序號, 縮小後的圖片, 原圖尺寸)]；同一組一起推論
+    groups = {}
+    for index, (entry, (image, original_size, imgsz, error)) in enumerate(zip(entries, decoded)):
+        if error is not None:
+            records[index] = {"source": entry["source"], "id": entry["id"], "error": error}
+        else:
+            groups.setdefault(imgsz, []).append((index, image, original_size))
+
+    for imgsz, group in groups.items():
+        group_options = dict(options or {}, imgsz=imgsz)
+        result = analyzer.detect_pills_batch(model_name, [image for _, image, _ in group], options=group_options)
+        for position, (index, image, original_size) in enumerate(group):
+            entry = entries[index]
+            record = {"source": entry["source"], "id": entry["id"]}
+            if "error" in result:
+                record["error"] = result["error"]
+            else:
+                detections = image_encode.scale_detections(
+                    result["frames"][position], image_decode.image_size(image), original_size
+                )
+                record["detections"] = detections
+                if with_drug_info:
+                    record["pills_info"] = item_pills_info(detections, result.get("pills_info"))
+            records[index] = record
+    return [records[index] for index in range(len(entries))]
+
+
+def run(args):
+    output = open_output(args.output, args.format)
+    completed = output.completed()
+    entries = [
+        entry for entry in iter_inputs(args.inputs)
+        if entry["source"] not in completed or (args.retry_failed and not completed[entry["source"]])
+    ]
+    if args.limit is not None:
+        entries = entries[:args.limit]
+    print(f"待處理 {len(entries)} 張圖片（輸出中已有 {len(completed)} 張的結果）", file=sys.stderr)
+    if not entries:
+        output.close()
+        return 0
+
+    # 先建立解碼行程池，再載入模型（子行程不必複製模型與 torch 的執行緒）
+    decode_pool = ProcessPoolExecutor(max_workers=args.decode_workers)
+    try:
+        from modules import yolo_pill_analyzer as analyzer
+
+        analyzer.initialize_models()
+        if args.with_drug_info:
+            from db_cloud_sql import load_drug_catalog
+            if not load_drug_catalog():
+                logger.warning("藥品目錄是空的（請確認資料庫環境變數），結果不含藥品資訊")
+        available_models = analyzer.get_available_models()
+        if not available_models:
+            raise RuntimeError("沒有可用的模型")
+        model_name = args.model_name or available_models[0]
+        if model_name not in available_models:
+            raise ValueError(f"模型 {model_name} 不可用，可用模型: {available_models}")
+        options = build_options(args, analyzer, model_name)
+
+        chunks = list(_chunks(entries, args.chunk_size))
+        def submit(chunk):
+            return [decode_pool.submit(decode_file, entry["source"], args.imgsz) for entry in chunk]
+
+        pending = submit(chunks[0])
+        processed, failed = 0, 0
+        started = time.perf_counter()
+        for index, chunk in enumerate(chunks):
+            decoded = [future.result() for future in pending]
+            # 推論這一段時，下一段已在行程池中解碼
+            if index + 1 < len(chunks):
+                pending = submit(chunks[index + 1])
+            records = detect_chunk(analyzer, model_name, chunk, decoded, options, args.with_drug_info)
+            output.write(records)
+            processed += len(records)
+            failed += sum(1 for record in records if record.get("error") is not None)
+            elapsed = time.perf_counter() - started
+            print(f"[{processed}/{len(entries)}] {processed / elapsed:.1f} 張/秒，失敗 {failed} 張",
+                  file=sys.stderr)
+    finally:
+        decode_pool.shutdown(cancel_futures=True)
+        output.close()
+    print(f"完成：處理 {processed} 張，失敗 {failed} 張，結果寫入 {args.output}", file=sys.stderr)
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="pill-detection-api batch",
+                                     description="離線批次偵測圖片目錄或清單檔，結果可中斷後續跑")
+    parser.add_argument("inputs", nargs="+", help="圖片目錄，或清單檔（.jsonl 每行 {\"path\", \"id\"}，其餘每行一個路徑）")
+    parser.add_argument("--output", "-o", required=True,
+                        help="結果輸出路徑（.jsonl 檔，或 .parquet 目錄）")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default=None, help="輸出格式（預設依副檔名）")
+    parser.add_argument("--model-name", default=None, help="使用的模型（預設第一個可用模型）")
+    parser.add_argument("--with-drug-info", action="store_true", help="從資料庫載入藥品目錄，附上每張圖片的藥品資訊")
+    parser.add_argument("--chunk-size", type=int, default=16,
+                        help="每段解碼、推論並寫入的圖片數（下一段同時在解碼，記憶體中約有兩段的圖片）")
+    parser.add_argument("--decode-workers", type=int, default=os.cpu_count() or 1, help="解碼行程數")
+    parser.add_argument("--retry-failed", action="store_true", help="續跑時重新處理上次失敗的圖片")
+    parser.add_argument("--limit", type=int, default=None, help="本次最多處理的圖片數")
+    parser.add_argument("--conf", type=float, default=None, help="信心度門檻（預設 0.7）")
+    parser.add_argument("--iou", type=float, default=None, help="NMS 的 IoU 門檻（預設 0.7）")
+    parser.add_argument("--imgsz", default=None, help="推論尺寸（整數或 auto，預設 640）")
+    parser.add_argument("--max-det", type=int, default=None, help="每張圖片最多偵測數（預設 300）")
+    parser.add_argument("--classes", nargs="+", default=None, help="只偵測這些類別（類別名稱或索引）")
+    args = parser.parse_args(argv)
+    if args.imgsz is not None and args.imgsz != "auto":
+        try:
+            args.imgsz = int(args.imgsz)
+        except ValueError:
+            parser.error("--imgsz 必須是整數或 auto")
+    if args.chunk_size < 1 or args.decode_workers < 1:
+        parser.error("--chunk-size 與 --decode-workers 必須是正整數")
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    return run(parse_args(argv))
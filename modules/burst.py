@@ -0,0 +1,136 @@
+"""
+影片 / 連拍輸入
+從短影片中平均取樣畫面（或從連拍的多張圖片中平均挑選），解碼成 BGR 陣列；
+再以縮成 32x32 灰階的畫面指紋與上一個保留的畫面比較，平均差異低於門檻的近似重複畫面直接略過，
+只有內容有變化的畫面才送進模型批次推論。
+NumPy / OpenCV 在第一次處理畫面時才匯入（API 匯入時只需要這裡的設定值）
+"""
+import os
+import logging
+import tempfile
+
+from modules.request_limits import ImageTooLargeError
+
+logger = logging.getLogger(__name__)
+
+# 每個請求最多處理的畫面數（影片取樣數 / 連拍張數）
+MAX_FRAMES = int(os.environ.get("BURST_MAX_FRAMES", "32"))
+DEFAULT_SAMPLE_FRAMES = int(os.environ.get("BURST_SAMPLE_FRAMES", "16"))
+# 近似重複門檻：32x32 灰階指紋的平均絕對差（0～255）
+DEFAULT_DEDUP_THRESHOLD = float(os.environ.get("BURST_DEDUP_THRESHOLD", "3.0"))
+# 影片沒有總畫面數資訊時，以此頻率（每秒畫面數）取樣
+FALLBACK_SAMPLE_FPS = 4.0
+SIGNATURE_SIZE = 32
+_GRAY_WEIGHTS = (0.114, 0.587, 0.299)  # BGR
+
+
+class VideoDecodeError(ValueError):
+    """影片無法解碼"""
+
+
+def evenly_spaced(total, count):
+    """從 total 個項目中平均挑出最多 count 個索引（包含第一個與最後一個）"""
+    import numpy as np
+
+    if total <= count:
+        return list(range(total))
+    return sorted(set(np.linspace(0, total - 1, count).round().astype(int).tolist()))
+
+
+def decode_frames(images_data, max_frames=DEFAULT_SAMPLE_FRAMES):
+    """連拍圖片：先平均挑選再解碼，回傳 (原始索引, BGR 陣列) 列表"""
+    from modules.image_decode import decode_to_array
+
+    max_frames = min(max_frames, MAX_FRAMES)
+    return [(i, decode_to_array(images_data[i])) for i in evenly_spaced(len(images_data), max_frames)]
+
+
+def sample_video_frames(data, max_frames=DEFAULT_SAMPLE_FRAMES, max_pixels=None):
+    """
+    影片：寫入暫存檔後以 OpenCV 讀取，在整段影片中平均取樣最多 max_frames 個畫面
+    回傳 (畫面索引, BGR 陣列) 列表；未取樣的畫面只 grab 不轉換顏色
+    """
+    from modules.image_decode import CV2_AVAILABLE, MAX_IMAGE_PIXELS
+
+    if not CV2_AVAILABLE:
+        raise VideoDecodeError("伺服器未安裝 OpenCV，無法解碼影片")
+    import cv2
+
+    max_frames = min(max_frames, MAX_FRAMES)
+    max_pixels = MAX_IMAGE_PIXELS if max_pixels is None else max_pixels
+
+    with tempfile.NamedTemporaryFile(suffix=".video") as tmp:
+        tmp.write(data)
+        tmp.flush()
+        capture = cv2.VideoCapture(tmp.name)
+        try:
+            if not capture.isOpened():
+                raise VideoDecodeError("無法解碼影片（格式不支援或檔案損毀）")
+            width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            if width * height > max_pixels:
+                raise ImageTooLargeError(f"影片畫面尺寸 {width}x{height} 超過上限 {max_pixels:,} 像素")
+
+            total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            if total > 0:
+                targets = set(evenly_spaced(total, max_frames))
+                last_target = max(targets)
+                stride = None
+            else:
+                # 部分串流格式沒有總畫面數，改以固定頻率取樣
+                fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+                stride = max(1, round(fps / FALLBACK_SAMPLE_FPS))
+                targets, last_target = None, None
+
+            frames = []
+            index = 0
+            while len(frames) < max_frames:
+                wanted = index % stride == 0 if stride else index in targets
+                if wanted:
+                    ok, frame = capture.read()
+                    if ok:
+                        frames.append((index, frame))
+                else:
+                    ok = capture.grab()
+                if not ok or (last_target is not None and index >= last_target):
+                    break
+                index += 1
+        finally:
+            capture.release()
+
+    if not frames:
+        raise VideoDecodeError("影片中沒有可解碼的畫面")
+    return frames
+
+
+def frame_signature(image):
+    """畫面指紋：先跳格取樣到約 128 像素再轉灰階，平均池化成 32x32（float32）"""
+    import numpy as np
+
+    height, width = image.shape[:2]
+    step = max(1, min(height, width) // (SIGNATURE_SIZE * 4))
+    gray = image[::step, ::step].astype(np.float32) @ np.array(_GRAY_WEIGHTS, dtype=np.float32)
+    block_h, block_w = gray.shape[0] // SIGNATURE_SIZE, gray.shape[1] // SIGNATURE_SIZE
+    if block_h == 0 or block_w == 0:
+        return gray
+    gray = gray[:block_h * SIGNATURE_SIZE, :block_w * SIGNATURE_SIZE]
+    return gray.reshape(SIGNATURE_SIZE, block_h, SIGNATURE_SIZE, block_w).mean(axis=(1, 3))
+
+
+def deduplicate_frames(frames, threshold=DEFAULT_DEDUP_THRESHOLD):
+    """
+    略過與上一個保留畫面幾乎相同的畫面（與上一個「保留」的畫面比較，緩慢移動累積後仍會保留新畫面）
+    frames 為 (索引, 陣列) 列表，回傳 (保留的畫面, 略過的數量)
+    """
+    import numpy as np
+
+    kept = []
+    previous = None
+    for index, frame in frames:
+        signature = frame_signature(frame)
+        if (previous is not None and previous.shape == signature.shape
+                and float(np.abs(signature - previous).mean()) < threshold):
+            continue
+        kept.append((index, frame))
+        previous = signature
+    return kept, len(frames) - len(kept)
@@ -0,0 +1,93 @@
+"""
+兩階段串接偵測（cascade）
+第一階段以低解析度（LOCATE_IMGSZ）對整張圖片推論，只負責找出藥丸位置，信心度門檻放低以免漏掉；
+第二階段從原始全解析度圖片裁出每個候選框（四周保留邊界），整批以 CROP_IMGSZ 推論一次，
+在每個裁切中取與候選框吻合、信心度最高的偵測作為最終的類別、信心度與框。
+外觀相近的藥丸只在裁切中以接近原始的解析度辨識，不必對整張大圖做高解析度推論
+"""
+import os
+
+import numpy as np
+
+from modules.tracking import iou_matrix
+
+# 第一階段（定位）的輸入尺寸與信心度門檻
+LOCATE_IMGSZ = int(os.environ.get("CASCADE_LOCATE_IMGSZ", "320"))
+LOCATE_CONF = float(os.environ.get("CASCADE_LOCATE_CONF", "0.25"))
+# 第二階段（裁切辨識）的輸入尺寸；裁切四周各保留框寬 / 高的比例作為邊界
+CROP_IMGSZ = int(os.environ.get("CASCADE_CROP_IMGSZ", "320"))
+CROP_PADDING = float(os.environ.get("CASCADE_CROP_PADDING", "0.15"))
+MIN_CROP_PADDING = 8
+# 每張圖片最多送進第二階段的候選框數（依第一階段信心度排序）
+MAX_CROPS = int(os.environ.get("CASCADE_MAX_CROPS", "64"))
+# 裁切中的偵測與候選框至少要有此 IoU 才視為同一顆藥丸
+MATCH_IOU = 0.3
+# 第二階段結果之間 IoU 超過此值時視為重複，只保留信心度較高者
+DEDUP_IOU = 0.7
+
+
+def top_candidates(boxes, scores, classes, limit=MAX_CROPS):
+    """依信心度由高到低保留最多 limit 個候選框"""
+    order = np.argsort(-scores, kind="stable")[:limit]
+    return boxes[order], scores[order], classes[order]
+
+
+def crop_regions(image, boxes, padding=CROP_PADDING):
+    """
+    從 BGR 陣列裁出每個框（四周加上邊界並限制在圖片範圍內）
+    回傳 (裁切列表, 每個裁切左上角在原圖的座標 (N, 2))
+    """
+    height, width = image.shape[:2]
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    sizes = boxes[:, 2:] - boxes[:, :2]
+    pad = np.maximum(sizes * padding, MIN_CROP_PADDING)
+    top_left = np.floor(boxes[:, :2] - pad).clip(0, None).astype(int)
+    bottom_right = np.ceil(boxes[:, 2:] + pad).astype(int)
+    bottom_right[:, 0] = np.clip(bottom_right[:, 0], top_left[:, 0] + 1, width)
+    bottom_right[:, 1] = np.clip(bottom_right[:, 1], top_left[:, 1] + 1, height)
+    crops = [
+        np.ascontiguousarray(image[y0:y1, x0:x1])
+        for (x0, y0), (x1, y1) in zip(top_left, bottom_right)
+    ]
+    return crops, top_left
+
+
+def refine(boxes, scores, classes, crop_detections, offsets, conf_threshold):
+    """
+    以第二階段的裁切結果修正候選框
+    crop_detections 為每個裁切的 (xyxy, conf, cls) 陣列（裁切座標）；
+    裁切中沒有吻合的偵測時，第一階段信心度達到門檻的候選框維持原結果，其餘捨棄
+    回傳最終的 (xyxy, conf, cls) 陣列（原圖座標，依信心度由高到低）
+    """
+    final_boxes, final_scores, final_classes = [], [], []
+    for i, (crop_boxes, crop_scores, crop_classes) in enumerate(crop_detections):
+        if len(crop_scores):
+            mapped = crop_boxes + np.tile(offsets[i], 2)
+            ious = iou_matrix(boxes[i:i + 1], mapped)[0]
+            matched = np.flatnonzero((ious >= MATCH_IOU) & (crop_scores >= conf_threshold))
+            if len(matched):
+                best = matched[np.argmax(crop_scores[matched])]
+                final_boxes.append(mapped[best])
+                final_scores.append(crop_scores[best])
+                final_classes.append(crop_classes[best])
+                continue
+        if scores[i] >= conf_threshold:
+            final_boxes.append(boxes[i])
+            final_scores.append(scores[i])
+            final_classes.append(classes[i])
+
+    if not final_scores:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+    return suppress_duplicates(np.array(final_boxes), np.array(final_scores), np.array(final_classes))
+
+
+def suppress_duplicates(boxes, scores, classes, iou_threshold=DEDUP_IOU):
+    """相鄰候選框在裁切中可能找到同一顆藥丸，依信心度貪婪保留、移除高度重疊的框"""
+    order = np.argsort(-scores, kind="stable")
+    boxes, scores, classes = boxes[order], scores[order], classes[order]
+    ious = iou_matrix(boxes, boxes)
+    keep = np.ones(len(scores), dtype=bool)
+    for i in range(len(scores)):
+        if keep[i]:
+            keep[i + 1:] &= ious[i, i + 1:] <= iou_threshold
+    return boxes[keep], scores[keep], classes[keep]
@@ -0,0 +1,215 @@
+"""
+推論的 CPU 執行緒配置
+torch 預設的 intra-op 執行緒數等於主機核心數，在 Cloud Run 上會超過容器實際可用的 CPU，
+與 uvicorn 事件迴圈、解碼 / 標註執行緒搶 CPU，延遲因此不穩定。
+每個 uvicorn worker 依可用 CPU（affinity 與 cgroup 配額取較小者）除以 worker 數決定 intra-op 執行緒數，
+inter-op 預設 1（推論只在單一執行緒中進行）；多個 worker 時可設定 CPU_AFFINITY=auto 讓每個 worker 固定在不同的 CPU 上
+"""
+import os
+import sys
+import math
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 以檔案鎖分配 worker 編號（僅限 POSIX；其他平台無法自動綁定 CPU）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# intra-op / inter-op 執行緒數："auto" 或正整數
+TORCH_INTRA_OP_THREADS = os.environ.get("TORCH_INTRA_OP_THREADS", "auto").lower()
+TORCH_INTER_OP_THREADS = os.environ.get("TORCH_INTER_OP_THREADS", "1").lower()
+# CPU 綁定："off"（預設）、"auto"（依 worker 編號平均分配可用 CPU）或 CPU 列表，例如 "0-3,6"
+CPU_AFFINITY = os.environ.get("CPU_AFFINITY", "off").lower()
+# uvicorn 的 worker 數（uvicorn 本身也以 WEB_CONCURRENCY 作為 --workers 的預設值）
+WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+_plan = None
+_plan_lock = threading.Lock()
+# 持有 worker 編號的鎖檔，行程結束時自動釋放，重新啟動的 worker 會拿到同一個編號
+_slot_file = None
+
+
+def cgroup_cpu_limit():
+    """cgroup 的 CPU 配額（可為小數），沒有限制或無法讀取時回傳 None"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus():
+    """目前行程可用的 CPU 編號（排序後）"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_cpu_list(value):
+    """'0-3,6' -> [0, 1, 2, 3, 6]"""
+    cpus = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+            cpus.update(range(start, end + 1))
+        else:
+            cpus.add(int(part))
+    if not cpus:
+        raise ValueError(f"CPU 列表是空的: {value!r}")
+    return sorted(cpus)
+
+
+def claim_worker_slot(workers=WORKERS):
+    """
+    以鎖檔取得本 worker 的編號（0 ～ workers-1），同一個 uvicorn 主行程下的 worker 不會拿到相同編號；
+    拿不到時（例如 worker 數設定不符）回傳 None
+    """
+    global _slot_file
+    if workers <= 1:
+        return 0
+    if fcntl is None:
+        return None
+    lock_dir = tempfile.gettempdir()
+    for slot in range(workers):
+        path = os.path.join(lock_dir, f"pill-api-worker-{os.getppid()}-{slot}.lock")
+        f = open(path, "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _slot_file = f
+        return slot
+    return None
+
+
+def split_cpus(cpus, workers, slot):
+    """把 CPU 平均分給 workers 個 worker，回傳第 slot 個 worker 的 CPU（CPU 比 worker 少時輪流共用）"""
+    if workers >= len(cpus):
+        return [cpus[slot % len(cpus)]]
+    per_worker, extra = divmod(len(cpus), workers)
+    start = slot * per_worker + min(slot, extra)
+    return cpus[start:start + per_worker + (1 if slot < extra else 0)]
+
+
+def _thread_count(value, default):
+    if value == "auto":
+        return default
+    return max(1, int(value))
+
+
+def compute_plan(workers=WORKERS, intra=TORCH_INTRA_OP_THREADS, inter=TORCH_INTER_OP_THREADS,
+                 affinity=CPU_AFFINITY, slot=None):
+    """決定本 worker 的 CPU 綁定與執行緒數，回傳描述用的字典"""
+    cpus = available_cpus()
+    pinned = None
+    if affinity == "auto":
+        if slot is None:
+            slot = claim_worker_slot(workers)
+        if slot is not None:
+            pinned = split_cpus(cpus, workers, slot)
+    elif affinity not in ("", "off", "none", "false"):
+        pinned = [cpu for cpu in parse_cpu_list(affinity) if cpu in cpus] or None
+
+    limit = cgroup_cpu_limit()
+    if pinned:
+        usable = len(pinned)
+    else:
+        usable = len(cpus)
+        if limit is not None:
+            usable = min(usable, max(1, math.ceil(limit)))
+        usable = max(1, usable // workers)
+    return {
+        "workers": workers,
+        "worker_slot": slot,
+        "available_cpus": len(cpus),
+        "cgroup_cpu_limit": limit,
+        "affinity": pinned,
+        "intra_op_threads": _thread_count(intra, usable),
+        "inter_op_threads": _thread_count(inter, 1),
+    }
+
+
+def get_plan():
+    global _plan
+    if _plan is None:
+        with _plan_lock:
+            if _plan is None:
+                _plan = compute_plan()
+    return _plan
+
+
+def set_plan(plan):
+    """以指定的配置取代依環境變數決定的配置（例如批次工作 worker 行程），回傳該配置"""
+    global _plan
+    with _plan_lock:
+        _plan = plan
+    return plan
+
+
+def _pin_all_threads(cpus):
+    """把行程中現有的所有執行緒綁到 cpus（之後建立的執行緒會繼承）"""
+    try:
+        thread_ids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        thread_ids = [0]
+    for tid in thread_ids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            pass
+
+
+def apply_affinity(plan=None):
+    """依配置綁定 CPU（應在啟動初期、建立推論執行緒之前呼叫）"""
+    plan = plan or get_plan()
+    if plan["affinity"] and hasattr(os, "sched_setaffinity"):
+        _pin_all_threads(plan["affinity"])
+        worker = f"worker {plan['worker_slot']} " if plan["worker_slot"] is not None else ""
+        logger.info(f"[調試] {worker}綁定 CPU: {plan['affinity']}")
+    return plan
+
+
+def configure_torch(plan=None):
+    """設定 torch 的 intra-op / inter-op 執行緒數（需在第一次推論之前呼叫）"""
+    plan = plan or get_plan()
+    try:
+        import torch
+    except ImportError:
+        return plan
+    torch.set_num_threads(plan["intra_op_threads"])
+    try:
+        torch.set_num_interop_threads(plan["inter_op_threads"])
+    except RuntimeError as e:
+        # inter-op 執行緒池已經啟動過時無法再調整
+        logger.warning(f"無法設定 torch inter-op 執行緒數: {e}")
+    logger.info(f"[調試] torch 執行緒: intra-op={torch.get_num_threads()}, "
+                f"inter-op={torch.get_num_interop_threads()}")
+    return plan
+
+
+def describe():
+    """目前的配置（供健康檢查顯示）"""
+    plan = dict(get_plan())
+    # 只在 torch 已經匯入時讀取實際值，不為了健康檢查匯入 torch
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        plan["torch_threads"] = {"intra_op": torch.get_num_threads(), "inter_op": torch.get_num_interop_threads()}
+    return plan
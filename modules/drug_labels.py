@@ -0,0 +1,37 @@
+"""
+藥品標籤前處理工具
+在載入藥品目錄與模型時預先計算顯示用標籤，繪圖時只需查表
+"""
+import re
+
+# 中文藥名：取數字或括號之前、且包含中文字的部分
+_ZH_NAME_PATTERN = re.compile(r'^([^\d\(\uff08]*[\u4e00-\u9fff][^\d\(\uff08]*)')
+# 模型類別名稱的後綴（例如 "_front"、"_2"）
+_CLASS_SUFFIX_PATTERN = re.compile(r'_.*$')
+# 需要移除的引號（半形與全形）
+_QUOTE_CHARS = ('"', '\u201c', '\u201d')
+
+
+def make_display_label(drug_id, drug_name_zh):
+    """根據中文藥名產生繪圖用的顯示標籤，無中文名稱時回傳 drug_id"""
+    if not drug_name_zh or drug_name_zh == drug_id:
+        return drug_id
+
+    clean_name = drug_name_zh
+    for quote in _QUOTE_CHARS:
+        clean_name = clean_name.replace(quote, '')
+
+    match = _ZH_NAME_PATTERN.match(clean_name)
+    if match:
+        return match.group(1).strip()
+    return drug_name_zh
+
+
+def strip_class_suffix(class_name):
+    """移除模型類別名稱中 _ 之後的後綴，取得對應資料庫的基礎藥品ID"""
+    return _CLASS_SUFFIX_PATTERN.sub('', class_name)
+
+
+def build_base_id_map(class_names):
+    """為模型的所有類別名稱建立 類別名稱 -> 基礎藥品ID 的映射"""
+    return {name: strip_class_suffix(name) for name in class_names}
@@ -0,0 +1,84 @@
+"""
+圖片解碼
+直接把上傳的位元組解碼成連續的 BGR uint8 NumPy 陣列 (H, W, 3)，可直接交給 YOLO 推論
+（ultralytics 對 NumPy 輸入視為 BGR，不需要再轉換一次）；只有需要標註時才轉成 PIL 圖片。
+優先使用 OpenCV imdecode（libjpeg-turbo），會依 EXIF 方向旋轉；OpenCV 不支援的格式改用 PIL。
+解碼前先只讀取檔頭檢查寬高，像素數超過 MAX_IMAGE_PIXELS 的圖片（含解壓縮炸彈）不會被解碼
+"""
+import io
+import os
+import logging
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from modules.request_limits import ImageTooLargeError
+
+logger = logging.getLogger(__name__)
+
+# 嘗試導入 OpenCV，如果失敗則全部改用 PIL 解碼
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+    logger.info("[調試] OpenCV 不可用，圖片解碼改用 PIL")
+
+# 單張圖片的像素上限（預設 5000 萬像素，涵蓋一般手機相機的最高解析度）
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", str(50_000_000)))
+
+
+def check_image_size(data, max_pixels=None):
+    """
+    只解析檔頭取得寬高（不解碼像素），超過像素上限時拋出 ImageTooLargeError
+    回傳 (寬, 高)；PIL 無法辨識的格式回傳 None，交給解碼器處理（OpenCV 另有自己的像素上限）
+    """
+    max_pixels = MAX_IMAGE_PIXELS if max_pixels is None else max_pixels
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e)) from e
+    except Exception:
+        return None
+    if width * height > max_pixels:
+        raise ImageTooLargeError(f"圖片尺寸 {width}x{height} 超過上限 {max_pixels:,} 像素")
+    return width, height
+
+
+def _decode_with_pil(data):
+    """PIL 解碼：套用 EXIF 方向、轉成 RGB，再翻轉通道為 BGR"""
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+
+
+def decode_to_array(data, max_pixels=None):
+    """
+    將圖片位元組解碼為 BGR uint8 陣列 (H, W, 3)
+    IMREAD_COLOR 會套用 EXIF 方向，並把灰階、含透明度、16 位元的圖片統一轉成 8 位元 3 通道
+    """
+    check_image_size(data, max_pixels)
+    if CV2_AVAILABLE:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is not None:
+            return image
+    return _decode_with_pil(data)
+
+
+def image_size(image):
+    """回傳 (寬, 高)，同時支援 NumPy 陣列與 PIL 圖片"""
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size
+
+
+def to_pil(image):
+    """BGR 陣列轉成新的 RGB PIL 圖片（需要標註時才呼叫）；PIL 圖片則轉成 RGB 副本"""
+    if not isinstance(image, np.ndarray):
+        return image.convert("RGB")
+    if CV2_AVAILABLE:
+        return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return Image.fromarray(np.ascontiguousarray(image[:, :, ::-1]))
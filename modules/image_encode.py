@@ -0,0 +1,156 @@
+"""
+標註圖片輸出
+依請求選項決定輸出格式（JPEG / WebP / PNG）、品質與最長邊；縮小時先把原圖縮到目標尺寸再繪製標籤，
+文字與框線在小圖上依然清晰，也不必先在全解析度上繪製再整張縮小。
+JPEG / PNG 的 BGR 陣列優先以 OpenCV 編碼；WebP 一律用 PIL（OpenCV 無法調整 WebP 的壓縮速度），
+OpenCV 不可用時全部改用 PIL
+"""
+import io
+import os
+import time
+import logging
+
+import numpy as np
+from PIL import Image
+
+from modules.image_decode import image_size, to_pil
+
+logger = logging.getLogger(__name__)
+
+# 嘗試導入 OpenCV，如果失敗則全部改用 PIL 縮放與編碼
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+    logger.info("[調試] OpenCV 不可用，圖片編碼改用 PIL")
+
+# 格式 -> (副檔名, Content-Type)
+OUTPUT_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+    "png": (".png", "image/png"),
+}
+# PNG 為無損格式，品質選項不適用；壓縮等級 1 與 OpenCV 預設相同（等級 6 約慢 3 倍，只小約一成）
+PNG_COMPRESSION = int(os.environ.get("PNG_COMPRESSION", "1"))
+# WebP 壓縮速度 0（最快）～ 6（最慢）；預設 4 的編碼時間約為 0 的 4 倍，照片大小差異不大
+WEBP_METHOD = int(os.environ.get("WEBP_METHOD", "0"))
+
+# 未在請求中指定時的預設值（與原本的輸出相同：全解析度 JPEG、品質 75、不產生縮圖）
+DEFAULT_FORMAT = os.environ.get("ANNOTATED_IMAGE_FORMAT", "jpeg").lower()
+DEFAULT_QUALITY = int(os.environ.get("ANNOTATED_IMAGE_QUALITY", "75"))
+DEFAULT_MAX_DIMENSION = int(os.environ.get("ANNOTATED_IMAGE_MAX_DIMENSION", "0")) or None
+DEFAULT_THUMBNAIL_SIZE = int(os.environ.get("ANNOTATED_THUMBNAIL_SIZE", "0")) or None
+
+
+def resolve_options(options=None):
+    """合併請求選項與預設值，回傳 {format, quality, max_dimension, thumbnail_size}"""
+    options = {key: value for key, value in (options or {}).items() if value is not None}
+    resolved = {
+        "format": options.get("format", DEFAULT_FORMAT).lower(),
+        "quality": options.get("quality", DEFAULT_QUALITY),
+        "max_dimension": options.get("max_dimension", DEFAULT_MAX_DIMENSION),
+        "thumbnail_size": options.get("thumbnail_size", DEFAULT_THUMBNAIL_SIZE),
+    }
+    if resolved["format"] not in OUTPUT_FORMATS:
+        raise ValueError(f"不支援的輸出格式: {resolved['format']}，可用格式: {list(OUTPUT_FORMATS)}")
+    return resolved
+
+
+def target_size(width, height, max_dimension):
+    """最長邊不超過 max_dimension 的 (寬, 高)，只縮小不放大"""
+    if not max_dimension or max(width, height) <= max_dimension:
+        return width, height
+    scale = max_dimension / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def resize(image, size):
+    """
+    縮小 BGR 陣列（或 PIL 圖片）到 size=(寬, 高)
+    先以面積平均反覆減半（OpenCV 對 2 倍整數倍率有快速路徑），剩下不到 2 倍的部分用雙線性內插；
+    畫質接近整張 INTER_AREA（避免摩爾紋），但 1200 萬像素的圖片快數倍
+    """
+    if not isinstance(image, np.ndarray):
+        return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    if not CV2_AVAILABLE:
+        # PIL 不在意通道順序，直接縮放 BGR 陣列
+        return np.asarray(Image.fromarray(image).resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0))
+
+    width, height = size
+    while image.shape[1] // 2 >= width and image.shape[0] // 2 >= height:
+        half_width, half_height = image.shape[1] // 2, image.shape[0] // 2
+        # 裁掉奇數的最後一行 / 列，讓倍率剛好是 2
+        image = cv2.resize(image[:half_height * 2, :half_width * 2], (half_width, half_height),
+                           interpolation=cv2.INTER_AREA)
+    if (image.shape[1], image.shape[0]) == (width, height):
+        return image
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+def scale_detections(detections, from_size, to_size):
+    """把偵測框座標換算到縮放後的圖片（回傳新的列表，不修改原本的偵測結果）"""
+    if from_size == to_size:
+        return detections
+    scale_x = to_size[0] / from_size[0]
+    scale_y = to_size[1] / from_size[1]
+    scaled = []
+    for det in detections:
+        x0, y0, x1, y1 = det['bbox']
+        scaled.append(dict(det, bbox=[round(x0 * scale_x), round(y0 * scale_y),
+                                      round(x1 * scale_x), round(y1 * scale_y)]))
+    return scaled
+
+
+def _encode_with_cv2(image, fmt, quality):
+    if fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    ok, buffer = cv2.imencode(OUTPUT_FORMATS[fmt][0], image, params)
+    if not ok:
+        raise IOError(f"OpenCV 無法編碼為 {fmt}")
+    return buffer.tobytes()
+
+
+def _encode_with_pil(image, fmt, quality):
+    buffer = io.BytesIO()
+    if fmt == "png":
+        image.save(buffer, format="PNG", compress_level=PNG_COMPRESSION)
+    elif fmt == "webp":
+        image.save(buffer, format="WEBP", quality=quality, method=WEBP_METHOD)
+    else:
+        image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def encode(image, fmt="jpeg", quality=DEFAULT_QUALITY):
+    """將 BGR 陣列或 PIL 圖片編碼為指定格式，回傳位元組"""
+    if isinstance(image, np.ndarray):
+        if CV2_AVAILABLE and fmt != "webp":
+            return _encode_with_cv2(image, fmt, quality)
+        image = to_pil(image)
+    return _encode_with_pil(image, fmt, quality)
+
+
+def encode_to_file(image, path, fmt="jpeg", quality=DEFAULT_QUALITY):
+    """編碼並寫入檔案，回傳 (位元組數, 編碼耗時秒數)"""
+    start = time.perf_counter()
+    data = encode(image, fmt, quality)
+    elapsed = time.perf_counter() - start
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data), elapsed
+
+
+def describe(image, fmt, quality, num_bytes, encode_seconds):
+    """輸出圖片的摘要，放在 API 回應中"""
+    width, height = image_size(image)
+    return {
+        "format": fmt,
+        "quality": None if fmt == "png" else quality,
+        "width": width,
+        "height": height,
+        "bytes": num_bytes,
+        "encode_ms": round(encode_seconds * 1000, 2),
+    }
@@ -0,0 +1,83 @@
+"""
+推論參數
+請求可指定 conf、iou、imgsz、max_det 與類別白名單，直接傳給 model.predict：
+類別白名單在 NMS 之前就過濾掉不需要的類別，max_det 限制 NMS 的輸出數量；
+imgsz="auto" 依輸入解析度決定推論尺寸，小圖不放大（省下推論成本），高解析度照片改用較大的尺寸保留細節
+"""
+import os
+
+# 未在請求中指定時的預設值（與原本的行為相同：conf 0.7，其餘為 ultralytics 預設）
+DEFAULT_CONF = float(os.environ.get("INFERENCE_CONF", "0.7"))
+DEFAULT_IOU = float(os.environ.get("INFERENCE_IOU", "0.7"))
+DEFAULT_IMGSZ = os.environ.get("INFERENCE_IMGSZ", "640").lower()
+DEFAULT_MAX_DET = int(os.environ.get("INFERENCE_MAX_DET", "300"))
+
+# imgsz="auto" 的候選尺寸（皆為 32 的倍數）與上限
+AUTO_IMGSZ_STEPS = (320, 480, 640, 960, 1280, 1600, 1920)
+AUTO_IMGSZ_MAX = int(os.environ.get("AUTO_IMGSZ_MAX", "1280"))
+# 大圖的推論尺寸約為最長邊的 1/3（手機的 4032 像素照片 -> 1280），但不低於 640
+AUTO_IMGSZ_DIVISOR = 3
+AUTO_IMGSZ_MIN_LARGE = 640
+
+
+def auto_imgsz(width, height):
+    """
+    依輸入解析度決定推論尺寸
+    最長邊不超過 640 時取不小於最長邊的最小候選尺寸（不放大小圖）；
+    更大的圖片取不超過最長邊 1/3 的最大候選尺寸，介於 640 與 AUTO_IMGSZ_MAX 之間
+    """
+    longest = max(width, height)
+    steps = [step for step in AUTO_IMGSZ_STEPS if step <= AUTO_IMGSZ_MAX] or [AUTO_IMGSZ_MAX]
+    if longest <= AUTO_IMGSZ_MIN_LARGE:
+        return next((step for step in steps if step >= longest), steps[-1])
+    target = longest / AUTO_IMGSZ_DIVISOR
+    candidates = [step for step in steps if AUTO_IMGSZ_MIN_LARGE <= step <= target]
+    return candidates[-1] if candidates else min(AUTO_IMGSZ_MIN_LARGE, steps[-1])
+
+
+def resolve(options=None, image=None):
+    """
+    合併請求選項與預設值，回傳 model.predict 的參數字典
+    options 的 classes 需已轉成類別索引；imgsz 為 "auto" 時依 image（BGR 陣列）的尺寸決定
+    """
+    options = {key: value for key, value in (options or {}).items() if value is not None}
+    imgsz = options.get("imgsz", DEFAULT_IMGSZ)
+    if isinstance(imgsz, str):
+        if imgsz.lower() == "auto":
+            imgsz = auto_imgsz(image.shape[1], image.shape[0]) if hasattr(image, "shape") else AUTO_IMGSZ_MIN_LARGE
+        else:
+            imgsz = int(imgsz)
+    kwargs = {
+        "conf": options.get("conf", DEFAULT_CONF),
+        "iou": options.get("iou", DEFAULT_IOU),
+        "imgsz": imgsz,
+        "max_det": options.get("max_det", DEFAULT_MAX_DET),
+    }
+    if options.get("classes") is not None:
+        kwargs["classes"] = list(options["classes"])
+    return kwargs
+
+
+def resolve_classes(names, classes):
+    """
+    類別白名單（類別名稱或索引）-> 排序後的類別索引列表
+    names 為模型的 {索引: 名稱}；有不存在的類別時拋出 ValueError
+    """
+    if classes is None:
+        return None
+    by_name = {name: class_id for class_id, name in names.items()}
+    resolved = set()
+    unknown = []
+    for item in classes:
+        if isinstance(item, int) or (isinstance(item, str) and item.isdigit() and item not in by_name):
+            class_id = int(item)
+            if class_id in names:
+                resolved.add(class_id)
+                continue
+        elif item in by_name:
+            resolved.add(by_name[item])
+            continue
+        unknown.append(item)
+    if unknown:
+        raise ValueError(f"模型沒有這些類別: {unknown}")
+    return sorted(resolved)
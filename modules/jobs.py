@@ -0,0 +1,578 @@
+"""
+非同步批次偵測工作佇列
+工作（job）與其中每張圖片（item）存在本機的 SQLite 檔案（WAL 模式），API 行程只負責寫入與查詢；
+獨立的 worker 行程各自載入模型，從佇列認領同一個工作的一批圖片（租約制，worker 中斷時租約到期後由其他 worker 重新認領），
+以 detect_pills_batch 批次推論後寫回結果並更新進度。
+讀取失敗（網路 / GCS）的圖片以指數退避重試，最多 JOB_MAX_ATTEMPTS 次；無法解碼的圖片直接標記失敗。
+完成（或取消）的工作保留 JOB_RESULT_TTL_HOURS 小時，另外最多保留 JOB_MAX_FINISHED_JOBS 個，之後連同結果一起刪除
+
+獨立執行 worker（與 API 共用同一個 JOB_DB_PATH）:
+    python -m modules.jobs --workers 2
+"""
+import os
+import json
+import time
+import uuid
+import base64
+import sqlite3
+import logging
+import argparse
+import multiprocessing
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+
+from modules import cpu_topology
+from modules.request_limits import MAX_UPLOAD_BYTES
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "jobs/jobs.sqlite3")
+# API 行程啟動時一併啟動的 worker 行程數（0 表示只接受工作，由獨立的 worker 處理）
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "0"))
+# 每個 worker 行程的 torch intra-op 執行緒數（與 API 的推論共用 CPU）
+JOB_WORKER_THREADS = int(os.environ.get("JOB_WORKER_THREADS", "1"))
+# 每次認領並一起推論的圖片數
+JOB_BATCH_SIZE = int(os.environ.get("JOB_BATCH_SIZE", "16"))
+JOB_MAX_ITEMS = int(os.environ.get("JOB_MAX_ITEMS", "100000"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+# 重試前的等待時間（秒），每次加倍
+JOB_RETRY_DELAY_S = float(os.environ.get("JOB_RETRY_DELAY_S", "5"))
+# 認領後的租約長度（秒），超過仍未寫回結果時視為 worker 中斷
+JOB_LEASE_S = float(os.environ.get("JOB_LEASE_S", "300"))
+JOB_POLL_INTERVAL_S = float(os.environ.get("JOB_POLL_INTERVAL_S", "1"))
+JOB_FETCH_TIMEOUT_S = float(os.environ.get("JOB_FETCH_TIMEOUT_S", "30"))
+# 本機路徑的圖片只允許位於此目錄之下（未設定時不接受本機路徑）
+JOB_INPUT_ROOT = os.environ.get("JOB_INPUT_ROOT")
+# 允許讀取的 GCS bucket 與 http(s) 主機（逗號分隔；主機可用 *.example.com 比對子網域），未設定時不接受該類 uri。
+# 伺服器會以自己的網路位置與服務帳號讀取，不能讓客戶端任意指定（例如雲端的 metadata 端點或其他 bucket）
+JOB_ALLOWED_BUCKETS = frozenset(
+    name.strip() for name in os.environ.get("JOB_ALLOWED_BUCKETS", "").split(",") if name.strip()
+)
+JOB_ALLOWED_HOSTS = frozenset(
+    name.strip().lower() for name in os.environ.get("JOB_ALLOWED_HOSTS", "").split(",") if name.strip()
+)
+# 結果保留期限與數量
+JOB_RESULT_TTL_HOURS = float(os.environ.get("JOB_RESULT_TTL_HOURS", "72"))
+JOB_MAX_FINISHED_JOBS = int(os.environ.get("JOB_MAX_FINISHED_JOBS", "1000"))
+JOB_PURGE_INTERVAL_S = 600
+
+# 工作與圖片的狀態
+QUEUED, RUNNING, COMPLETED, CANCELLED = "queued", "running", "completed", "cancelled"
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    options TEXT,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    client_id TEXT,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS job_items_claim ON job_items (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+"""
+
+
+class RetryableError(Exception):
+    """暫時性的錯誤（例如讀取圖片時網路中斷），稍後重試"""
+
+
+def _host_allowed(host):
+    host = (host or "").lower()
+    return host in JOB_ALLOWED_HOSTS or any(
+        pattern.startswith("*.") and host.endswith(pattern[1:]) for pattern in JOB_ALLOWED_HOSTS
+    )
+
+
+def _check_remote_uri(uri):
+    """gs:// 與 http(s):// 的 uri 必須位於允許清單中，否則拋出 ValueError"""
+    if uri.startswith("gs://"):
+        bucket_name = uri[len("gs://"):].partition("/")[0]
+        if bucket_name not in JOB_ALLOWED_BUCKETS:
+            raise ValueError(f"不允許讀取的 bucket（見 JOB_ALLOWED_BUCKETS）: {bucket_name}")
+    else:
+        host = urllib.parse.urlsplit(uri).hostname
+        if not _host_allowed(host):
+            raise ValueError(f"不允許讀取的主機（見 JOB_ALLOWED_HOSTS）: {host}")
+
+
+class _AllowListRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """重新導向的目標同樣必須在允許清單中"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        _check_remote_uri(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_url_opener = urllib.request.build_opener(_AllowListRedirectHandler)
+
+
+def validate_source(item):
+    """
+    檢查一個圖片來源：{"uri": gs:// / http(s):// / 本機路徑} 或 {"image": base64}，擇一
+    不合法（含不在允許清單中的 bucket / 主機）時拋出 ValueError
+    """
+    uri, image = item.get("uri"), item.get("image")
+    if (uri is None) == (image is None):
+        raise ValueError("uri 與 image 必須擇一指定")
+    if uri is None:
+        return
+    if uri.startswith(("gs://", "http://", "https://")):
+        _check_remote_uri(uri)
+        return
+    if not JOB_INPUT_ROOT:
+        raise ValueError(f"不接受本機路徑（未設定 JOB_INPUT_ROOT）: {uri}")
+    root = os.path.realpath(JOB_INPUT_ROOT)
+    if os.path.commonpath([root, os.path.realpath(os.path.join(root, uri))]) != root:
+        raise ValueError(f"路徑不在 JOB_INPUT_ROOT 之下: {uri}")
+
+
+def fetch_source(source):
+    """讀取圖片來源的位元組；網路 / GCS 錯誤拋出 RetryableError，其餘錯誤拋出 ValueError"""
+    if source.get("image") is not None:
+        try:
+            return base64.b64decode(source["image"], validate=False)
+        except ValueError as e:
+            raise ValueError(f"base64 解碼失敗: {e}")
+
+    uri = source["uri"]
+    # 工作送出後允許清單可能已經變更，讀取前再檢查一次
+    if uri.startswith(("gs://", "http://", "https://")):
+        _check_remote_uri(uri)
+    try:
+        if uri.startswith("gs://"):
+            from modules.yolo_pill_analyzer import _get_storage_client
+
+            bucket_name, _, blob_name = uri[len("gs://"):].partition("/")
+            data = _get_storage_client().bucket(bucket_name).blob(blob_name).download_as_bytes(
+                timeout=JOB_FETCH_TIMEOUT_S
+            )
+        elif uri.startswith(("http://", "https://")):
+            with _url_opener.open(uri, timeout=JOB_FETCH_TIMEOUT_S) as response:
+                data = response.read(MAX_UPLOAD_BYTES + 1)
+        else:
+            path = os.path.join(os.path.realpath(JOB_INPUT_ROOT), uri)
+            with open(path, "rb") as f:
+                data = f.read(MAX_UPLOAD_BYTES + 1)
+    except FileNotFoundError as e:
+        raise ValueError(f"找不到圖片: {e}")
+    except ValueError:
+        raise
+    except ImportError as e:
+        raise ValueError(f"無法讀取 {uri}: {e}")
+    except Exception as e:
+        raise RetryableError(f"讀取 {uri} 失敗: {e}")
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise ValueError(f"圖片超過上限 {MAX_UPLOAD_BYTES / (1024 * 1024):.1f} MB")
+    return data
+
+
+def _iso(timestamp):
+    return None if timestamp is None else time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+
+class JobStore:
+    """SQLite 工作佇列（每次操作開新連線，可同時在多個執行緒 / 行程中使用）"""
+
+    def __init__(self, path=None):
+        self.path = path or JOB_DB_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """寫入交易（BEGIN IMMEDIATE：多個 worker 同時認領時彼此排隊，不會認領到同一張圖片）"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    # --- API 端 ---
+
+    def submit(self, items, model_name, options=None):
+        """建立工作，items 為 [{"id", "uri" | "image"}]，回傳工作 ID"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        rows = [
+            (job_id, index, item.get("id"),
+             json.dumps({key: item[key] for key in ("uri", "image") if item.get(key) is not None}), PENDING)
+            for index, item in enumerate(items)
+        ]
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, model_name, options, total, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, model_name, json.dumps(options) if options else None, len(rows), now),
+            )
+            conn.executemany(
+                "INSERT INTO job_items (job_id, idx, client_id, source, status) VALUES (?, ?, ?, ?, ?)", rows
+            )
+        return job_id
+
+    def status(self, job_id):
+        """工作狀態與進度，找不到（或已過期刪除）時回傳 None"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        finished = row["done"] + row["failed"]
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "model_name": row["model_name"],
+            "options": json.loads(row["options"]) if row["options"] else None,
+            "total": row["total"],
+            "done": row["done"],
+            "failed": row["failed"],
+            "pending": row["total"] - finished if row["status"] != CANCELLED else 0,
+            "progress": round(finished / row["total"], 4) if row["total"] else 1.0,
+            "created_at": _iso(row["created_at"]),
+            "started_at": _iso(row["started_at"]),
+            "finished_at": _iso(row["finished_at"]),
+            "expires_at": _iso(row["expires_at"]),
+        }
+
+    def results(self, job_id, offset=0, limit=100, status=None):
+        """依順序回傳工作中的圖片結果（可只取某個狀態）"""
+        query = "SELECT idx, client_id, status, attempts, result, error FROM job_items WHERE job_id = ?"
+        params = [job_id]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY idx LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        conn = self._connect()
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        items = []
+        for row in rows:
+            item = {"index": row["idx"], "id": row["client_id"], "status": row["status"],
+                    "attempts": row["attempts"]}
+            if row["result"] is not None:
+                item.update(json.loads(row["result"]))
+            if row["error"] is not None:
+                item["error"] = row["error"]
+            items.append(item)
+        return items
+
+    def cancel(self, job_id):
+        """取消工作：尚未完成的圖片不再處理；回傳是否有此工作"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return False
+            if row["status"] in (COMPLETED, CANCELLED):
+                return True
+            conn.execute(
+                "UPDATE job_items SET status = ?, lease_until = NULL WHERE job_id = ? AND status IN (?, ?)",
+                (CANCELLED, job_id, PENDING, RUNNING),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, expires_at = ? WHERE id = ?",
+                (CANCELLED, now, now + JOB_RESULT_TTL_HOURS * 3600, job_id),
+            )
+        return True
+
+    def pending_count(self):
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM job_items WHERE status IN (?, ?)", (PENDING, RUNNING)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    # --- worker 端 ---
+
+    def claim(self, batch_size=None, lease_s=None):
+        """
+        認領最早建立的工作中最多 batch_size 張可處理的圖片（等待中且已到重試時間，或租約已過期）
+        回傳 {"job_id", "model_name", "options", "items": [{"index", "source", "attempts"}]}，沒有工作時回傳 None
+        """
+        batch_size = batch_size or JOB_BATCH_SIZE
+        lease_s = lease_s or JOB_LEASE_S
+        now = time.time()
+        with self._transaction() as conn:
+            self._fail_abandoned(conn, now)
+            row = conn.execute(
+                "SELECT j.id, j.model_name, j.options FROM jobs j JOIN job_items i ON i.job_id = j.id "
+                "WHERE j.status IN (?, ?) AND ((i.status = ? AND i.available_at <= ?) "
+                "OR (i.status = ? AND i.lease_until < ?)) ORDER BY j.created_at LIMIT 1",
+                (QUEUED, RUNNING, PENDING, now, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            job_id = row["id"]
+            items = conn.execute(
+                "SELECT idx, source, attempts FROM job_items WHERE job_id = ? AND "
+                "((status = ? AND available_at <= ?) OR (status = ? AND lease_until < ?)) ORDER BY idx LIMIT ?",
+                (job_id, PENDING, now, RUNNING, now, batch_size),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE job_items SET status = ?, attempts = attempts + 1, lease_until = ? WHERE job_id = ? AND idx = ?",
+                [(RUNNING, now + lease_s, job_id, item["idx"]) for item in items],
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (RUNNING, now, job_id),
+            )
+        return {
+            "job_id": job_id,
+            "model_name": row["model_name"],
+            "options": json.loads(row["options"]) if row["options"] else None,
+            "items": [{"index": item["idx"], "source": json.loads(item["source"]), "attempts": item["attempts"] + 1}
+                      for item in items],
+        }
+
+    def _fail_abandoned(self, conn, now):
+        """租約過期且已用完重試次數的圖片（worker 反覆在處理途中中斷）標記為失敗"""
+        rows = conn.execute(
+            "SELECT job_id, idx FROM job_items WHERE status = ? AND lease_until < ? AND attempts >= ?",
+            (RUNNING, now, JOB_MAX_ATTEMPTS),
+        ).fetchall()
+        by_job = {}
+        for row in rows:
+            by_job.setdefault(row["job_id"], []).append((row["idx"], FAILED, None, "處理逾時（worker 中斷）"))
+        for job_id, outcomes in by_job.items():
+            self._write_outcomes(conn, job_id, outcomes, now)
+
+    def finish(self, job_id, outcomes):
+        """
+        寫回一批圖片的結果，outcomes 為 [(index, 狀態, 結果字典, 錯誤訊息)]，狀態為 done、failed 或 pending（重試）
+        已被取消的圖片不會被覆寫
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._write_outcomes(conn, job_id, outcomes, now)
+
+    def _write_outcomes(self, conn, job_id, outcomes, now):
+        counts = {DONE: 0, FAILED: 0}
+        for index, status, result, error in outcomes:
+            if status == PENDING:
+                attempts = conn.execute(
+                    "SELECT attempts FROM job_items WHERE job_id = ? AND idx = ?", (job_id, index)
+                ).fetchone()["attempts"]
+                delay = JOB_RETRY_DELAY_S * (2 ** max(0, attempts - 1))
+                conn.execute(
+                    "UPDATE job_items SET status = ?, lease_until = NULL, available_at = ?, error = ? "
+                    "WHERE job_id = ? AND idx = ? AND status = ?",
+                    (PENDING, now + delay, error, job_id, index, RUNNING),
+                )
+                continue
+            cursor = conn.execute(
+                "UPDATE job_items SET status = ?, lease_until = NULL, result = ?, error = ? "
+                "WHERE job_id = ? AND idx = ? AND status = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+                 job_id, index, RUNNING),
+            )
+            counts[status] += cursor.rowcount
+        if counts[DONE] or counts[FAILED]:
+            conn.execute("UPDATE jobs SET done = done + ?, failed = failed + ? WHERE id = ?",
+                         (counts[DONE], counts[FAILED], job_id))
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, expires_at = ? "
+                "WHERE id = ? AND status = ? AND done + failed >= total",
+                (COMPLETED, now, now + JOB_RESULT_TTL_HOURS * 3600, job_id, RUNNING),
+            )
+
+    def purge(self):
+        """刪除過期的工作，以及超過保留數量的最舊已結束工作；回傳刪除的工作數"""
+        now = time.time()
+        with self._transaction() as conn:
+            expired = [row[0] for row in conn.execute(
+                "SELECT id FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (now,)
+            )]
+            expired += [row[0] for row in conn.execute(
+                "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND (expires_at IS NULL OR expires_at >= ?) "
+                "ORDER BY finished_at DESC LIMIT -1 OFFSET ?", (now, JOB_MAX_FINISHED_JOBS)
+            )]
+            for job_id in expired:
+                conn.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(expired)
+
+
+# --- worker 行程 ---
+
+def item_pills_info(detections, pills_info):
+    """從整批的藥品資訊中取出這張圖片偵測到的藥品"""
+    if pills_info is None:
+        return None
+    drug_ids = {det["drug_id"] for det in detections if det.get("drug_id") is not None}
+    return [info for info in pills_info if info.get("drug_id") in drug_ids]
+
+
+def _retry_or_fail(item, error):
+    status = PENDING if item["attempts"] < JOB_MAX_ATTEMPTS else FAILED
+    return item["index"], status, None, error
+
+
+def process_batch(store, analyzer, claimed):
+    """讀取、解碼並批次推論一批認領到的圖片，寫回結果；回傳寫回的結果數"""
+    from modules import image_decode
+
+    outcomes = []
+    ready_items, images = [], []
+    for item in claimed["items"]:
+        try:
+            images.append(image_decode.decode_to_array(fetch_source(item["source"])))
+            ready_items.append(item)
+        except RetryableError as e:
+            outcomes.append(_retry_or_fail(item, str(e)))
+        except Exception as e:
+            # 無法解碼的圖片重試也不會成功
+            outcomes.append((item["index"], FAILED, None, f"圖片讀取失敗: {e}"))
+
+    if images:
+        result = analyzer.detect_pills_batch(claimed["model_name"], images, options=claimed["options"])
+        if "error" in result:
+            outcomes += [_retry_or_fail(item, result["error"]) for item in ready_items]
+        else:
+            for item, detections in zip(ready_items, result["frames"]):
+                outcomes.append((item["index"], DONE, {
+                    "detections": detections,
+                    "pills_info": item_pills_info(detections, result.get("pills_info")),
+                }, None))
+
+    store.finish(claimed["job_id"], outcomes)
+    return len(outcomes)
+
+
+def _load_models():
+    """worker 行程：載入模型與藥品目錄（與 API 相同的類別綁定）"""
+    from modules import yolo_pill_analyzer
+
+    yolo_pill_analyzer.initialize_models()
+    try:
+        from db_cloud_sql import load_drug_catalog
+        load_drug_catalog()
+    except Exception as e:
+        logger.warning(f"工作 worker 無法載入藥品目錄，結果不含藥品資訊: {e}")
+    return yolo_pill_analyzer
+
+
+def worker_main(worker_index, stop_event, db_path=None):
+    """worker 行程的進入點：反覆認領並處理圖片，直到 stop_event 被設定"""
+    # 每個 worker 只用少量執行緒，且不參與 API worker 的 CPU 綁定；直接指定配置，
+    # 不依賴 cpu_topology 在匯入時讀取的環境變數（第一次載入模型時套用到 torch）
+    cpu_topology.set_plan(cpu_topology.compute_plan(workers=1, intra=str(JOB_WORKER_THREADS), affinity="off"))
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    analyzer = _load_models()
+    store = JobStore(db_path)
+    logger.info(f"[工作] worker {worker_index} 已啟動 (pid={os.getpid()})")
+    next_purge = 0.0
+    while not stop_event.is_set():
+        if time.time() >= next_purge:
+            purged = store.purge()
+            if purged:
+                logger.info(f"[工作] 已刪除 {purged} 個過期的工作")
+            next_purge = time.time() + JOB_PURGE_INTERVAL_S
+        try:
+            claimed = store.claim()
+        except sqlite3.OperationalError as e:
+            logger.warning(f"[工作] 認領失敗，稍後重試: {e}")
+            stop_event.wait(JOB_POLL_INTERVAL_S)
+            continue
+        if claimed is None:
+            stop_event.wait(JOB_POLL_INTERVAL_S)
+            continue
+        count = process_batch(store, analyzer, claimed)
+        logger.info(f"[工作] worker {worker_index} 完成工作 {claimed['job_id']} 的 {count} 張圖片")
+    logger.info(f"[工作] worker {worker_index} 已停止")
+
+
+class WorkerPool:
+    """管理 worker 子行程（spawn，不繼承 API 行程的執行緒與模型）"""
+
+    def __init__(self, count=None, db_path=None):
+        self.count = JOB_WORKERS if count is None else count
+        self.db_path = db_path
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._processes = []
+
+    def start(self):
+        for index in range(self.count):
+            process = self._context.Process(target=worker_main, args=(index, self._stop_event, self.db_path),
+                                            name=f"job-worker-{index}", daemon=True)
+            process.start()
+            self._processes.append(process)
+        return self
+
+    def stop(self, timeout=30.0):
+        """通知 worker 停止；處理中的一批會做完，逾時未結束的行程直接終止（租約到期後由其他 worker 重做）"""
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._processes = []
+
+    def alive(self):
+        return sum(1 for process in self._processes if process.is_alive())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批次偵測工作佇列的 worker")
+    parser.add_argument("--workers", type=int, default=max(1, JOB_WORKERS), help="worker 行程數")
+    parser.add_argument("--db", default=JOB_DB_PATH, help="工作佇列的 SQLite 檔案")
+    args = parser.parse_args(argv)
+
+    JobStore(args.db)
+    pool = WorkerPool(args.workers, args.db).start()
+    try:
+        while pool.alive():
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,265 @@
+"""
+標註繪製
+PIL 版（_draw_custom_labels）與 NumPy 版共用字型、字型縮放與標籤擺放規則；
+NumPy 版直接在 BGR 陣列上以切片畫框，標籤（背景色塊 + 黑色文字）預先算繪成小圖塊，
+依 (文字, 字型大小, 顏色) 快取後直接貼上，同一種藥品在不同請求間重複出現時幾乎不需重新算繪文字
+"""
+import os
+import logging
+import functools
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+# 字型檔案優先順序列表
+LABEL_FONT_PATHS = [
+    "fonts/jf-openhuninn-2.1.ttf",           # 主要字型
+    "fonts/NotoSansCJK-Regular.ttc",         # Google Noto 備用
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",  # 系統 Noto
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",           # 系統文泉驛
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",         # 系統文泉驛微米黑
+]
+
+BOX_LINE_WIDTH = 4
+H_PADDING = 5
+V_PADDING = 3
+TEXT_COLOR = "#000000"
+MIN_FONT_SIZE = 12
+# 快取的標籤圖塊數量上限（每個約數 KB 到數十 KB）
+SPRITE_CACHE_SIZE = int(os.environ.get("LABEL_SPRITE_CACHE_SIZE", "1024"))
+
+# 只用來量測文字尺寸的畫布（與在 RGB 圖片上繪製時的量測結果相同）
+_measure_draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+LabelSprite = namedtuple("LabelSprite", ["bg_width", "bg_height", "color", "coverage"])
+
+
+@functools.lru_cache(maxsize=32)
+def load_label_font(font_size):
+    """
+    依字型大小載入並快取中文字型
+    每次請求重新載入數 MB 的字型檔既慢，也會讓 FreeType 的原生記憶體隨請求數持續成長
+    font_size 為 None 時回傳預設字型
+    """
+    if font_size is None:
+        return ImageFont.load_default()
+    for font_path in LABEL_FONT_PATHS:
+        try:
+            if os.path.exists(font_path):
+                font = ImageFont.truetype(font_path, font_size)
+                logger.info(f"✅ 成功載入字型: {font_path} (size={font_size})")
+                return font
+        except Exception as e:
+            logger.debug(f"字型載入失敗 {font_path}: {str(e)}")
+            continue
+
+    logger.warning("⚠️ 所有中文字型載入失敗，使用預設字型 (中文可能無法正確顯示)")
+    return ImageFont.load_default()
+
+
+def label_font_size(image_width):
+    """依圖片寬度決定標籤字型大小"""
+    return max(25, int(image_width / 25))
+
+
+def measure_text(text, font):
+    """回傳文字的 (寬, 高)"""
+    left, top, right, bottom = _measure_draw.textbbox((0, 0), text, font=font)
+    return right - left, bottom - top
+
+
+@functools.lru_cache(maxsize=SPRITE_CACHE_SIZE)
+def fit_label_font(text, font_size, image_width):
+    """
+    文字比圖片還寬時縮小字型，回傳 (字型大小, 文字寬, 文字高)
+    字型大小為 None 代表改用預設字型；量測文字是繪製的主要成本之一，因此結果也一併快取
+    """
+    font = load_label_font(font_size)
+    text_width, text_height = measure_text(text, font)
+    max_text_width = image_width - 2 * H_PADDING
+    if text_width > max_text_width:
+        scale_factor = max_text_width / text_width
+        new_font_size = max(MIN_FONT_SIZE, int(font_size * scale_factor))
+        try:
+            font_size = new_font_size if hasattr(font, 'path') else None
+            text_width, text_height = measure_text(text, load_label_font(font_size))
+        except Exception:
+            # 如果字型調整失敗，使用預設字型
+            font_size = None
+            text_width, text_height = measure_text(text, load_label_font(None))
+    return font_size, text_width, text_height
+
+
+def place_label(bbox, text_width, text_height, occupied_areas, image_width, image_height):
+    """
+    在偵測框附近找一個不與已放置標籤重疊、且不超出圖片的位置，回傳標籤背景框 (x0, y0, x1, y1)
+    並加入 occupied_areas；文字位置為 (x0 + H_PADDING, y0 + V_PADDING)
+    所有候選位置一次以陣列運算檢查（偵測數量多時，逐一比對重疊是繪製的主要成本）
+    """
+    label_width = text_width + 2 * H_PADDING
+    label_height = text_height + 2 * V_PADDING
+
+    # 候選位置：優先靠近檢測框的位置
+    candidate_offsets = np.array([
+        (bbox[0], bbox[1] - label_height),                 # 上方緊貼
+        (bbox[0], bbox[3] + 2),                            # 下方緊貼
+        (bbox[2] - label_width, bbox[1] - label_height),   # 右上
+        (bbox[2] - label_width, bbox[3] + 2),              # 右下
+        (bbox[0] - label_width, bbox[1]),                  # 左側
+        (bbox[2] + 2, bbox[1]),                            # 右側
+    ], dtype=np.int64)
+
+    # 縮小搜索範圍，讓標籤更接近檢測框：每個基礎位置向右、向左嘗試少量偏移
+    max_offset = min(30, text_width // 2)  # 最大偏移距離限制為30像素或文字寬度的一半
+    step_size = 8  # 增大步長，減少計算量
+    offsets = np.arange(0, max_offset, step_size)
+    shifts = np.stack([offsets, -offsets], axis=1).ravel()
+
+    best_box = None
+    if shifts.size:
+        tx0 = (candidate_offsets[:, 0:1] + shifts).ravel()
+        ty0 = np.repeat(candidate_offsets[:, 1], shifts.size)
+        tx1 = tx0 + label_width
+        ty1 = ty0 + label_height
+
+        # 確保文字框完全在圖片邊界內，且不與已放置的標籤重疊
+        valid = (tx0 >= 0) & (ty0 >= 0) & (tx1 <= image_width) & (ty1 <= image_height)
+        if occupied_areas:
+            occ = np.array(occupied_areas, dtype=np.int64)
+            overlap = ~((tx1[:, None] <= occ[:, 0]) | (tx0[:, None] >= occ[:, 2]) |
+                        (ty1[:, None] <= occ[:, 1]) | (ty0[:, None] >= occ[:, 3]))
+            valid &= ~overlap.any(axis=1)
+
+        candidates = np.flatnonzero(valid)
+        if candidates.size:
+            tx0, ty0, tx1, ty1 = tx0[candidates], ty0[candidates], tx1[candidates], ty1[candidates]
+            # 距離檢測框中心越近越好（比較距離平方，結果與比較距離相同）
+            center_x = bbox[0] + (bbox[2] - bbox[0]) // 2
+            center_y = bbox[1] + (bbox[3] - bbox[1]) // 2
+            distance_sq = (center_x - (tx0 + label_width // 2)) ** 2 + (center_y - (ty0 + label_height // 2)) ** 2
+
+            # 優先級：上方 > 下方 > 左右側 > 其他（允許小量重疊）
+            position_priority = np.select(
+                [ty1 <= bbox[1] + 5, ty0 >= bbox[3] - 5, (tx1 <= bbox[0] + 5) | (tx0 >= bbox[2] - 5)],
+                [0, 1, 2], default=3,
+            )
+            # lexsort 為穩定排序：同分時取最先產生的候選位置
+            best = np.lexsort((distance_sq, position_priority))[0]
+            best_box = (int(tx0[best]), int(ty0[best]), int(tx1[best]), int(ty1[best]))
+
+    if best_box is None:
+        # 最壞情況的fallback: 強制放在圖片邊界內，避免超出
+        bg_x0 = max(0, min(bbox[0], image_width - label_width))
+        bg_y0 = max(0, min(bbox[1] - label_height, image_height - label_height))
+        bg_x1 = bg_x0 + label_width
+        bg_y1 = bg_y0 + label_height
+
+        # 再次確保不超出邊界
+        if bg_x1 > image_width:
+            bg_x1 = image_width
+            bg_x0 = bg_x1 - label_width
+        if bg_y1 > image_height:
+            bg_y1 = image_height
+            bg_y0 = bg_y1 - label_height
+        best_box = (bg_x0, bg_y0, bg_x1, bg_y1)
+
+    occupied_areas.append(best_box)
+    return best_box
+
+
+def _hex_to_bgr(color):
+    color = color.lstrip("#")
+    r, g, b = (int(color[i:i + 2], 16) for i in (0, 2, 4))
+    return b, g, r
+
+
+@functools.lru_cache(maxsize=SPRITE_CACHE_SIZE)
+def label_sprite(text, font_size, bg_color):
+    """
+    預先算繪一個標籤：背景色塊（與 PIL rectangle 相同，包含右下角像素）加上黑色文字。
+    背景範圍內完全不透明，顏色事先混合好，貼上時直接複製；
+    文字可能超出背景色塊（例如字型下緣），超出部分只有文字本身覆蓋，貼上時再與原圖混合。
+    回傳的陣列為唯讀，可在執行緒間共用
+    """
+    font = load_label_font(font_size)
+    text_width, text_height = measure_text(text, font)
+    bg_width = text_width + 2 * H_PADDING + 1
+    bg_height = text_height + 2 * V_PADDING + 1
+    glyph_right, glyph_bottom = _measure_draw.textbbox((H_PADDING, V_PADDING), text, font=font)[2:]
+    width, height = max(bg_width, glyph_right), max(bg_height, glyph_bottom)
+
+    mask_image = Image.new("L", (width, height), 0)
+    ImageDraw.Draw(mask_image).text((H_PADDING, V_PADDING), text, fill=255, font=font)
+    coverage = np.asarray(mask_image, dtype=np.uint16)
+
+    # 黑色文字蓋在背景色上：背景色 × (1 - 文字覆蓋率)，捨入方式與 PIL 相同
+    bg_bgr = np.array(_hex_to_bgr(bg_color), dtype=np.uint32)
+    color = ((bg_bgr * (255 - coverage[:bg_height, :bg_width, None]) + 127) // 255).astype(np.uint8)
+
+    color.setflags(write=False)
+    coverage.setflags(write=False)
+    return LabelSprite(bg_width, bg_height, color, coverage[:, :, None])
+
+
+def _darken(image, coverage, x, y):
+    """把背景範圍外的文字（黑色，覆蓋率 coverage）混合到 image[y:, x:]，超出圖片的部分裁掉"""
+    image_height, image_width = image.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + coverage.shape[1], image_width), min(y + coverage.shape[0], image_height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    region = image[y0:y1, x0:x1]
+    region[...] = (region * (255 - coverage[y0 - y:y1 - y, x0 - x:x1 - x]) + 127) // 255
+
+
+def _blit(image, sprite, x, y):
+    """把標籤圖塊貼到 (x, y)，超出圖片的部分裁掉"""
+    image_height, image_width = image.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + sprite.bg_width, image_width), min(y + sprite.bg_height, image_height)
+    if x0 < x1 and y0 < y1:
+        image[y0:y1, x0:x1] = sprite.color[y0 - y:y1 - y, x0 - x:x1 - x]
+
+    # 超出背景色塊的文字：右側與下方的長條
+    sprite_height, sprite_width = sprite.coverage.shape[:2]
+    if sprite_width > sprite.bg_width:
+        _darken(image, sprite.coverage[:, sprite.bg_width:], x + sprite.bg_width, y)
+    if sprite_height > sprite.bg_height:
+        _darken(image, sprite.coverage[sprite.bg_height:, :sprite.bg_width], x, y + sprite.bg_height)
+
+
+def _draw_box(image, bbox, color_bgr, line_width=BOX_LINE_WIDTH):
+    """畫矩形外框（與 PIL rectangle 相同：包含右下角座標，線寬向內）"""
+    image_height, image_width = image.shape[:2]
+    x0, y0, x1, y1 = (int(v) for v in bbox)
+    xs, xe = max(x0, 0), min(x1, image_width - 1) + 1
+    ys, ye = max(y0, 0), min(y1, image_height - 1) + 1
+    if xs >= xe or ys >= ye:
+        return
+    image[ys:min(y0 + line_width, ye), xs:xe] = color_bgr
+    image[max(y1 - line_width + 1, ys):ye, xs:xe] = color_bgr
+    image[ys:ye, xs:min(x0 + line_width, xe)] = color_bgr
+    image[ys:ye, max(x1 - line_width + 1, xs):xe] = color_bgr
+
+
+def render_labels(image, detections, label_texts, colors):
+    """
+    在 BGR 陣列的副本上畫出偵測框與標籤，回傳新的 BGR 陣列
+    label_texts、colors 與 detections 一一對應
+    """
+    canvas = image.copy()
+    image_height, image_width = canvas.shape[:2]
+    base_font_size = label_font_size(image_width)
+    occupied_areas = []
+
+    for det, label_text, color in zip(detections, label_texts, colors):
+        bbox = det['bbox']
+        _draw_box(canvas, bbox, _hex_to_bgr(color))
+
+        font_size, text_width, text_height = fit_label_font(label_text, base_font_size, image_width)
+        bg_x0, bg_y0, _, _ = place_label(bbox, text_width, text_height, occupied_areas, image_width, image_height)
+        _blit(canvas, label_sprite(label_text, font_size, color), bg_x0, bg_y0)
+    return canvas
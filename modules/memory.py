@@ -0,0 +1,141 @@
+"""
+記憶體用量追蹤
+每個請求記錄常駐記憶體 (RSS) 的增減；設定 MEMORY_TRACEMALLOC=1 時另外以 tracemalloc
+記錄請求期間 Python 配置量的峰值，並提供堆積快照（與上一次快照比較，用來找出洩漏）。
+tracemalloc 的峰值是整個行程共用的計數器，每個請求開始時都重設會讓併發請求互相清掉峰值，
+因此同一時間只有一個請求量測峰值（其他併發請求只記錄 RSS）；量到的峰值仍包含期間其他請求的配置，是上限值
+"""
+import os
+import gc
+import logging
+import threading
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# 嘗試導入 psutil，如果失敗則改讀 /proc/self/statm（僅限 Linux）
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+    _process = psutil.Process()
+except ImportError:
+    PSUTIL_AVAILABLE = False
+    _process = None
+
+TRACEMALLOC_ENABLED = os.environ.get("MEMORY_TRACEMALLOC", "0").lower() in ("1", "true", "yes", "on")
+# 快照中每筆配置保留的堆疊層數，越多越能看出呼叫來源，但額外負擔也越大
+TRACEMALLOC_FRAMES = int(os.environ.get("MEMORY_TRACEMALLOC_FRAMES", "1"))
+
+# 快照時略過 tracemalloc 自身與匯入機制的配置
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+_last_snapshot = None
+# 正在量測 tracemalloc 峰值的請求（同一時間只有一個）
+_peak_lock = threading.Lock()
+
+
+def start_tracing():
+    """依設定啟用 tracemalloc，回傳是否正在追蹤"""
+    if TRACEMALLOC_ENABLED and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        logger.info(f"tracemalloc 已啟用 (frames={TRACEMALLOC_FRAMES})")
+    return tracemalloc.is_tracing()
+
+
+def current_rss_bytes():
+    """回傳目前行程的常駐記憶體（位元組），無法取得時回傳 None"""
+    if PSUTIL_AVAILABLE:
+        return _process.memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def start_request():
+    """
+    記錄請求開始時的記憶體狀態，交給 finish_request 計算差值（請求失敗時也必須呼叫，才會釋放峰值量測）
+    已有其他請求在量測 tracemalloc 峰值時，這個請求不量測峰值
+    """
+    traced_start = None
+    if tracemalloc.is_tracing() and _peak_lock.acquire(blocking=False):
+        traced_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    return current_rss_bytes(), traced_start
+
+
+def finish_request(start):
+    """
+    回傳 (RSS 增減, tracemalloc 峰值增量, 目前 RSS)，單位為位元組；無法量測的項目為 None
+    峰值增量 = 請求期間的配置峰值 - 請求開始時的配置量
+    """
+    rss_start, traced_start = start
+    rss_end = current_rss_bytes()
+    rss_delta = rss_end - rss_start if rss_start is not None and rss_end is not None else None
+    peak_delta = None
+    if traced_start is not None:
+        try:
+            if tracemalloc.is_tracing():
+                peak_delta = max(0, tracemalloc.get_traced_memory()[1] - traced_start)
+        finally:
+            _peak_lock.release()
+    return rss_delta, peak_delta, rss_end
+
+
+def memory_stats():
+    """目前的記憶體概況"""
+    stats = {
+        "rss_bytes": current_rss_bytes(),
+        "tracemalloc_enabled": tracemalloc.is_tracing(),
+        "gc_counts": list(gc.get_count()),
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        stats["traced_current_bytes"] = current
+        stats["traced_peak_bytes"] = peak
+    return stats
+
+
+def _format_stat(stat):
+    frame = stat.traceback[0]
+    return {
+        "location": f"{frame.filename}:{frame.lineno}",
+        "size_bytes": stat.size,
+        "count": stat.count,
+    }
+
+
+def _format_diff(stat):
+    entry = _format_stat(stat)
+    entry["size_diff_bytes"] = stat.size_diff
+    entry["count_diff"] = stat.count_diff
+    return entry
+
+
+def take_snapshot(limit=20, key_type="lineno"):
+    """
+    先執行 gc 再取得堆積快照，回傳配置量最大的項目，以及與上一次快照相比增加最多的項目
+    未啟用 tracemalloc 時會立即啟用，這次只回傳概況，下一次快照才有資料
+    """
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        _last_snapshot = None
+        logger.info("[調試] 因快照請求啟用 tracemalloc")
+        return {"started": True, "stats": memory_stats(), "top": [], "diff": None}
+
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+    top = [_format_stat(stat) for stat in snapshot.statistics(key_type)[:limit]]
+    diff = None
+    if _last_snapshot is not None:
+        diff = [_format_diff(stat) for stat in snapshot.compare_to(_last_snapshot, key_type)[:limit]]
+    _last_snapshot = snapshot
+    return {"started": False, "stats": memory_stats(), "top": top, "diff": diff}
@@ -0,0 +1,259 @@
+"""
+Prometheus 監控指標
+記錄偵測流程各階段耗時（依端點與模型分類）、錯誤次數、快取命中、每張圖片的偵測數量、
+每個請求的記憶體用量、WebSocket 串流的畫面處理 / 丟棄數、各優先通道的推論排隊狀況與負載訊號，
+並彙整每個請求的階段耗時供 Server-Timing 標頭使用
+"""
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+
+from modules.tracing import start_span
+
+logger = logging.getLogger(__name__)
+
+# 嘗試導入 prometheus_client，如果失敗則停用指標（不影響主要功能）
+try:
+    from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; charset=utf-8"
+    logger.info("[調試] prometheus_client 不可用，停用 /metrics 指標")
+
+# 目前請求的 (endpoint, model_name) 標籤，讓分析模組內的計時不需要額外傳參數
+_request_labels = contextvars.ContextVar("metrics_request_labels", default=("unknown", "unknown"))
+# 目前請求的階段耗時彙整（秒），未呼叫 start_request_timings 時為 None
+_request_timings = contextvars.ContextVar("metrics_request_timings", default=None)
+
+# 細部階段 -> 回傳給客戶端的階段分類
+TIMING_GROUPS = {
+    "base64_decode": "decode",
+    "image_decode": "decode",
+    "video_decode": "decode",
+    "predict": "inference",
+    "cascade_locate": "inference",
+    "cascade_refine": "inference",
+    "inference_queue": "queue",
+    "db_lookup": "db",
+    "image_resize": "annotate",
+    "draw_labels": "annotate",
+    "image_encode": "annotate",
+    "gcs_upload": "upload",
+}
+
+# 各階段耗時的分桶（秒），涵蓋毫秒級的解碼到數秒的上傳
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DETECTION_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 20, 30, 50, 100, 300)
+# 每個請求的記憶體用量分桶（位元組），1 MB 到 1 GB
+_MB = 1024 * 1024
+MEMORY_BUCKETS = tuple(mb * _MB for mb in (1, 4, 16, 32, 64, 128, 256, 512, 1024))
+
+if PROMETHEUS_AVAILABLE:
+    STAGE_SECONDS = Histogram(
+        "pill_api_stage_seconds",
+        "偵測流程各階段耗時（秒）",
+        ["stage", "endpoint", "model_name"],
+        buckets=STAGE_BUCKETS,
+    )
+    ERRORS = Counter(
+        "pill_api_errors_total",
+        "請求錯誤次數",
+        ["endpoint", "error_type"],
+    )
+    CACHE_EVENTS = Counter(
+        "pill_api_cache_events_total",
+        "快取查詢次數（result 為 hit 或 miss）",
+        ["cache", "result"],
+    )
+    DETECTIONS_PER_IMAGE = Histogram(
+        "pill_api_detections_per_image",
+        "每張圖片的偵測數量",
+        ["endpoint", "model_name"],
+        buckets=DETECTION_COUNT_BUCKETS,
+    )
+    REQUEST_RSS_GROWTH = Histogram(
+        "pill_api_request_rss_growth_bytes",
+        "請求期間常駐記憶體 (RSS) 的增加量（位元組，減少時記為 0）",
+        ["endpoint"],
+        buckets=MEMORY_BUCKETS,
+    )
+    REQUEST_PEAK_ALLOCATED = Histogram(
+        "pill_api_request_peak_allocated_bytes",
+        "請求期間 Python 配置量的峰值增量（位元組，需啟用 MEMORY_TRACEMALLOC；同一時間只量測一個請求，含期間其他請求的配置，為近似上限）",
+        ["endpoint"],
+        buckets=MEMORY_BUCKETS,
+    )
+    PROCESS_RSS = Gauge(
+        "pill_api_process_rss_bytes",
+        "最近一次請求結束時的行程常駐記憶體（位元組）",
+    )
+    STREAM_FRAMES = Counter(
+        "pill_api_stream_frames_total",
+        "WebSocket 串流收到的畫面數（result 為 processed、dropped 或 error）",
+        ["result"],
+    )
+    ACTIVE_STREAMS = Gauge(
+        "pill_api_active_streams",
+        "目前的 WebSocket 串流連線數",
+    )
+    INFERENCE_QUEUE_DEPTH = Gauge(
+        "pill_api_inference_queue_depth",
+        "各優先通道等待推論的請求數",
+        ["lane"],
+    )
+    INFERENCE_QUEUE_WAIT = Histogram(
+        "pill_api_inference_queue_wait_seconds",
+        "各優先通道等待推論執行緒的時間（秒）",
+        ["lane"],
+        buckets=STAGE_BUCKETS,
+    )
+    DEADLINE_DROPS = Counter(
+        "pill_api_deadline_drops_total",
+        "因期限已過而略過的請求數（stage 為被略過的階段：queue 或 annotate）",
+        ["lane", "stage"],
+    )
+    INFERENCE_UTILIZATION = Gauge(
+        "pill_api_inference_utilization",
+        "最近一段時間內推論執行緒的使用率（0～1）",
+    )
+    INFERENCE_ESTIMATED_WAIT = Gauge(
+        "pill_api_inference_estimated_wait_seconds",
+        "新請求在各優先通道的預估推論等待時間（秒）",
+        ["lane"],
+    )
+    DRAINING = Gauge(
+        "pill_api_draining",
+        "執行個體是否正在關閉（1 表示不再接受新請求）",
+    )
+    STARTUP_PHASE_SECONDS = Gauge(
+        "pill_api_startup_phase_seconds",
+        "啟動各階段耗時（秒）",
+        ["phase"],
+    )
+
+
+def set_request_labels(endpoint, model_name=None):
+    """設定目前請求的端點與模型標籤；客戶端指定的模型名稱須先驗證過，再以 set_model_name 設定，避免任意字串成為標籤值"""
+    _request_labels.set((endpoint, model_name or "unknown"))
+
+
+def set_model_name(model_name):
+    """在決定使用的模型後更新模型標籤"""
+    endpoint, _ = _request_labels.get()
+    _request_labels.set((endpoint, model_name or "unknown"))
+
+
+@contextmanager
+def stage_timer(stage):
+    """記錄一個處理階段的耗時（同時建立追蹤 span），例外發生時也會記錄"""
+    start = time.perf_counter()
+    try:
+        with start_span(stage):
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = _request_timings.get()
+        if timings is not None:
+            group = TIMING_GROUPS.get(stage, stage)
+            timings[group] = timings.get(group, 0.0) + elapsed
+        if PROMETHEUS_AVAILABLE:
+            endpoint, model_name = _request_labels.get()
+            STAGE_SECONDS.labels(stage, endpoint, model_name).observe(elapsed)
+
+
+def start_request_timings():
+    """開始彙整目前請求的階段耗時，回傳會被 stage_timer 累加的字典"""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def timings_ms(timings):
+    """將階段耗時（秒）轉成毫秒，供回應中的 timings 欄位使用"""
+    return {name: round(seconds * 1000, 2) for name, seconds in timings.items()}
+
+
+def format_server_timing(timings):
+    """產生 Server-Timing 標頭，例如 'decode;dur=3.1, inference;dur=85.2'"""
+    return ", ".join(f"{name};dur={ms}" for name, ms in timings_ms(timings).items())
+
+
+def record_error(endpoint, error_type):
+    if PROMETHEUS_AVAILABLE:
+        ERRORS.labels(endpoint, error_type).inc()
+
+
+def record_cache(cache, hits=0, misses=0):
+    if PROMETHEUS_AVAILABLE:
+        if hits:
+            CACHE_EVENTS.labels(cache, "hit").inc(hits)
+        if misses:
+            CACHE_EVENTS.labels(cache, "miss").inc(misses)
+
+
+def record_detections(count):
+    if PROMETHEUS_AVAILABLE:
+        endpoint, model_name = _request_labels.get()
+        DETECTIONS_PER_IMAGE.labels(endpoint, model_name).observe(count)
+
+
+def record_request_memory(endpoint, rss_delta, peak_delta, rss_bytes=None):
+    if PROMETHEUS_AVAILABLE:
+        if rss_delta is not None:
+            REQUEST_RSS_GROWTH.labels(endpoint).observe(max(0, rss_delta))
+        if peak_delta is not None:
+            REQUEST_PEAK_ALLOCATED.labels(endpoint).observe(peak_delta)
+        if rss_bytes is not None:
+            PROCESS_RSS.set(rss_bytes)
+
+
+def record_stream_frames(result, count=1):
+    if PROMETHEUS_AVAILABLE and count:
+        STREAM_FRAMES.labels(result).inc(count)
+
+
+def set_active_streams(count):
+    if PROMETHEUS_AVAILABLE:
+        ACTIVE_STREAMS.set(count)
+
+
+def set_queue_depth(lane, depth):
+    if PROMETHEUS_AVAILABLE:
+        INFERENCE_QUEUE_DEPTH.labels(lane).set(depth)
+
+
+def record_queue_wait(lane, seconds):
+    if PROMETHEUS_AVAILABLE:
+        INFERENCE_QUEUE_WAIT.labels(lane).observe(seconds)
+
+
+def record_deadline_drop(lane, stage):
+    if PROMETHEUS_AVAILABLE:
+        DEADLINE_DROPS.labels(lane or "unknown", stage).inc()
+
+
+def set_load(load):
+    """更新負載訊號指標（load 為 InferenceScheduler.load() 的結果）"""
+    if PROMETHEUS_AVAILABLE:
+        INFERENCE_UTILIZATION.set(load["utilization"])
+        for lane, seconds in load["estimated_wait_s"].items():
+            INFERENCE_ESTIMATED_WAIT.labels(lane).set(seconds)
+
+
+def set_draining(draining):
+    if PROMETHEUS_AVAILABLE:
+        DRAINING.set(1 if draining else 0)
+
+
+def record_startup_phase(phase, seconds):
+    if PROMETHEUS_AVAILABLE:
+        STARTUP_PHASE_SECONDS.labels(phase).set(seconds)
+
+
+def render_latest():
+    """回傳 (內容, Content-Type)，供 /metrics 端點使用"""
+    if not PROMETHEUS_AVAILABLE:
+        return None, CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
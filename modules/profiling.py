@@ -0,0 +1,178 @@
+"""
+按需的單一請求效能分析
+請求帶有 X-Profile: 1（或 ?profile=1）與有效的管理者權杖時，事件迴圈上的處理以 pyinstrument 取樣分析器記錄，
+交給執行緒的阻塞工作（解碼、推論、標註、上傳）在各自的執行緒中另外取樣（每次呼叫一個檔案），
+模型推論另外以 torch.profiler 記錄；分析結果依 X-Request-ID 存放在 PROFILE_DIR。未帶旗標的請求只多一次標頭查詢。
+
+需要安裝 pyinstrument（第一次分析時才匯入，未安裝時忽略分析請求）；同一時間只分析一個請求，已有進行中的分析時新的分析請求會被忽略
+（分析器會拖慢整個行程，併發請求的取樣也會互相混雜）
+"""
+import os
+import re
+import glob
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from modules.admin_auth import is_admin
+
+logger = logging.getLogger(__name__)
+
+# pyinstrument 的 Profiler 類別（第一次分析時匯入）
+Profiler = None
+
+PROFILE_HEADER = "x-profile"
+PROFILE_QUERY_PARAM = "profile"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+# pyinstrument 取樣間隔（秒）
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.001"))
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9\-]+$")
+_FALSE_VALUES = ("", "0", "false", "no", "off")
+
+# 目前請求的分析工作階段，供 detect_pills 判斷是否要啟用 torch.profiler
+_active_session = contextvars.ContextVar("profiling_session", default=None)
+# 同一時間只允許一個分析工作階段
+_session_lock = threading.Lock()
+
+
+def _get_profiler_class():
+    """第一次分析時才匯入 pyinstrument；未安裝時回傳 None"""
+    global Profiler
+    if Profiler is None:
+        try:
+            from pyinstrument import Profiler as profiler_class
+        except ImportError:
+            return None
+        Profiler = profiler_class
+    return Profiler
+
+
+def is_profiling_requested(request):
+    """檢查請求是否要求效能分析；先檢查旗標，只有帶旗標時才驗證管理者權杖"""
+    flag = request.headers.get(PROFILE_HEADER)
+    if flag is None:
+        flag = request.query_params.get(PROFILE_QUERY_PARAM)
+    if flag is None or flag.lower() in _FALSE_VALUES:
+        return False
+    if not is_admin(request.headers):
+        logger.warning("收到效能分析請求但管理者權杖無效，忽略")
+        return False
+    return True
+
+
+class ProfileSession:
+    """單一請求的分析工作階段"""
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.artifacts = []
+        self._profiler = None
+        # 執行緒中的阻塞工作與 torch trace 共用的序號（同一請求可能推論多次）
+        self._sequence = 0
+        self._sequence_lock = threading.Lock()
+
+    def start(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        self._profiler = Profiler(interval=SAMPLE_INTERVAL, async_mode="enabled")
+        self._profiler.start()
+        _active_session.set(self)
+        return self
+
+    def stop(self):
+        """停止分析並寫出結果，回傳產生的檔案路徑列表"""
+        if self._profiler is None:
+            return self.artifacts
+        try:
+            self._profiler.stop()
+            path = os.path.join(PROFILE_DIR, f"{self.request_id}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+            self.add_artifact(path)
+        finally:
+            self._profiler = None
+            _session_lock.release()
+        logger.info(f"請求 {self.request_id} 的效能分析結果: {self.artifacts}")
+        return self.artifacts
+
+    def next_sequence(self):
+        """本工作階段的下一個檔案序號"""
+        with self._sequence_lock:
+            self._sequence += 1
+            return self._sequence
+
+    def add_artifact(self, path):
+        """記錄產生的檔案（同一路徑只列一次）"""
+        if path not in self.artifacts:
+            self.artifacts.append(path)
+
+    def run_in_thread(self, func, *args):
+        """在目前的執行緒中以獨立的分析器執行阻塞工作，結果寫成 <請求ID>.<序號>-<函式名稱>.html"""
+        sequence = self.next_sequence()
+        profiler = Profiler(interval=SAMPLE_INTERVAL, async_mode="disabled")
+        profiler.start()
+        try:
+            return func(*args)
+        finally:
+            profiler.stop()
+            name = re.sub(r"[^A-Za-z0-9_]", "_", getattr(func, "__name__", type(func).__name__))
+            path = os.path.join(PROFILE_DIR, f"{self.request_id}.{sequence}-{name}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+            self.add_artifact(path)
+
+
+def start_session(request_id):
+    """開始分析目前的請求；未安裝 pyinstrument 或已有進行中的分析時回傳 None"""
+    if _get_profiler_class() is None:
+        logger.warning("收到效能分析請求但未安裝 pyinstrument，忽略")
+        return None
+    if not _session_lock.acquire(blocking=False):
+        logger.warning(f"已有進行中的效能分析，忽略請求 {request_id} 的分析")
+        return None
+    try:
+        return ProfileSession(request_id).start()
+    except Exception:
+        _session_lock.release()
+        raise
+
+
+def current_session():
+    return _active_session.get()
+
+
+def profile_blocking(func, *args):
+    """在執行緒中執行阻塞工作（由 run_blocking 在複製的 context 中呼叫）；目前請求正在分析時一併取樣"""
+    session = _active_session.get()
+    if session is None:
+        return func(*args)
+    return session.run_in_thread(func, *args)
+
+
+@contextmanager
+def profile_inference():
+    """在分析中的請求內以 torch.profiler 記錄模型推論，每次推論輸出一個 <請求ID>.<序號>.torch.json（Chrome trace）"""
+    session = _active_session.get()
+    if session is None:
+        yield
+        return
+
+    try:
+        from torch.profiler import profile, ProfilerActivity
+    except ImportError:
+        yield
+        return
+
+    with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+        yield
+    path = os.path.join(PROFILE_DIR, f"{session.request_id}.{session.next_sequence()}.torch.json")
+    prof.export_chrome_trace(path)
+    session.add_artifact(path)
+
+
+def find_artifacts(request_id):
+    """依請求ID尋找已儲存的分析結果"""
+    if not _REQUEST_ID_PATTERN.match(request_id):
+        return []
+    return sorted(glob.glob(os.path.join(PROFILE_DIR, f"{request_id}.*")))
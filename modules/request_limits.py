@@ -0,0 +1,71 @@
+"""
+請求本文大小限制
+以純 ASGI 中介層在讀取本文時邊讀邊累計位元組數：Content-Length 超過上限時在讀取第一個區塊前就拒絕，
+沒有 Content-Length（chunked）時在累計超過上限的那一刻中止，不會先把整個本文緩衝到記憶體。
+超過上限時拋出 HTTPException(413)，由全域的 HTTP 異常處理器產生一致格式的錯誤回應
+"""
+import os
+
+from fastapi import HTTPException
+
+# 單張圖片的位元組上限
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# 請求本文上限：base64 會讓圖片膨脹約 4/3，另外保留 JSON 欄位與 multipart 邊界的空間
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", str(MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024)))
+
+
+class ImageTooLargeError(ValueError):
+    """圖片像素數超過上限（由 image_decode 在解碼前拋出，端點回傳 413；定義在這裡讓端點不必匯入解碼器就能捕捉）"""
+
+
+def _content_length(scope):
+    for name, value in scope.get("headers", ()):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def _too_large(max_bytes):
+    return HTTPException(
+        status_code=413,
+        detail=f"請求本文超過上限 {max_bytes / (1024 * 1024):.1f} MB"
+    )
+
+
+class BodySizeLimitMiddleware:
+    """限制 HTTP 請求本文大小的 ASGI 中介層"""
+
+    def __init__(self, app, max_bytes=None):
+        self.app = app
+        self.max_bytes = MAX_REQUEST_BYTES if max_bytes is None else max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.max_bytes
+        declared_length = _content_length(scope)
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            # 只中止一次；之後回應送出時的斷線偵測仍需要正常讀取
+            if rejected:
+                return await receive()
+            if declared_length is not None and declared_length > max_bytes:
+                rejected = True
+                raise _too_large(max_bytes)
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    rejected = True
+                    raise _too_large(max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,173 @@
+"""
+請求追蹤中介層
+以純 ASGI 中介層取代 @app.middleware("http")：不經過 BaseHTTPMiddleware 的 call_next
+（每個請求額外建立工作、以記憶體串流轉送回應本文），直接包裝 send 在回應開始時加上
+X-Request-ID 與 X-Process-Time 標頭。
+
+每個請求仍會產生請求 ID、決定優先通道與期限、在關閉中拒絕新的偵測請求；
+開始 / 完成的 JSON 日誌與每請求的記憶體量測（讀取 RSS）依 REQUEST_LOG_SAMPLE_RATE 抽樣，
+失敗（例外或 5xx）與超過 REQUEST_LOG_SLOW_MS 的請求不論是否抽中都記錄完成日誌。
+REQUEST_LOG_EXCLUDE_PATHS 列出的路徑（健康檢查、指標抓取）不記錄日誌、不量測記憶體、也不建立追蹤 span
+"""
+import os
+import time
+import uuid
+import random
+import traceback
+
+from starlette.requests import Request
+
+from modules import admission
+from modules import memory
+from modules import metrics
+from modules import profiling
+from modules import tracing
+
+# 開始 / 完成日誌與記憶體量測的抽樣比例（0～1；1 為全部記錄）
+SAMPLE_RATE = min(1.0, max(0.0, float(os.environ.get("REQUEST_LOG_SAMPLE_RATE", "1"))))
+# 超過此處理時間（毫秒）的請求一律記錄完成日誌；0 表示不啟用
+SLOW_MS = float(os.environ.get("REQUEST_LOG_SLOW_MS", "0"))
+# 不記錄日誌、記憶體與追蹤的路徑（逗號分隔，完全比對）
+EXCLUDE_PATHS = frozenset(
+    path.strip()
+    for path in os.environ.get("REQUEST_LOG_EXCLUDE_PATHS", "/health,/metrics,/api/load").split(",")
+    if path.strip()
+)
+
+
+def _route_path(scope):
+    """匹配到的路由路徑（由路由器寫入 scope），避免以原始 URL 當作指標標籤"""
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+class RequestTrackingMiddleware:
+    """請求 ID、處理時間標頭、抽樣日誌與記憶體量測、追蹤 span 與按需效能分析的 ASGI 中介層"""
+
+    def __init__(self, app, logger, draining_response, sample_rate=None, exclude_paths=None, slow_ms=None):
+        self.app = app
+        self.logger = logger
+        # 關閉中拒絕新請求時的回應：draining_response(request, request_id) -> Response
+        self.draining_response = draining_response
+        self.sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+        self.exclude_paths = EXCLUDE_PATHS if exclude_paths is None else frozenset(exclude_paths)
+        self.slow_s = (SLOW_MS if slow_ms is None else slow_ms) / 1000
+
+    def _sampled(self):
+        rate = self.sample_rate
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        request_id = str(uuid.uuid4())
+        scope.setdefault("state", {})["request_id"] = request_id
+        path = scope["path"]
+        request = Request(scope)
+
+        # 抵達時就決定優先通道與期限（排隊與讀取本文的時間都算在期限內）
+        lane, _ = admission.start_request(path, request.headers)
+        if admission.is_draining() and (lane is not None or path == "/api/jobs"):
+            # 關閉中不再接受新的偵測與批次工作（查詢類端點照常回應）
+            response = self.draining_response(request, request_id)
+            await response(scope, receive, send)
+            return
+
+        # 按需效能分析（未帶 X-Profile 旗標時只多一次標頭查詢）
+        profile_session = None
+        if profiling.is_profiling_requested(request):
+            profile_session = profiling.start_session(request_id)
+
+        if path in self.exclude_paths:
+            # 探測與指標抓取：只加上標頭
+            await self._call(scope, receive, send, request_id, start_time, profile_session)
+            return
+
+        sampled = self._sampled()
+        memory_start = memory.start_request() if sampled else None
+        if sampled:
+            self.logger.info(
+                "Request started",
+                request_id=request_id,
+                method=scope["method"],
+                url=str(request.url),
+                client_ip=scope["client"][0] if scope.get("client") else "unknown"
+            )
+
+        # 請求的根 span，後續各階段 span 都會掛在其下（含執行緒中的工作）
+        with tracing.start_span(
+            f"{scope['method']} {path}",
+            request_id=request_id,
+            **{"http.method": scope["method"], "http.target": path}
+        ) as request_span:
+            try:
+                status_code, process_time = await self._call(
+                    scope, receive, send, request_id, start_time, profile_session
+                )
+            except Exception as e:
+                if memory_start is not None:
+                    memory.finish_request(memory_start)
+                # 失敗的請求不論是否抽中都記錄
+                self.logger.error(
+                    "Request failed",
+                    request_id=request_id,
+                    method=scope["method"],
+                    path=path,
+                    error=str(e),
+                    process_time=round(time.perf_counter() - start_time, 4),
+                    traceback=traceback.format_exc()
+                )
+                raise
+
+            rss_delta = peak_delta = None
+            if memory_start is not None:
+                rss_delta, peak_delta, rss_bytes = memory.finish_request(memory_start)
+                metrics.record_request_memory(_route_path(scope), rss_delta, peak_delta, rss_bytes)
+            if request_span is not None:
+                request_span.set_attribute("http.status_code", status_code)
+
+        if sampled or status_code >= 500 or (self.slow_s and process_time >= self.slow_s):
+            self.logger.info(
+                "Request completed",
+                request_id=request_id,
+                method=scope["method"],
+                path=path,
+                status_code=status_code,
+                process_time=round(process_time, 4),
+                rss_delta_bytes=rss_delta,
+                peak_allocated_bytes=peak_delta,
+                sampled=sampled
+            )
+
+    async def _call(self, scope, receive, send, request_id, start_time, profile_session):
+        """執行下游應用，在回應開始時加上標頭；回傳 (狀態碼, 到回應開始為止的處理時間)"""
+        result = [500, None]
+
+        async def send_with_headers(message):
+            nonlocal profile_session
+            if message["type"] == "http.response.start":
+                process_time = time.perf_counter() - start_time
+                result[0], result[1] = message["status"], process_time
+                headers = list(message.get("headers", ()))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                headers.append((b"x-process-time", str(round(process_time, 4)).encode("latin-1")))
+                if profile_session is not None:
+                    artifacts = profile_session.stop()
+                    profile_session = None
+                    headers.append((
+                        b"x-profile-artifacts",
+                        ",".join(os.path.basename(p) for p in artifacts).encode("latin-1")
+                    ))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            if profile_session is not None:
+                profile_session.stop()
+        if result[1] is None:
+            result[1] = time.perf_counter() - start_time
+        return result[0], result[1]
@@ -0,0 +1,55 @@
+"""
+回應序列化
+偵測結果在回傳前已經是純 Python 的 dict / list，偵測端點直接以 FastJSONResponse 回傳，
+不再讓 FastAPI 依 response_model 把每個偵測重新驗證、轉換一次（response_model 只用於 API 文件）；
+有安裝 orjson 時以 orjson 序列化，否則退回標準函式庫的 json。
+columnar 格式把偵測列表轉成平行陣列（框、信心度、類別索引），省下每個偵測重複的鍵名
+"""
+import logging
+
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+# 嘗試導入 orjson，如果失敗則使用標準 json（輸出內容相同，只是較慢）
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    logger.info("[調試] orjson 不可用，回應改用標準 json 序列化")
+
+RESPONSE_FORMATS = ("objects", "columnar")
+
+
+class FastJSONResponse(JSONResponse):
+    """以 orjson 序列化的 JSON 回應（可直接序列化 NumPy 數值）；未安裝 orjson 時與 JSONResponse 相同"""
+
+    def render(self, content):
+        if ORJSON_AVAILABLE:
+            return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+        return super().render(content)
+
+
+def to_columnar(detections):
+    """
+    偵測列表 -> 平行陣列：boxes[i]、confidences[i]、class_ids[i]、drug_ids[i] 為第 i 個偵測，
+    class_names 只列出出現過的類別（類別索引字串 -> 名稱）；標註顏色由客戶端依索引決定
+    """
+    class_names = {}
+    for det in detections:
+        class_names.setdefault(str(det['class_id']), det['class_name'])
+    return {
+        "boxes": [det['bbox'] for det in detections],
+        "confidences": [det['confidence'] for det in detections],
+        "class_ids": [det['class_id'] for det in detections],
+        "drug_ids": [det['drug_id'] for det in detections],
+        "class_names": class_names,
+    }
+
+
+def format_detections(detections, response_format=None):
+    """依請求的格式（objects 或 columnar）輸出偵測結果"""
+    if response_format == "columnar":
+        return to_columnar(detections)
+    return detections
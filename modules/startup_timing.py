@@ -0,0 +1,39 @@
+"""
+啟動階段計時
+記錄行程從匯入到可以服務請求之間各階段的耗時（匯入、模型載入、資料庫連線、藥品目錄、暖機），
+寫入日誌並匯出到 /metrics，方便追蹤冷啟動的退步
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+_phases = {}
+_lock = threading.Lock()
+
+
+def record_phase(name, seconds):
+    with _lock:
+        _phases[name] = seconds
+    metrics.record_startup_phase(name, seconds)
+    logger.info(f"[啟動] {name}: {seconds * 1000:.1f} ms")
+
+
+@contextmanager
+def phase(name):
+    """計時一個啟動階段（可在不同執行緒中同時使用）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+def phases_ms():
+    """目前已記錄的啟動階段耗時（毫秒），依記錄順序排列"""
+    with _lock:
+        return {name: round(seconds * 1000, 1) for name, seconds in _phases.items()}
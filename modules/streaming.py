@@ -0,0 +1,85 @@
+"""
+WebSocket 即時串流偵測
+每個連線一個工作階段：接收端只把最新收到的畫面放進單格信箱（新畫面覆蓋尚未處理的舊畫面），
+處理端每次取出最新的一格推論，因此推論跟不上鏡頭速度時會自動丟棄過時的畫面，延遲不會累積。
+偵測結果以精簡的 JSON 陣列回傳，類別名稱與藥品ID只在連線建立時送一次
+"""
+import os
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 同時進行的串流連線上限（推論共用同一個執行緒，連線越多每條的畫面率越低）
+MAX_SESSIONS = int(os.environ.get("STREAM_MAX_SESSIONS", "8"))
+
+# WebSocket 關閉代碼
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+CLOSE_SERVICE_RESTART = 1012
+
+_active_sessions = 0
+
+
+def try_open_session():
+    """佔用一個串流名額，已達上限時回傳 False"""
+    global _active_sessions
+    if _active_sessions >= MAX_SESSIONS:
+        return False
+    _active_sessions += 1
+    return True
+
+
+def close_session():
+    global _active_sessions
+    _active_sessions = max(0, _active_sessions - 1)
+
+
+def active_sessions():
+    return _active_sessions
+
+
+class LatestFrameSlot:
+    """只保留最新一個畫面的信箱（只在事件迴圈中使用，不需要鎖）"""
+
+    def __init__(self):
+        self._frame = None
+        self._pending_dropped = 0
+        self._event = asyncio.Event()
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, data):
+        """放入新畫面，覆蓋尚未處理的舊畫面；回傳此畫面的序號（從 1 開始）"""
+        self.received += 1
+        if self._frame is not None:
+            self.dropped += 1
+            self._pending_dropped += 1
+        self._frame = (self.received, data)
+        self._event.set()
+        return self.received
+
+    def close(self):
+        """連線結束：喚醒處理端，尚未處理的畫面不再處理"""
+        self._closed = True
+        self._event.set()
+
+    async def get(self):
+        """等待並取出最新的畫面，回傳 (序號, 資料, 上次取出後被覆蓋的畫面數)；連線結束時回傳 None"""
+        while True:
+            if self._closed:
+                return None
+            if self._frame is not None:
+                seq, data = self._frame
+                dropped = self._pending_dropped
+                self._frame = None
+                self._pending_dropped = 0
+                return seq, data, dropped
+            self._event.clear()
+            await self._event.wait()
+
+
+def compact_detections(detections):
+    """偵測結果 -> [[class_id, confidence, x0, y0, x1, y1], ...]"""
+    return [[det['class_id'], det['confidence'], *det['bbox']] for det in detections]
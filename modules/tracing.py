@@ -0,0 +1,94 @@
+"""
+OpenTelemetry 分散式追蹤
+每個請求建立根 span，偵測流程各階段、SQL 查詢與儲存上傳建立子 span；
+匯出器由環境變數 TRACING_EXPORTER 決定（none / console / file / otlp），
+未安裝 opentelemetry 或未啟用時 start_span 不做任何事；OpenTelemetry 只在啟用追蹤時才匯入
+"""
+import os
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "pill-detection-api"
+
+_tracer = None
+_trace_file = None
+
+
+def configure_tracing(exporter=None, file_path=None):
+    """
+    依設定建立 TracerProvider，回傳是否啟用追蹤
+    - console: 輸出到標準輸出
+    - file: 以 JSON 輸出到 TRACING_FILE（預設 traces.jsonl），方便測試時檢查
+    - otlp: 以 OTLP/HTTP 匯出（端點使用 OTEL_EXPORTER_OTLP_ENDPOINT 等標準環境變數）
+    """
+    global _tracer, _trace_file
+    exporter = (exporter or os.environ.get("TRACING_EXPORTER", "none")).lower()
+    if exporter == "none":
+        return False
+    # 嘗試導入 OpenTelemetry，如果失敗則停用追蹤
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SimpleSpanProcessor
+    except ImportError:
+        logger.warning("[調試] 已設定 TRACING_EXPORTER 但未安裝 opentelemetry-sdk，停用追蹤")
+        return False
+
+    provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+    if exporter == "console":
+        provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
+    elif exporter == "file":
+        file_path = file_path or os.environ.get("TRACING_FILE", "traces.jsonl")
+        _trace_file = open(file_path, "a", encoding="utf-8")
+        provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter(
+            out=_trace_file,
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )))
+    elif exporter == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.warning("[調試] 未安裝 opentelemetry-exporter-otlp，停用追蹤")
+            return False
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    else:
+        logger.warning(f"[調試] 未知的 TRACING_EXPORTER: {exporter}，停用追蹤")
+        return False
+
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer(SERVICE_NAME)
+    logger.info(f"OpenTelemetry 追蹤已啟用 (exporter={exporter})")
+    return True
+
+
+def tracing_enabled():
+    return _tracer is not None
+
+
+@contextmanager
+def start_span(name, **attributes):
+    """建立子 span（自動成為目前 span 的子節點）；未啟用追蹤時不做任何事"""
+    if _tracer is None:
+        yield None
+        return
+    attributes = {key: value for key, value in attributes.items() if value is not None}
+    with _tracer.start_as_current_span(name, attributes=attributes) as span:
+        yield span
+
+
+def shutdown_tracing():
+    """送出尚未匯出的 span 並關閉檔案"""
+    global _tracer, _trace_file
+    if _tracer is not None:
+        from opentelemetry import trace
+
+        provider = trace.get_tracer_provider()
+        if hasattr(provider, "shutdown"):
+            provider.shutdown()
+        _tracer = None
+    if _trace_file is not None:
+        _trace_file.close()
+        _trace_file = None
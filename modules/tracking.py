@@ -0,0 +1,113 @@
+"""
+跨畫面追蹤
+以 IoU 貪婪配對把連續畫面中的偵測框串成軌跡（同一顆藥丸），再把每條軌跡彙整成一筆偵測：
+類別取各畫面信心度加總最高者，框取信心度最高的那一格。藥盤在鏡頭下只會小幅移動，
+IoU 配對就足夠，不需要外觀特徵或運動模型
+"""
+import numpy as np
+
+DEFAULT_IOU_THRESHOLD = 0.3
+# 軌跡連續幾個處理過的畫面沒有配對到就結束
+DEFAULT_MAX_MISSES = 2
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """計算兩組 [x0, y0, x1, y1] 框之間的 IoU 矩陣 (len(a), len(b))"""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    inter_w = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    intersection = inter_w * inter_h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+class _Track:
+    def __init__(self, track_id, frame_index, detection):
+        self.track_id = track_id
+        self.bbox = detection['bbox']
+        self.first_frame = frame_index
+        self.last_frame = frame_index
+        self.misses = 0
+        self.observations = []
+        self.add(frame_index, detection)
+
+    def add(self, frame_index, detection):
+        self.bbox = detection['bbox']
+        self.last_frame = frame_index
+        self.misses = 0
+        self.observations.append((frame_index, detection))
+
+    def summary(self):
+        """彙整成一筆偵測：類別依信心度加總投票，其餘欄位取該類別信心度最高的那一格"""
+        votes = {}
+        for _, det in self.observations:
+            votes[det['class_name']] = votes.get(det['class_name'], 0.0) + det['confidence']
+        class_name = max(votes, key=votes.get)
+        frame_index, best = max(
+            ((i, det) for i, det in self.observations if det['class_name'] == class_name),
+            key=lambda item: item[1]['confidence'],
+        )
+        consolidated = dict(best)
+        consolidated.update({
+            'track_id': self.track_id,
+            'frame_index': frame_index,
+            'frames_seen': len(self.observations),
+            'first_frame': self.first_frame,
+            'last_frame': self.last_frame,
+            'mean_confidence': round(sum(det['confidence'] for _, det in self.observations) / len(self.observations), 3),
+        })
+        return consolidated
+
+
+class IoUTracker:
+    """以 IoU 貪婪配對跨畫面追蹤偵測框（與類別無關，類別在彙整時投票決定）"""
+
+    def __init__(self, iou_threshold=DEFAULT_IOU_THRESHOLD, max_misses=DEFAULT_MAX_MISSES):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self._active = []
+        self._finished = []
+        self._next_id = 1
+
+    def update(self, frame_index, detections):
+        """加入一個畫面的偵測結果，回傳每個偵測對應的 track_id"""
+        track_ids = [None] * len(detections)
+        unmatched = set(range(len(detections)))
+        if self._active and detections:
+            ious = iou_matrix([t.bbox for t in self._active], [d['bbox'] for d in detections])
+            # 由 IoU 最高的配對開始，每條軌跡與每個偵測最多配對一次
+            for flat in np.argsort(ious, axis=None)[::-1]:
+                track_idx, det_idx = divmod(int(flat), ious.shape[1])
+                if ious[track_idx, det_idx] < self.iou_threshold:
+                    break
+                track = self._active[track_idx]
+                if det_idx not in unmatched or track.last_frame == frame_index:
+                    continue
+                track.add(frame_index, detections[det_idx])
+                track_ids[det_idx] = track.track_id
+                unmatched.discard(det_idx)
+
+        still_active = []
+        for track in self._active:
+            if track.last_frame != frame_index:
+                track.misses += 1
+            if track.misses > self.max_misses:
+                self._finished.append(track)
+            else:
+                still_active.append(track)
+        self._active = still_active
+
+        for det_idx in sorted(unmatched):
+            track = _Track(self._next_id, frame_index, detections[det_idx])
+            self._next_id += 1
+            self._active.append(track)
+            track_ids[det_idx] = track.track_id
+        return track_ids
+
+    def consolidate(self, min_frames=1):
+        """回傳所有軌跡的彙整偵測（依 track_id 排序），只保留至少出現在 min_frames 個畫面的軌跡"""
+        tracks = sorted(self._finished + self._active, key=lambda t: t.track_id)
+        return [t.summary() for t in tracks if len(t.observations) >= min_frames]
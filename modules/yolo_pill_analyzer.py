@@ -2,31 +2,56 @@ import os
 import time
 import uuid
 import logging
-from PIL import  ImageDraw, ImageFont
-from ultralytics import YOLO
-import re
+import threading
+import importlib.util
+import numpy as np
+from PIL import  ImageDraw
+from modules.drug_labels import make_display_label, strip_class_suffix, build_base_id_map
+from modules.metrics import stage_timer, record_cache, record_detections
+from modules.profiling import profile_inference
+from modules.tracing import start_span
+from modules.image_decode import image_size, to_pil
+from modules import startup_timing, label_renderer, image_encode, cascade, inference_params, cpu_topology
 # 配置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# 嘗試導入 Google Cloud Storage，如果失敗則跳過
+# 只檢查 Google Cloud Storage 是否已安裝，實際匯入延到第一次上傳（匯入本身需要數百毫秒）
 try:
-    from google.cloud import storage
-    GCS_AVAILABLE = True
-    logger.info("[調試] Google Cloud Storage 可用")
-except ImportError:
+    GCS_AVAILABLE = importlib.util.find_spec("google.cloud.storage") is not None
+except (ImportError, ValueError):
     GCS_AVAILABLE = False
+if GCS_AVAILABLE:
+    logger.info("[調試] Google Cloud Storage 可用")
+else:
     logger.info("[調試] Google Cloud Storage 不可用，將使用本地儲存")
 
+# ultralytics（連帶 torch）在第一次載入模型時才匯入，讓不需要模型的匯入（腳本、工具）保持輕量
+YOLO = None
+# 啟動時以空白圖片先推論一次，把 torch 與 predictor 的初始化成本移出第一個請求
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "1").lower() not in ("0", "false", "no", "off")
+WARMUP_IMAGE_SIZE = 640
+# 標註繪製方式：numpy（在陣列上畫框並貼上快取的標籤圖塊，預設）或 pil（原本的 ImageDraw 繪製）
+LABEL_RENDERER = os.environ.get("LABEL_RENDERER", "numpy").lower()
+# 影片 / 連拍批次推論時每批的圖片數
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "8"))
+
 # --- GCS 和模型設定 ---
 GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME")
 MODEL_PATHS = {"YOLOv12.pt": "models/YOLOv12.pt"}
 
 loaded_models = {}
+# 模型類別名稱 -> 移除後綴的基礎藥品ID（模型載入時預先計算）
+class_base_ids = {}
+# 模型名稱 -> 以類別索引排列的藥品資訊列表（模型載入或藥品目錄變更時重建）
+class_bindings = {}
 
 # 延遲初始化 GCS client（避免啟動時認證錯誤）
 client = None
 bucket = None
+_client_lock = threading.Lock()
+# 藥品目錄載入與模型載入可能在不同執行緒同時完成，重建綁定時需要序列化
+_bindings_lock = threading.Lock()
 
 # --- 全域顏色設定 ---
 COLORS = ["#FF6B6B", "#4ECDC4", "#45B7D1", "#F9A825", "#6A89CC", "#E84393", "#079992"]
@@ -35,6 +60,27 @@ def get_color_for_index(i):
     """根據索引回傳固定順序的顏色"""
     return COLORS[i % len(COLORS)]
 
+def _get_yolo_class():
+    """第一次使用時才匯入 ultralytics"""
+    global YOLO
+    if YOLO is None:
+        with startup_timing.phase("import_ultralytics"):
+            from ultralytics import YOLO as yolo_class
+        # torch 已隨 ultralytics 匯入；在推論執行緒中、第一次推論之前設定執行緒數
+        cpu_topology.configure_torch()
+        YOLO = yolo_class
+    return YOLO
+
+def _get_storage_client():
+    """第一次上傳時才匯入 google.cloud.storage 並建立 client，之後重複使用"""
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from google.cloud import storage
+                client = storage.Client()
+    return client
+
 def initialize_models():
     """在應用程式啟動時載入所有指定的 YOLO 模型。"""
     logger.info("YOLO Analyzer - 開始載入 YOLO 模型...")
@@ -44,15 +90,84 @@ def initialize_models():
             loaded_models[model_display_name] = None
             continue
         try:
-            loaded_models[model_display_name] = YOLO(model_file_path)
+            yolo_class = _get_yolo_class()
+            with startup_timing.phase(f"load_model:{model_display_name}"):
+                model = yolo_class(model_file_path)
+            loaded_models[model_display_name] = model
+            class_base_ids.update(build_base_id_map(model.names.values()))
             logger.info(f"成功載入模型: '{model_display_name}'")
         except Exception as e:
             logger.warning(f"警告: 載入模型 '{model_display_name}' 失敗: {e}")
             loaded_models[model_display_name] = None
     logger.info("YOLO Analyzer - 模型載入完成。")
 
+    # 建立類別與藥品目錄的綁定，並在目錄變更時自動重建
+    from db_cloud_sql import register_catalog_listener
+    register_catalog_listener(rebuild_class_bindings)
+    rebuild_class_bindings()
+
+    if MODEL_WARMUP:
+        warmup_models()
 
-def upload_file_to_gcs(local_file_path, bucket_name, object_name=None):
+
+def warmup_models():
+    """以空白圖片對每個模型推論一次（不計入請求指標），輸入格式與請求相同（BGR 陣列）"""
+    warmup_image = np.zeros((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8)
+    for model_name, model in loaded_models.items():
+        if model is None:
+            continue
+        try:
+            with startup_timing.phase(f"warmup:{model_name}"):
+                model.predict(source=warmup_image, conf=inference_params.DEFAULT_CONF, verbose=False)
+        except Exception as e:
+            logger.warning(f"模型 '{model_name}' 暖機失敗: {e}")
+
+
+def _catalog_match_key(drug_id):
+    """與 get_pills_details_by_ids 相同的比對規則：轉小寫並取前10碼"""
+    return drug_id.lower()[:10]
+
+
+def _bind_model_classes(model, drug_catalog):
+    """為單一模型建立 類別索引 -> 對應藥品資訊 的表格，無對應時為空 tuple"""
+    catalog_by_key = {}
+    for record in sorted(drug_catalog.values(), key=lambda r: r['drug_id']):
+        catalog_by_key.setdefault(_catalog_match_key(record['drug_id']), []).append(record)
+
+    table = [()] * (max(model.names) + 1 if model.names else 0)
+    for class_id, class_name in model.names.items():
+        records = catalog_by_key.get(_catalog_match_key(class_name))
+        if not records:
+            # 前10碼比對不到時，改用移除後綴的基礎ID比對
+            base_record = drug_catalog.get(class_base_ids.get(class_name) or strip_class_suffix(class_name))
+            records = [base_record] if base_record else []
+        table[class_id] = tuple(records)
+    return table
+
+
+def rebuild_class_bindings():
+    """依目前的藥品目錄重建所有已載入模型的類別綁定，並回報未對應的類別"""
+    from db_cloud_sql import drug_catalog
+
+    with _bindings_lock:
+        if not drug_catalog:
+            logger.info("藥品目錄為空，略過類別綁定，偵測時將改用資料庫查詢")
+            class_bindings.clear()
+            return
+
+        for model_name, model in list(loaded_models.items()):
+            if model is None:
+                continue
+            table = _bind_model_classes(model, drug_catalog)
+            class_bindings[model_name] = table
+            unmapped = [model.names[i] for i, records in enumerate(table) if i in model.names and not records]
+            if unmapped:
+                logger.warning(f"模型 '{model_name}' 有 {len(unmapped)} 個類別在藥品目錄中找不到對應: {unmapped}")
+            else:
+                logger.info(f"模型 '{model_name}' 的 {len(model.names)} 個類別皆已對應到藥品目錄")
+
+
+def upload_file_to_gcs(local_file_path, bucket_name, object_name=None, content_type=None):
     """將本地檔案上傳到 Google Cloud Storage 儲存桶，並回傳 V4 Signed URL。"""
     if not GCS_AVAILABLE:
         logger.info("[調試] GCS 不可用，跳過上傳")
@@ -62,12 +177,13 @@ def upload_file_to_gcs(local_file_path, bucket_name, object_name=None):
         object_name = os.path.basename(local_file_path)
 
     try:
-        storage_client = storage.Client()
+        storage_client = _get_storage_client()
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(object_name)
         
         # 上傳文件
-        blob.upload_from_filename(local_file_path)
+        with start_span("gcs.upload", **{"gcs.bucket": bucket_name, "gcs.object": object_name}):
+            blob.upload_from_filename(local_file_path, content_type=content_type)
         logger.info(f"[調試] 文件已上傳到 GCS: {bucket_name}/{object_name}")
         
         # 嘗試生成 V4 Signed URL，如果失敗則使用公開 URL
@@ -90,252 +206,147 @@ def upload_file_to_gcs(local_file_path, bucket_name, object_name=None):
         logger.error(f"GCS 上傳或 Signed URL 生成時發生錯誤: {e}")
         return None
 
-def _draw_custom_labels(base_image, detections, pills_info_from_db):
-    """【樣式優化 v4】精準對齊文字與背景 + 保證每個框顏色不重複"""
-
-    print("--- 開始建立中文標籤映射 ---")
-    print(f"原始藥品資訊 (pills_info_from_db): {pills_info_from_db}")
-
-    # 步驟 1: 建立從 drug_id (英文) 到中文名稱的映射字典。
+def _label_texts(detections, pills_info_from_db):
+    """依偵測結果取得每個框的中文顯示標籤（兩種繪製方式共用）"""
+    # 建立從 drug_id (英文) 到中文顯示標籤的映射字典（標籤已在載入目錄時預先計算）
     name_map = {}
     for pill in pills_info_from_db:
         drug_id = pill['drug_id']
-        drug_name_zh = pill.get('drug_name_zh', drug_id)
-        
-        # 使用正規表達式偵測數字以前的中文字
-        if drug_name_zh != drug_id:
-            # 移除引號，然後匹配中文字符直到遇到數字或括號
-            clean_name = drug_name_zh.replace('"', '').replace('"', '').replace('"', '')
-            match = re.match(r'^([^\d\(\uff08]*[\u4e00-\u9fff][^\d\(\uff08]*)', clean_name)
-            if match:
-                drug_name_zh = match.group(1).strip()
-        
-        name_map[drug_id] = drug_name_zh
-        print(f"  映射: drug_id='{drug_id}' -> 中文名稱='{drug_name_zh}' (是否有中文: {'是' if drug_name_zh != drug_id else '否'})")
-    print(f"最終中文標籤映射 (name_map): {name_map}")
-    print("--- 中文標籤映射建立完成 ---")
-    
-    # 額外調試：檢測到的藥品ID
-    print("\n=== 檢測到的藥品ID列表 ===")
-    for i, det in enumerate(detections):
-        print(f"檢測 {i+1}: '{det['class_name']}'")
-    print("=========================")
-    # 調試輸出
-    logger.info(f"[調試] 檢測到的藥品: {[det['class_name'] for det in detections]}")
-    logger.info(f"[調試] 資料庫藥品: {list(name_map.keys())}")
-    logger.info(f"[調試] 中文名稱映射: {name_map})")
-    # 步驟 2: 準備繪圖
-    editable_image = base_image.copy().convert("RGB")
-    draw = ImageDraw.Draw(editable_image)
-
-    # --- 測試：解決文字框重疊問題＆避免超出圖片邊緣 ---
-    # 最前面要多「from PIL import Image」
+        display_label = pill.get('display_label')
+        if display_label is None:
+            display_label = make_display_label(drug_id, pill.get('drug_name_zh'))
+        name_map[drug_id] = display_label
 
-    occupied_areas = []     # 用個List儲存已放置的文字框位置
+    logger.debug(f"[調試] 檢測到的藥品: {[det['class_name'] for det in detections]}")
+    logger.debug(f"[調試] 中文名稱映射: {name_map}")
 
-    image_width, image_height = editable_image.size
+    label_texts = []
+    for det in detections:
+        drug_id = det['class_name']
+        # 以預先計算的基礎ID（移除 _ 後綴）匹配資料庫中的藥品ID
+        base_drug_id = class_base_ids.get(drug_id)
+        if base_drug_id is None:
+            base_drug_id = strip_class_suffix(drug_id)
+        label_texts.append(name_map.get(det.get('drug_id')) or name_map.get(base_drug_id, drug_id))
+    return label_texts
 
-    def boxes_overlap(a, b):
-        """判斷兩個文字方塊是否重疊"""
-        ax0, ay0, ax1, ay1 = a
-        bx0, by0, bx1, by1 = b
-        return not (ax1 <= bx0 or ax0 >= bx1 or ay1 <= by0 or ay0 >= by1)
-    
-    # 步驟 3: 載入支援中文的字型檔 (改進版)
-    font_size = max(25, int(base_image.width / 25))
-    font = None
-    
-    # 字型檔案優先順序列表
-    font_paths = [
-        "fonts/jf-openhuninn-2.1.ttf",           # 主要字型
-        "fonts/NotoSansCJK-Regular.ttc",         # Google Noto 備用
-        "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",  # 系統 Noto
-        "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",           # 系統文泉驛
-        "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",         # 系統文泉驛微米黑
-    ]
-    
-    for font_path in font_paths:
-        try:
-            if os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, font_size)
-                logger.info(f"✅ 成功載入字型: {font_path}")
-                break
-        except Exception as e:
-            logger.debug(f"字型載入失敗 {font_path}: {str(e)}")
-            continue
-    
-    if font is None:
-        logger.warning("⚠️ 所有中文字型載入失敗，使用預設字型 (中文可能無法正確顯示)")
-        font = ImageFont.load_default()
+def _draw_custom_labels(base_image, detections, pills_info_from_db):
+    """【樣式優化 v4】精準對齊文字與背景 + 保證每個框顏色不重複（PIL 版，回傳 PIL 圖片）"""
+    label_texts = _label_texts(detections, pills_info_from_db)
 
-    # --- 使用全域顏色函數 ---
+    # 在新的 RGB 圖片上繪製（BGR 陣列在這裡才轉成 PIL；convert 本身就會產生新圖片，不需要先 copy）
+    editable_image = to_pil(base_image)
+    draw = ImageDraw.Draw(editable_image)
+    image_width, image_height = editable_image.size
+    occupied_areas = []     # 用個List儲存已放置的文字框位置
+    base_font_size = label_renderer.label_font_size(image_width)
 
-    # --- 繪圖 ---
-    for i, det in enumerate(detections):
+    for i, (det, label_text) in enumerate(zip(detections, label_texts)):
         bbox = det['bbox']      # [x0, y0, x1, y1]
-        drug_id = det['class_name']
-        
-        # 使用正規表達式移除各種後綴來匹配資料庫中的藥品ID
-        base_drug_id = drug_id
-        # 匹配並移除 _ 後面的所有內容
-        pattern = r'_.*$'
-        match = re.search(pattern, drug_id)
-        if match:
-            base_drug_id = re.sub(pattern, '', drug_id)
-
-            print(f"    後綴處理: '{drug_id}' -> '{base_drug_id}' (移除後綴: '{match.group(0)}')")
-        
-        label_text = name_map.get(base_drug_id, drug_id)
-        
-        # 詳細的匹配調試
-        print(f"\n--- 藥品 {i+1} 標籤匹配過程 ---")
-        print(f"原始檢測ID: '{drug_id}'")
-        print(f"處理後基礎ID: '{base_drug_id}'")
-        print(f"在映射字典中查找: {base_drug_id in name_map}")
-        if base_drug_id in name_map:
-            print(f"找到匹配! 中文名稱: '{name_map[base_drug_id]}'")
-        else:
-            print(f"未找到匹配，使用原ID: '{drug_id}'")
-            print(f"可用的映射鍵: {list(name_map.keys())}")
-        print(f"最終標籤文字: '{label_text}'")
-        print(f"顯示類型: {'中文標籤' if label_text != drug_id and label_text != base_drug_id else '英文ID'}")
-        print("--------------------------------")
-        
-        logger.info(f"[調試] 檢測藥品: {drug_id} -> 基礎ID: {base_drug_id} -> 中文標籤: {label_text}")
         box_color = get_color_for_index(i)
-        text_color = "#000000"
-        bg_color = box_color
 
         # 繪製矩形框
-        draw.rectangle(bbox, outline=box_color, width=4)
-
-        # 1. 定義水平和垂直的 padding
-        h_padding = 5
-        v_padding = 3
-        # 2. 取得文字的精確尺寸
-        if hasattr(draw, 'textbbox'):
-            text_bbox = draw.textbbox((0, 0), label_text, font=font)
-            text_width = text_bbox[2] - text_bbox[0]
-            text_height = text_bbox[3] - text_bbox[1]
-        else:
-            text_width, text_height = draw.textsize(label_text, font=font)
-        
-        # 3. 確保文字框不會超出圖片邊界
-        max_text_width = image_width - 2 * h_padding
-        if text_width > max_text_width:
-            # 如果文字太長，縮小字型
-            scale_factor = max_text_width / text_width
-            new_font_size = max(12, int(font_size * scale_factor))
-            try:
-                if hasattr(font, 'path'):
-                    font = ImageFont.truetype(font.path, new_font_size)
-                else:
-                    font = ImageFont.load_default()
-                # 重新計算文字尺寸
-                if hasattr(draw, 'textbbox'):
-                    text_bbox = draw.textbbox((0, 0), label_text, font=font)
-                    text_width = text_bbox[2] - text_bbox[0]
-                    text_height = text_bbox[3] - text_bbox[1]
-                else:
-                    text_width, text_height = draw.textsize(label_text, font=font)
-            except:
-                # 如果字型調整失敗，使用預設字型
-                font = ImageFont.load_default()
-                if hasattr(draw, 'textbbox'):
-                    text_bbox = draw.textbbox((0, 0), label_text, font=font)
-                    text_width = text_bbox[2] - text_bbox[0]
-                    text_height = text_bbox[3] - text_bbox[1]
-                else:
-                    text_width, text_height = draw.textsize(label_text, font=font)
-
-        # 候選位置：優先靠近檢測框的位置
-        candidate_offsets = [
-            (bbox[0], bbox[1] - (text_height + 2 * v_padding)),  # 上方緊貼
-            (bbox[0], bbox[3] + 2),                              # 下方緊貼
-            (bbox[2] - (text_width + 2 * h_padding), bbox[1] - (text_height + 2 * v_padding)), # 右上
-            (bbox[2] - (text_width + 2 * h_padding), bbox[3] + 2), # 右下
-            (bbox[0] - (text_width + 2 * h_padding), bbox[1]),     # 左側
-            (bbox[2] + 2, bbox[1]),                                # 右側
-        ]
-
-        # 縮小搜索範圍，讓標籤更接近檢測框
-        max_offset = min(30, text_width // 2)  # 最大偏移距離限制為30像素或文字寬度的一半
-        step_size = 8  # 增大步長，減少計算量
-        candidates = []
-
-        for base_x, base_y in candidate_offsets:
-            # 每個基礎位置嘗試少量偏移
-            for offset_x in range(0, max_offset, step_size):
-                for direction in [1, -1]:  # 向右和向左
-                    tx0 = base_x + (offset_x * direction)
-                    ty0 = base_y
-                    tx1 = tx0 + text_width + 2 * h_padding
-                    ty1 = ty0 + text_height + 2 * v_padding
-
-                    # 確保文字框完全在圖片邊界內
-                    if tx0 < 0 or ty0 < 0 or tx1 > image_width or ty1 > image_height:
-                        continue
-
-                    label_box = (tx0, ty0, tx1, ty1)
-
-                    if not any(boxes_overlap(label_box, occ) for occ in occupied_areas):
-                        # 計算距離檢測框的距離，越近越好
-                        center_x = bbox[0] + (bbox[2] - bbox[0]) // 2
-                        center_y = bbox[1] + (bbox[3] - bbox[1]) // 2
-                        label_center_x = tx0 + (text_width + 2 * h_padding) // 2
-                        label_center_y = ty0 + (text_height + 2 * v_padding) // 2
-                        distance = ((center_x - label_center_x) ** 2 + (center_y - label_center_y) ** 2) ** 0.5
-                        
-                        # 優先級：上方 > 下方 > 左右側 > 其他
-                        position_priority = 0
-                        if ty1 <= bbox[1] + 5:  # 上方（允許小量重疊）
-                            position_priority = 0
-                        elif ty0 >= bbox[3] - 5:  # 下方（允許小量重疊）
-                            position_priority = 1
-                        elif tx1 <= bbox[0] + 5 or tx0 >= bbox[2] - 5:  # 左右側
-                            position_priority = 2
-                        else:  # 其他位置
-                            position_priority = 3
-                        
-                        candidates.append({
-                            'box': label_box,
-                            'text_pos': (tx0 + h_padding, ty0 + v_padding),
-                            'score': (position_priority, distance)
-                        })
-
-        if candidates:
-            # 按照優先條件排序並選第一個（tuple 自然排序：False < True）
-            best = sorted(candidates, key=lambda c: c['score'])[0]
-            (bg_x0, bg_y0, bg_x1, bg_y1) = best['box']
-            text_x, text_y = best['text_pos']
-            occupied_areas.append((bg_x0, bg_y0, bg_x1, bg_y1))
-        else:
-            # 最壞情況的fallback: 強制放在圖片邊界內，避免超出
-            bg_x0 = max(0, min(bbox[0], image_width - (text_width + 2 * h_padding)))
-            bg_y0 = max(0, min(bbox[1] - (text_height + 2 * v_padding), image_height - (text_height + 2 * v_padding)))
-            bg_x1 = bg_x0 + text_width + (2 * h_padding)
-            bg_y1 = bg_y0 + text_height + (2 * v_padding)
-            
-            # 再次確保不超出邊界
-            if bg_x1 > image_width:
-                bg_x1 = image_width
-                bg_x0 = bg_x1 - (text_width + 2 * h_padding)
-            if bg_y1 > image_height:
-                bg_y1 = image_height
-                bg_y0 = bg_y1 - (text_height + 2 * v_padding)
-                
-            text_x = bg_x0 + h_padding
-            text_y = bg_y0 + v_padding
-            occupied_areas.append((bg_x0, bg_y0, bg_x1, bg_y1))
-        
-        # 繪製文字背景
-        draw.rectangle((bg_x0, bg_y0, bg_x1, bg_y1), fill=bg_color)
-        # 繪製文字
-        draw.text((text_x, text_y), label_text, fill=text_color, font=font)
+        draw.rectangle(bbox, outline=box_color, width=label_renderer.BOX_LINE_WIDTH)
+
+        # 文字太長時縮小字型，再找不與其他標籤重疊、不超出圖片的位置
+        font_size, text_width, text_height = label_renderer.fit_label_font(label_text, base_font_size, image_width)
+        bg_box = label_renderer.place_label(bbox, text_width, text_height, occupied_areas, image_width, image_height)
+
+        # 繪製文字背景與文字
+        draw.rectangle(bg_box, fill=box_color)
+        text_pos = (bg_box[0] + label_renderer.H_PADDING, bg_box[1] + label_renderer.V_PADDING)
+        draw.text(text_pos, label_text, fill=label_renderer.TEXT_COLOR,
+                  font=label_renderer.load_label_font(font_size))
     return editable_image
 
-def detect_pills(model_name, image_pil):
-    
+def _draw_labels_numpy(base_image, detections, pills_info_from_db):
+    """NumPy 版：在 BGR 陣列上畫框並貼上快取的標籤圖塊，回傳 BGR 陣列"""
+    if not isinstance(base_image, np.ndarray):
+        base_image = np.ascontiguousarray(np.asarray(base_image.convert("RGB"))[:, :, ::-1])
+    label_texts = _label_texts(detections, pills_info_from_db)
+    colors = [get_color_for_index(i) for i in range(len(detections))]
+    return label_renderer.render_labels(base_image, detections, label_texts, colors)
+
+def draw_annotations(base_image, detections, pills_info_from_db, renderer=None):
+    """依 LABEL_RENDERER 選擇繪製方式；numpy 版回傳 BGR 陣列，pil 版回傳 PIL 圖片"""
+    if (renderer or LABEL_RENDERER) == "pil":
+        return _draw_custom_labels(base_image, detections, pills_info_from_db)
+    return _draw_labels_numpy(base_image, detections, pills_info_from_db)
+
+def render_annotated_variants(base_image, detections, pills_info_from_db, options):
+    """
+    依輸出選項在目標解析度上繪製標註圖片，回傳 [(variant, 圖片)]：full 以及（有指定時）thumbnail
+    先把原圖縮到目標尺寸、換算偵測框，再繪製標籤；縮圖從上一個縮小後的原圖再縮，不必再處理全解析度
+    """
+    original_size = image_size(base_image)
+    variants = [("full", options['max_dimension'])]
+    if options['thumbnail_size']:
+        variants.append(("thumbnail", options['thumbnail_size']))
+
+    rendered = []
+    source = base_image
+    for variant, max_dimension in variants:
+        size = image_encode.target_size(*original_size, max_dimension)
+        if size != image_size(source):
+            with stage_timer("image_resize"):
+                source = image_encode.resize(source, size)
+        scaled = image_encode.scale_detections(detections, original_size, size)
+        with stage_timer("draw_labels"):
+            rendered.append((variant, draw_annotations(source, scaled, pills_info_from_db)))
+    return rendered
+
+def _parse_boxes(model_object, bindings, xyxy, conf, cls, pills_info, seen_drug_ids):
+    """
+    將一張圖片的框座標、信心度與類別（NumPy 陣列）轉成偵測列表，對應的藥品資訊（不重複）加入 pills_info
+    陣列先整批轉成 Python 列表，不逐一索引 tensor
+    """
+    detections = []
+    class_ids = cls.astype(int).tolist()
+    # 遍歷所有檢測到的物件
+    for i, (class_id, confidence, box) in enumerate(zip(class_ids, conf.tolist(), xyxy.tolist())):
+        records = bindings[class_id] if bindings is not None and class_id < len(bindings) else ()
+        detections.append({
+            'class_name': model_object.names[class_id],  # 類別名稱
+            'class_id': class_id,
+            'drug_id': records[0]['drug_id'] if records else None,  # 對應的藥品ID
+            'confidence': round(confidence, 3),        # 信心度（四捨五入到三位小數）
+            'bbox': [round(coord) for coord in box],  # 邊界框座標
+            'color': get_color_for_index(i)  # 分配對應的顏色
+        })
+        for record in records:
+            if record['drug_id'] not in seen_drug_ids:
+                seen_drug_ids.add(record['drug_id'])
+                pills_info.append(record)
+
+    # 類別綁定的命中情況（藥品目錄快取）
+    if bindings is not None:
+        bound = sum(1 for det in detections if det['drug_id'] is not None)
+        record_cache("drug_catalog", hits=bound, misses=len(detections) - bound)
+    record_detections(len(detections))
+    return detections
+
+def _boxes_to_numpy(result):
+    """推論結果的框 -> (xyxy (N, 4), conf (N,), cls (N,)) NumPy 陣列，每個 tensor 只從裝置複製一次"""
+    boxes = result.boxes
+    return (boxes.xyxy.cpu().numpy().reshape(-1, 4), boxes.conf.cpu().numpy().reshape(-1),
+            boxes.cls.cpu().numpy().reshape(-1))
+
+def _parse_result(model_object, bindings, result, pills_info, seen_drug_ids):
+    """將一張圖片的推論結果轉成偵測列表"""
+    return _parse_boxes(model_object, bindings, *_boxes_to_numpy(result), pills_info, seen_drug_ids)
+
+def resolve_class_filter(model_name, classes):
+    """類別白名單（名稱或索引）-> 類別索引列表；模型沒有的類別拋出 ValueError"""
+    model = loaded_models.get(model_name)
+    if classes is None or model is None:
+        return None
+    return inference_params.resolve_classes(model.names, classes)
+
+def detect_pills(model_name, image, options=None):
+    """
+    image 可為 BGR NumPy 陣列（建議，模型不需再轉換）或 PIL 圖片
+    options 為推論參數（conf、iou、imgsz、max_det、classes），未指定的使用預設值
+    """
     # 記錄開始時間用於計算處理耗時
     start_time = time.time()
     
@@ -347,28 +358,24 @@ def detect_pills(model_name, image_pil):
     model_object = loaded_models[model_name]
     
     try:
-        # 使用 YOLO 模型進行預測，設定信心度閾值為 0.7
-        results = model_object.predict(source=image_pil, conf=0.7)
+        # 使用 YOLO 模型進行預測（預設信心度閾值為 0.7）
+        predict_kwargs = inference_params.resolve(options, image)
+        with stage_timer("predict"), profile_inference():
+            results = model_object.predict(source=image, **predict_kwargs)
         result = results[0]  # 取得第一張圖片的結果
         
-        # 初始化偵測結果列表
-        detections = []
-        
-        # 遍歷所有檢測到的物件
-        for i in range(len(result.boxes)):
-            detections.append({
-                'class_name': model_object.names[int(result.boxes.cls[i])],  # 類別名稱
-                'confidence': round(float(result.boxes.conf[i]), 3),        # 信心度（四捨五入到三位小數）
-                'bbox': [round(coord) for coord in result.boxes.xyxy[i].tolist()],  # 邊界框座標
-                'color': get_color_for_index(i)  # 分配對應的顏色
-            })
-        
+        # 模型載入時建立的類別綁定（藥品目錄未載入時為 None）
+        bindings = class_bindings.get(model_name)
+        pills_info = []
+        detections = _parse_result(model_object, bindings, result, pills_info, set())
+
         # 計算總耗時
         elapsed_time = round(time.time() - start_time, 2)
         
         # 返回完整的偵測結果
         return {
             'detections': detections, 
+            'pills_info': pills_info if bindings is not None else None,
             'elapsed_time': elapsed_time, 
             'model_name': model_name
         }
@@ -378,42 +385,171 @@ def detect_pills(model_name, image_pil):
         logger.error(f"模型 '{model_name}' 偵測時發生錯誤: {e}")
         return {'error': f'模型 "{model_name}" 偵測時內部錯誤'}
 
-def create_and_upload_annotated_image(base_image, detections, pills_info_from_db):
-    """【新函式】根據偵測結果和資料庫資訊，繪製中文標籤圖片並上傳至 GCS。"""
-    logger.debug(f"[調試] 傳遞給 _draw_custom_labels 的 detections: {detections}")
-    logger.debug(f"[調試] 傳遞給 _draw_custom_labels 的 pills_info_from_db: {pills_info_from_db}")
-    annotated_image_pil = _draw_custom_labels(base_image, detections, pills_info_from_db)
-    temp_dir = "temp_images"
-    os.makedirs(temp_dir, exist_ok=True)
-    local_filename = f"predicted_{uuid.uuid4().hex}.jpg"
-    local_filepath = os.path.join(temp_dir, local_filename)
-    gcs_object_name = f"predictions/{local_filename}"
+def detect_pills_batch(model_name, images, batch_size=None, options=None):
+    """
+    多張圖片（影片畫面或連拍）批次推論，每批最多 batch_size 張一起送進模型
+    回傳 {'frames': 與 images 對應的偵測列表, 'pills_info': 所有畫面的藥品資訊聯集, ...}
+    """
+    start_time = time.time()
+    if model_name not in loaded_models or loaded_models[model_name] is None:
+        return {'error': f"模型 '{model_name}' 未載入"}
+    model_object = loaded_models[model_name]
+    batch_size = batch_size or BATCH_SIZE
+    # imgsz="auto" 依每張圖片的解析度決定（批次工作的圖片尺寸不一），推論尺寸相同的圖片才一起推論；
+    # 連拍 / 影片的畫面尺寸相同，只有一組
+    groups = {}
+    for index, image in enumerate(images):
+        predict_kwargs = inference_params.resolve(options, image)
+        groups.setdefault(predict_kwargs['imgsz'], (predict_kwargs, []))[1].append(index)
+
     try:
-        annotated_image_pil.save(local_filepath)
-        logger.info(f"[調試] 標註圖片已保存到本地: {local_filepath}")
-        
-        # 檢查 GCS 配置和可用性
-        if not GCS_AVAILABLE or not GCS_BUCKET_NAME:
-            logger.info(f"[調試] GCS 不可用或未設定，使用本地路徑: {local_filepath}")
-            return local_filepath  # 返回本地路徑
-        
-        logger.info(f"[調試] 開始上傳到 GCS: {GCS_BUCKET_NAME}/{gcs_object_name}")
-        predict_image_url = upload_file_to_gcs(local_filepath, GCS_BUCKET_NAME, gcs_object_name)
-        
-        if predict_image_url:
-            logger.info(f"[調試] GCS 上傳成功，圖片 URL 已生成")
-            # 保留本地文件作為備份
-            return predict_image_url
-        else:
-            logger.warning(f"[調試] GCS 上傳失敗，返回本地路徑: {local_filepath}")
-            return local_filepath  # 返回本地路徑
-            
+        bindings = class_bindings.get(model_name)
+        frames = [None] * len(images)
+        pills_info = []
+        seen_drug_ids = set()
+        for predict_kwargs, indices in groups.values():
+            for offset in range(0, len(indices), batch_size):
+                chunk_indices = indices[offset:offset + batch_size]
+                # 以列表傳入時 ultralytics 會把整批圖片一起前處理並推論
+                with stage_timer("predict"), profile_inference():
+                    results = model_object.predict(source=[images[i] for i in chunk_indices], **predict_kwargs)
+                for index, result in zip(chunk_indices, results):
+                    frames[index] = _parse_result(model_object, bindings, result, pills_info, seen_drug_ids)
+
+        return {
+            'frames': frames,
+            'pills_info': pills_info if bindings is not None else None,
+            'elapsed_time': round(time.time() - start_time, 2),
+            'model_name': model_name
+        }
+
+    except Exception as e:
+        logger.error(f"模型 '{model_name}' 批次偵測時發生錯誤: {e}")
+        return {'error': f'模型 "{model_name}" 批次偵測時內部錯誤'}
+
+def detect_pills_cascade(model_name, image, options=None):
+    """
+    兩階段串接偵測：低解析度定位整張圖片，再把候選框從原圖裁下來整批辨識
+    image 需為 BGR NumPy 陣列，回傳格式與 detect_pills 相同；
+    options 的 conf 為最終門檻，iou、max_det、classes 套用在定位階段，imgsz 不適用（兩階段各有固定尺寸）
+    """
+    start_time = time.time()
+    if model_name not in loaded_models or loaded_models[model_name] is None:
+        return {'error': f"模型 '{model_name}' 未載入"}
+    model_object = loaded_models[model_name]
+    predict_kwargs = inference_params.resolve(options, image)
+    conf_threshold = predict_kwargs['conf']
+    candidate_conf = min(cascade.LOCATE_CONF, conf_threshold)
+    classes = predict_kwargs.get('classes')
+
+    try:
+        with stage_timer("cascade_locate"), profile_inference():
+            located = model_object.predict(
+                source=image, conf=candidate_conf, iou=predict_kwargs['iou'], max_det=predict_kwargs['max_det'],
+                classes=classes, imgsz=cascade.LOCATE_IMGSZ
+            )[0]
+        boxes, scores, classes_found = cascade.top_candidates(*_boxes_to_numpy(located))
+
+        if len(scores):
+            crops, offsets = cascade.crop_regions(image, boxes)
+            # 所有裁切一起送進模型，只推論一次
+            with stage_timer("cascade_refine"), profile_inference():
+                crop_results = model_object.predict(
+                    source=crops, conf=candidate_conf, classes=classes, imgsz=cascade.CROP_IMGSZ
+                )
+            boxes, scores, classes_found = cascade.refine(
+                boxes, scores, classes_found, [_boxes_to_numpy(r) for r in crop_results], offsets, conf_threshold
+            )
+
+        bindings = class_bindings.get(model_name)
+        pills_info = []
+        detections = _parse_boxes(model_object, bindings, boxes, scores, classes_found, pills_info, set())
+
+        return {
+            'detections': detections,
+            'pills_info': pills_info if bindings is not None else None,
+            'elapsed_time': round(time.time() - start_time, 2),
+            'model_name': model_name
+        }
+
+    except Exception as e:
+        logger.error(f"模型 '{model_name}' 串接偵測時發生錯誤: {e}")
+        return {'error': f'模型 "{model_name}" 串接偵測時內部錯誤'}
+
+def _store_annotated_image(local_filepath, gcs_object_name, content_type):
+    """上傳到 GCS；GCS 不可用或上傳失敗時回傳本地路徑"""
+    # 檢查 GCS 配置和可用性
+    if not GCS_AVAILABLE or not GCS_BUCKET_NAME:
+        logger.info(f"[調試] GCS 不可用或未設定，使用本地路徑: {local_filepath}")
+        return local_filepath  # 返回本地路徑
+
+    logger.info(f"[調試] 開始上傳到 GCS: {GCS_BUCKET_NAME}/{gcs_object_name}")
+    with stage_timer("gcs_upload"):
+        predict_image_url = upload_file_to_gcs(local_filepath, GCS_BUCKET_NAME, gcs_object_name,
+                                               content_type=content_type)
+
+    if predict_image_url:
+        logger.info(f"[調試] GCS 上傳成功，圖片 URL 已生成")
+        # 保留本地文件作為備份
+        return predict_image_url
+    logger.warning(f"[調試] GCS 上傳失敗，返回本地路徑: {local_filepath}")
+    return local_filepath  # 返回本地路徑
+
+def create_and_upload_annotated_images(base_image, detections, pills_info_from_db, output_options=None):
+    """
+    根據偵測結果和資料庫資訊繪製中文標籤圖片（依輸出選項決定格式、品質、尺寸與縮圖）並上傳至 GCS
+    回傳 {variant: {url, format, quality, width, height, bytes, encode_ms}}，失敗時回傳 None
+    """
+    logger.debug(f"[調試] 傳遞給 draw_annotations 的 detections: {detections}")
+    logger.debug(f"[調試] 傳遞給 draw_annotations 的 pills_info_from_db: {pills_info_from_db}")
+    try:
+        options = image_encode.resolve_options(output_options)
+        extension, content_type = image_encode.OUTPUT_FORMATS[options['format']]
+        temp_dir = "temp_images"
+        os.makedirs(temp_dir, exist_ok=True)
+        base_name = f"predicted_{uuid.uuid4().hex}"
+
+        outputs = {}
+        for variant, annotated_image in render_annotated_variants(base_image, detections, pills_info_from_db, options):
+            suffix = "" if variant == "full" else "_thumb"
+            local_filename = f"{base_name}{suffix}{extension}"
+            local_filepath = os.path.join(temp_dir, local_filename)
+            with stage_timer("image_encode"):
+                num_bytes, encode_seconds = image_encode.encode_to_file(
+                    annotated_image, local_filepath, options['format'], options['quality']
+                )
+            logger.info(f"[調試] 標註圖片已保存到本地: {local_filepath} ({num_bytes} bytes)")
+
+            info = image_encode.describe(annotated_image, options['format'], options['quality'],
+                                         num_bytes, encode_seconds)
+            info['url'] = _store_annotated_image(local_filepath, f"predictions/{local_filename}", content_type)
+            outputs[variant] = info
+        return outputs
+
     except Exception as e:
         logger.error(f"圖片繪製或上傳時發生錯誤: {e}")
         import traceback
         traceback.print_exc()
         return None
 
+def create_and_upload_annotated_image(base_image, detections, pills_info_from_db, output_options=None):
+    """【新函式】根據偵測結果和資料庫資訊，繪製中文標籤圖片並上傳至 GCS，回傳完整尺寸圖片的 URL。"""
+    outputs = create_and_upload_annotated_images(base_image, detections, pills_info_from_db, output_options)
+    return outputs['full']['url'] if outputs else None
+
 def get_available_models():
     """回傳已成功載入的模型名稱列表。"""
     return [name for name, model in loaded_models.items() if model is not None]
+
+def get_class_labels(model_name):
+    """回傳模型的 [類別名稱, 對應的藥品ID] 列表（索引即 class_id），模型未載入時回傳 None"""
+    model = loaded_models.get(model_name)
+    if model is None:
+        return None
+    bindings = class_bindings.get(model_name)
+    size = max(model.names) + 1 if model.names else 0
+    labels = []
+    for class_id in range(size):
+        records = bindings[class_id] if bindings is not None and class_id < len(bindings) else ()
+        labels.append([model.names.get(class_id), records[0]['drug_id'] if records else None])
+    return labels
@@ -15,7 +15,9 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/yourusername/pill-detection-api",
-    packages=find_packages(),
+    # fastapi_app 與 db_cloud_sql 是頂層模組，功能模組在 modules 套件中
+    py_modules=["fastapi_app", "db_cloud_sql"],
+    packages=find_packages(include=["modules", "modules.*"]),
     classifiers=[
         "Development Status :: 4 - Beta",
         "Intended Audience :: Healthcare Industry",
@@ -31,6 +33,7 @@ setup(
         "dev": [
             "pytest>=7.0.0",
             "pytest-asyncio>=0.21.0",
+            "pytest-benchmark>=4.0.0",
             "httpx>=0.24.0",
             "black>=23.0.0",
             "flake8>=6.0.0",
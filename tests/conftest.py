@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    """匯入 fastapi_app（不執行 startup 事件，不載入模型也不連線資料庫）"""
+    import fastapi_app
+    return fastapi_app
+
+
+@pytest.fixture
+def client(app_module):
+    from fastapi.testclient import TestClient
+    return TestClient(app_module.app)
+
+
+@pytest.fixture
+def models_ready(app_module, monkeypatch):
+    """讓偵測端點略過模型載入，直接走到圖片解碼"""
+    async def ensure_models_loaded():
+        return None
+
+    monkeypatch.setattr(app_module, "ensure_models_loaded", ensure_models_loaded)
+    monkeypatch.setattr(app_module, "models_loaded", True)
+    monkeypatch.setattr(app_module, "get_available_models", lambda: ["test.pt"])
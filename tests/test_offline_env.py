@@ -0,0 +1,75 @@
+"""離線基準測試環境端到端執行 /api/detect（假模型、SQLite 藥品目錄、本地儲存）"""
+import base64
+import os
+import sys
+
+import pytest
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+from offline_env import STUB_MODEL_NAME, make_pill_image, setup_offline_app  # noqa: E402
+
+
+@pytest.fixture
+def offline_app(app_module, monkeypatch, tmp_path):
+    """接上離線替代元件；測試結束後還原被替換的模組屬性與工作目錄"""
+    import db_cloud_sql
+    from modules import yolo_pill_analyzer
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db_cloud_sql, "db_pool", db_cloud_sql.db_pool)
+    for name in ("YOLO", "MODEL_PATHS", "GCS_AVAILABLE", "GCS_BUCKET_NAME", "upload_file_to_gcs"):
+        monkeypatch.setattr(yolo_pill_analyzer, name, getattr(yolo_pill_analyzer, name))
+    monkeypatch.setattr(app_module, "models_loaded", False)
+    monkeypatch.setattr(app_module, "loaded_models", {})
+
+    app_module, workdir = setup_offline_app(workdir=str(tmp_path / "bench"), inference_latency_s=0)
+    return app_module, workdir, yolo_pill_analyzer.upload_file_to_gcs.__self__
+
+
+def test_offline_detect_uploads_annotated_image(offline_app):
+    """標註圖片經由本地儲存上傳，回應帶回 file:// URL 並記錄 Content-Type"""
+    from fastapi.testclient import TestClient
+
+    app_module, workdir, storage = offline_app
+    image = base64.b64encode(make_pill_image(640, 480)).decode()
+    response = TestClient(app_module.app).post(
+        "/api/detect", json={"image": image, "model_name": STUB_MODEL_NAME}
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"] is True
+    url = body["annotated_image_url"]
+    assert url and url.startswith("file://")
+    assert os.path.isfile(url[len("file://"):])
+    assert url[len("file://"):].startswith(workdir)
+    assert list(storage.content_types.values()) == ["image/jpeg"]
+
+
+def test_offline_burst_pills_info_matches_consolidated_tracks(offline_app):
+    """連拍結果的藥品資訊只包含通過 min_frames 彙整的偵測，不含只出現在單一畫面的藥品"""
+    from fastapi.testclient import TestClient
+
+    app_module, _, _ = offline_app
+    # 尺寸不同的畫面：假模型的偵測框各不相同，跨畫面追蹤不到同一顆藥丸
+    files = [
+        ("files", (f"{i}.jpg", make_pill_image(width, height, seed=i), "image/jpeg"))
+        for i, (width, height) in enumerate(((640, 480), (1280, 960), (960, 720)))
+    ]
+    client = TestClient(app_module.app)
+
+    response = client.post("/api/detect/burst", files=files, params={"min_frames": 1, "dedup_threshold": 0})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["detections"] and body["pills_info"]
+    drug_ids = {det["drug_id"] for det in body["detections"] if det.get("drug_id")}
+    assert {info["drug_id"] for info in body["pills_info"]} == drug_ids
+
+    response = client.post("/api/detect/burst", files=files, params={"min_frames": 3, "dedup_threshold": 0})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["detections"] == []
+    assert body["pills_info"] == []
@@ -0,0 +1,90 @@
+"""請求本文大小與圖片像素數上限"""
+import base64
+import struct
+import zlib
+
+import pytest
+
+from modules import image_decode
+from modules.request_limits import MAX_REQUEST_BYTES
+
+
+def _png_header_only(width, height):
+    """只有檔頭宣告 width x height 的 PNG（像素資料只有幾個位元組，檔案很小）"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr)
+            + chunk(b"IDAT", zlib.compress(b"\x00" * 16)) + chunk(b"IEND", b""))
+
+
+@pytest.fixture
+def no_full_decode(monkeypatch):
+    """解碼器被呼叫時讓測試失敗（像素數檢查必須在解碼前拒絕）"""
+    def fail(*args, **kwargs):
+        raise AssertionError("不應該解碼超過像素上限的圖片")
+
+    monkeypatch.setattr(image_decode, "_decode_with_pil", fail)
+    if image_decode.CV2_AVAILABLE:
+        monkeypatch.setattr(image_decode.cv2, "imdecode", fail)
+
+
+def _assert_too_large(response):
+    assert response.status_code == 413
+    body = response.json()
+    assert body["success"] is False
+    assert "request_id" in body
+
+
+def test_declared_content_length_over_limit(client):
+    """Content-Length 超過上限時在讀取本文前就拒絕"""
+    response = client.post(
+        "/api/detect/simple",
+        content=b"{}",
+        headers={"Content-Type": "application/json", "Content-Length": str(MAX_REQUEST_BYTES + 1)},
+    )
+    _assert_too_large(response)
+
+
+def test_chunked_body_over_limit(client):
+    """沒有 Content-Length 的 chunked 本文在累計超過上限時中止"""
+    chunk = b"0" * (1024 * 1024)
+    chunks = MAX_REQUEST_BYTES // len(chunk) + 2
+
+    def body():
+        for _ in range(chunks):
+            yield chunk
+
+    response = client.post("/api/detect/simple", content=body(), headers={"Content-Type": "application/json"})
+    _assert_too_large(response)
+
+
+def test_base64_payload_over_limit(client):
+    """base64 膨脹後超過請求本文上限的圖片回傳 413"""
+    image = base64.b64encode(b"\xff" * (MAX_REQUEST_BYTES * 3 // 4 + 1024)).decode()
+    response = client.post("/api/detect/simple", json={"image": image})
+    _assert_too_large(response)
+
+
+@pytest.mark.parametrize("width, height", [(8000, 8000), (40000, 40000)])
+def test_check_image_size_rejects_pixel_bomb(width, height, no_full_decode):
+    """檔案很小但宣告巨大尺寸的圖片只讀檔頭就被拒絕（含 PIL 自己的解壓縮炸彈上限）"""
+    data = _png_header_only(width, height)
+    assert len(data) < 1024
+    with pytest.raises(image_decode.ImageTooLargeError):
+        image_decode.check_image_size(data, max_pixels=50_000_000)
+    with pytest.raises(image_decode.ImageTooLargeError):
+        image_decode.decode_to_array(data, max_pixels=50_000_000)
+
+
+def test_check_image_size_accepts_normal_image():
+    assert image_decode.check_image_size(_png_header_only(640, 480)) == (640, 480)
+
+
+def test_pixel_bomb_endpoint_returns_413(client, models_ready, no_full_decode, monkeypatch):
+    """偵測端點收到像素炸彈時回傳 413，不解碼也不推論"""
+    monkeypatch.setattr(image_decode, "MAX_IMAGE_PIXELS", 50_000_000)
+    image = base64.b64encode(_png_header_only(10000, 10000)).decode()
+    response = client.post("/api/detect/simple", json={"image": image})
+    _assert_too_large(response)